@@ -175,6 +175,8 @@ def start_collector_depth():
         print("===> Closing Loop")
         App.loop.close()
         App.sched.shutdown()
+        if App.analyzer.depth_writer is not None:
+            App.analyzer.depth_writer.close()  # Write buffered order books
 
     return 0
 
@@ -3,6 +3,7 @@ import sys
 import argparse
 import math, time
 from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
 import time
 
 import pandas as pd
@@ -14,9 +15,13 @@ from binance.client import Client
 from binance.websockets import BinanceSocketManager
 
 from common.utils import *
+from common.order_book import OrderBook
+from common.event_writer import EventWriter
 from service.App import *
 from service.analyzer import *
 
+import time  # Again because datetime.time is imported by the star imports
+
 import logging
 log = logging.getLogger('collector_ws')
 
@@ -58,7 +63,7 @@ def process_message(msg):
         print(f"Empty stream received. Message: {msg}")
         # TODO: Check what happens and maybe reconnect
         return
-    stream_symbol, stream_channel = tuple(stream.split("@"))
+    stream_symbol, stream_channel = tuple(stream.split("@", 1))  # Channel can have options like depth@100ms
 
     event = msg.get('data')
     if event is None:
@@ -83,8 +88,60 @@ def process_message(msg):
 
     #print(f"Event symbol: {event_symbol}, Event channel: {event_channel}")
 
-    # Submit a task to our main event queue
-    App.analyzer.queue.put(event)
+    if event.get("e") == "depthUpdate":
+        update_order_book(event)
+
+    # Submit the event to the writer thread
+    App.event_writer.put(event)
+
+
+snapshot_times = {}  # Last time a snapshot was requested for a symbol
+snapshot_requests = {}  # Snapshot requests (futures) which have not been applied yet
+snapshot_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")
+
+
+def update_order_book(event):
+    """
+    Apply a diff-depth event to the local order book of its symbol. A snapshot is requested if the book is out of sync.
+    The snapshot is requested in a worker thread so that the stream is not stopped. It is applied with the next event
+    so that the book is changed only in the stream thread.
+    """
+    symbol = event["s"]
+    book = App.order_books.get(symbol)
+    if book is None:
+        book = OrderBook(symbol)
+        App.order_books[symbol] = book
+
+    request = snapshot_requests.get(symbol)
+    if request is not None and request.done():
+        del snapshot_requests[symbol]
+        apply_snapshot(book, request)
+
+    book.update(event)
+    if book.synced or symbol in snapshot_requests:
+        return  # Event was applied or stale, or it is buffered till the requested snapshot
+
+    # Snapshots are requested not more often than once per second
+    now = time.monotonic()
+    if now - snapshot_times.get(symbol, 0.0) < 1.0:
+        return
+    snapshot_times[symbol] = now
+
+    limit = App.config["collector"]["stream"].get("snapshot_limit", 1000)
+    snapshot_requests[symbol] = snapshot_executor.submit(App.client.get_order_book, symbol=symbol, limit=limit)
+
+
+def apply_snapshot(book, request):
+    try:
+        snapshot = request.result()
+    except Exception as e:
+        print(f"Exception while requesting order book snapshot for {book.symbol}: {e}")
+        return
+
+    if book.apply_snapshot(snapshot):
+        print(f"Order book for {book.symbol} synchronized at update id {book.last_update_id}.")
+    else:
+        print(f"Order book snapshot for {book.symbol} does not continue the stream events. New snapshot will be requested.")
 
 
 def start_collector_ws():
@@ -97,6 +154,18 @@ def start_collector_ws():
 
     App.client = Client(api_key=App.config["api_key"], api_secret=App.config["api_secret"])
 
+    # Events are written to files in a separate thread
+    TRADE_DATA = "."  # TODO: We need to read it from the environment. It could be data dir or docker volume.
+    stream_config = App.config["collector"]["stream"]
+    App.event_writer = EventWriter(
+        Path(TRADE_DATA).joinpath(App.config["collector"]["folder"], stream_config["folder"]),
+        max_events=stream_config.get("max_events", 100_000),
+        overflow=stream_config.get("overflow", "block"),
+        flush_period=App.config["collector"]["flush_period"],
+        compression=stream_config.get("compression"),
+    )
+    App.event_writer.start()
+
     #
     # Register websocket listener
     #
@@ -163,15 +232,17 @@ def start_collector_ws():
         App.sched.shutdown()
     """
 
-    # Periodically call db-store
+    # Periodically check that events are received
     saving_period = App.config["collector"]["flush_period"]
+    last_received = 0
     try:
         while True:
             time.sleep(saving_period)
-            event_count = App.analyzer.queue.qsize()
+            stats = App.event_writer.stats()
+            event_count = stats["received"] - last_received
+            last_received = stats["received"]
             if event_count > 0:
-                print(f"Storing {event_count} events.")
-                App.analyzer.store_queue()
+                print(f"Received {event_count} events. Writer: {stats}")
             else:
                 # Reconnect
                 print(f"No incoming messages. Trying to reconnect.")
@@ -195,6 +266,9 @@ def start_collector_ws():
     if App.bm is not None:
         App.bm.close()
 
+    App.event_writer.close()  # Write the queued events
+    snapshot_executor.shutdown(wait=False)
+
     print(f"End collecting data using WebSocket streams.")
 
     return 0
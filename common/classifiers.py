@@ -1,28 +1,13 @@
 from typing import List
+import pickle
+import importlib
 
 import numpy as np
 import pandas as pd
 
-from sklearn.model_selection import train_test_split
-from sklearn import metrics
-from sklearn.model_selection import ParameterGrid
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
-from sklearn.metrics import f1_score
-
-from sklearn.linear_model import LogisticRegression, SGDClassifier
-from sklearn.svm import SVC
-
-import lightgbm as lgbm
-
-import tensorflow as tf
-from tensorflow import keras
-from keras.optimizers import *
-from keras.models import Sequential
-from keras.layers import Dense, Dropout
-from keras.regularizers import *
-from keras.callbacks import *
+# Libraries of the algorithms (lightgbm, tensorflow, sklearn) are imported in the functions which use them.
+# Importing them takes seconds and hundreds of MB, and a process needs only the libraries of its algorithms
+# (the server can predict with exported trees and networks without any of them)
 
 #
 # GB
@@ -56,6 +41,7 @@ def train_gb(df_X, df_y, model_config: dict):
     #
     is_scale = model_config.get("train", {}).get("is_scale", False)
     if is_scale:
+        from sklearn.preprocessing import StandardScaler
         scaler = StandardScaler()
         scaler.fit(df_X)
         X_train = scaler.transform(df_X)
@@ -109,6 +95,7 @@ def train_gb(df_X, df_y, model_config: dict):
         'verbose': 0,
     }
 
+    import lightgbm as lgbm
     model = lgbm.train(
         lgbm_params,
         train_set=lgbm.Dataset(X_train, y_train),
@@ -140,6 +127,15 @@ def predict_gb(models: tuple, df_X_test, model_config: dict):
     is_scale = scaler is not None
 
     input_index = df_X_test.index
+
+    if isinstance(models[0], TreeEnsemble):
+        # Rows are scored directly from an array without intermediate data frames
+        X = scaler.transform(df_X_test) if is_scale else df_X_test.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(X).any(axis=1)
+        y_hat = np.full(len(X), np.nan)
+        y_hat[valid] = models[0].predict(X[valid])
+        return pd.Series(data=y_hat, index=input_index, name="y_hat")
+
     if is_scale:
         df_X_test = scaler.transform(df_X_test)
         df_X_test = pd.DataFrame(data=df_X_test, index=input_index)
@@ -159,6 +155,143 @@ def predict_gb(models: tuple, df_X_test, model_config: dict):
     return sr_ret
 
 
+class TreeEnsemble:
+    """
+    Trees of a trained LightGBM booster flattened into node arrays. All trees are evaluated at once for a batch of rows
+    by walking from the roots to the leaves, which is much faster than Booster.predict for few rows.
+    The booster remains the reference: the predictions are the same for models with numeric splits.
+
+    Leaves point to themselves so that all walks can continue till the maximum depth.
+    """
+
+    # Transformations of the sum of leaf values to the output for supported objectives
+    objectives = {
+        "binary": lambda raw, sigmoid: 1.0 / (1.0 + np.exp(-sigmoid * raw)),
+        "cross_entropy": lambda raw, sigmoid: 1.0 / (1.0 + np.exp(-raw)),
+        "regression": lambda raw, sigmoid: raw,
+    }
+
+    def __init__(self, feature, threshold, left, right, value, default_left, missing_type, roots, depth: int, objective: str, sigmoid: float = 1.0):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.missing_type = np.asarray(missing_type, dtype=np.int8)  # 0 - None, 1 - Zero, 2 - NaN
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.depth = int(depth)
+        self.objective = objective
+        self.sigmoid = float(sigmoid)
+        self._stumps = None  # Lookup tables for trees with one split (computed on first use)
+
+    @classmethod
+    def from_lightgbm(cls, booster):
+        """Flatten a booster. Return None if it has categorical splits, several classes or an unsupported objective."""
+        dump = booster.dump_model()
+        objective, *objective_params = dump.get("objective", "").split(" ")
+        objective = {"xentropy": "cross_entropy", "regression_l2": "regression"}.get(objective, objective)
+        if objective not in cls.objectives or dump.get("num_class") != 1 or dump.get("average_output"):
+            return None
+        sigmoid = float(dict(p.split(":") for p in objective_params if ":" in p).get("sigmoid", 1.0))
+
+        nodes = {name: [] for name in ("feature", "threshold", "left", "right", "value", "default_left", "missing_type")}
+        missing_types = {"None": 0, "Zero": 1, "NaN": 2}
+
+        def add(node) -> (int, int):
+            # Return the position of the node and the depth of its subtree
+            i = len(nodes["feature"])
+            if "leaf_value" in node:
+                for name, v in zip(nodes, (0, 0.0, i, i, node["leaf_value"], True, 0)):
+                    nodes[name].append(v)
+                return i, 0
+            if node.get("decision_type") != "<=":
+                raise ValueError("Categorical splits are not supported")
+            for name, v in zip(nodes, (node["split_feature"], node["threshold"], -1, -1, 0.0, node["default_left"], missing_types[node["missing_type"]])):
+                nodes[name].append(v)
+            nodes["left"][i], left_depth = add(node["left_child"])
+            nodes["right"][i], right_depth = add(node["right_child"])
+            return i, max(left_depth, right_depth) + 1
+
+        try:
+            roots, depths = zip(*[add(tree["tree_structure"]) for tree in dump["tree_info"]])
+        except ValueError:
+            return None
+
+        return cls(**nodes, roots=roots, depth=max(depths), objective=objective, sigmoid=sigmoid)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as arrays:
+            params = {name: arrays[name] for name in ("feature", "threshold", "left", "right", "value", "default_left", "missing_type", "roots")}
+            return cls(**params, depth=int(arrays["depth"]), objective=str(arrays["objective"]), sigmoid=float(arrays["sigmoid"]))
+
+    def save(self, file):
+        with open(file, "wb") as f:
+            np.savez(
+                f, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right, value=self.value,
+                default_left=self.default_left, missing_type=self.missing_type, roots=self.roots,
+                depth=self.depth, objective=self.objective, sigmoid=self.sigmoid,
+            )
+
+    def predict(self, X) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        values = X.ravel()
+
+        if self.depth <= 1 and not (self.missing_type == 1).any() and not np.isnan(values).any():
+            raw = self._predict_stumps(X)
+            with np.errstate(over="ignore"):
+                return self.objectives[self.objective](raw, self.sigmoid)
+
+        offsets = (np.arange(X.shape[0]) * X.shape[1])[:, None]  # Rows in the flat array
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)  # Current node of each tree for each row
+
+        # Missing values have to be checked only if they exist or zeros are treated as missing
+        check_missing = (self.missing_type == 1).any() or np.isnan(values).any()
+
+        for _ in range(self.depth):
+            x = values.take(offsets + self.feature.take(nodes))
+            go_left = x <= self.threshold.take(nodes)
+            if check_missing:
+                missing_type = self.missing_type.take(nodes)
+                nan = np.isnan(x)
+                x = np.where(nan & (missing_type != 2), 0.0, x)  # NaN is zero if it is not missing
+                missing = ((missing_type == 1) & (np.abs(x) <= 1e-35)) | ((missing_type == 2) & nan)
+                go_left = np.where(missing, self.default_left.take(nodes), x <= self.threshold.take(nodes))
+            nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+
+        raw = self.value.take(nodes).sum(axis=1)
+        with np.errstate(over="ignore"):
+            return self.objectives[self.objective](raw, self.sigmoid)
+
+    def _predict_stumps(self, X) -> np.ndarray:
+        """
+        Sum of trees with one split (stumps). The stumps of one feature are sorted by threshold so that
+        the sum of their values for a row is found by a binary search.
+        """
+        if self._stumps is None:
+            roots = self.roots
+            split = self.left[roots] != roots
+            left, right = self.value[self.left[roots]], self.value[self.right[roots]]
+            base = self.value[roots[~split]].sum() + right[split].sum()  # All rows go right
+            tables = []
+            for f in np.unique(self.feature[roots[split]]):
+                stumps = split & (self.feature[roots] == f)
+                order = np.argsort(self.threshold[roots][stumps], kind="stable")
+                thresholds = self.threshold[roots][stumps][order]
+                diffs = (left - right)[stumps][order]
+                # Change of the sum if a row goes left in this and all next stumps (with higher thresholds)
+                suffix_sums = np.append(np.cumsum(diffs[::-1])[::-1], 0.0)
+                tables.append((f, thresholds, suffix_sums))
+            self._stumps = (base, tables)
+
+        base, tables = self._stumps
+        raw = np.full(len(X), base)
+        for f, thresholds, suffix_sums in tables:
+            raw += suffix_sums[np.searchsorted(thresholds, X[:, f], side="left")]  # Row goes left if x <= threshold
+        return raw
+
+
 #
 # NN
 #
@@ -191,6 +324,7 @@ def train_nn(df_X, df_y, model_config: dict):
     #
     is_scale = model_config.get("train", {}).get("is_scale", True)
     if is_scale:
+        from sklearn.preprocessing import StandardScaler
         scaler = StandardScaler()
         scaler.fit(df_X)
         X_train = scaler.transform(df_X)
@@ -203,6 +337,12 @@ def train_nn(df_X, df_y, model_config: dict):
     #
     # Create model
     #
+    import tensorflow as tf
+    from keras.optimizers import Adam
+    from keras.models import Sequential
+    from keras.layers import Dense
+    from keras.callbacks import EarlyStopping
+
     params = model_config.get("params")
 
     n_features = X_train.shape[1]
@@ -296,9 +436,11 @@ def predict_nn(models: tuple, df_X_test, model_config: dict):
     df_X_test_nonans = df_X_test.dropna()  # Drop nans, possibly create gaps in index
     nonans_index = df_X_test_nonans.index
 
-    # Resets all (global) state generated by Keras
-    # Important if prediction is executed in a loop to avoid memory leak
-    tf.keras.backend.clear_session()
+    if not isinstance(models[0], NumpyNetwork):
+        # Resets all (global) state generated by Keras
+        # Important if prediction is executed in a loop to avoid memory leak
+        import tensorflow as tf
+        tf.keras.backend.clear_session()
 
     y_test_hat_nonans = models[0].predict_on_batch(df_X_test_nonans.values)  # NN returns matrix with one column as prediction
     y_test_hat_nonans = y_test_hat_nonans[:, 0]  # Or y_test_hat.flatten()
@@ -311,6 +453,63 @@ def predict_nn(models: tuple, df_X_test, model_config: dict):
     return sr_ret
 
 
+class NumpyNetwork:
+    """
+    Feed-forward network of dense layers evaluated with numpy. It is exported from a trained Keras model
+    and returns the same predictions (within float32 precision) without TensorFlow.
+    """
+
+    activations = {
+        "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+        "relu": lambda x: np.maximum(x, 0.0),
+        "tanh": np.tanh,
+        "linear": lambda x: x,
+    }
+
+    def __init__(self, kernels: list, biases: list, activations: list):
+        self.kernels = [np.asarray(k, dtype=np.float64) for k in kernels]
+        self.biases = [np.asarray(b, dtype=np.float64) for b in biases]
+        self.layer_activations = list(activations)
+
+    @classmethod
+    def from_keras(cls, model):
+        """Export the weights of a Keras model. Return None if the model has layers other than dense layers with supported activations."""
+        kernels, biases, activations = [], [], []
+        for layer in model.layers:
+            activation = getattr(getattr(layer, "activation", None), "__name__", None)
+            if type(layer).__name__ != "Dense" or activation not in cls.activations or not layer.use_bias:
+                return None
+            kernel, bias = layer.get_weights()
+            kernels.append(kernel)
+            biases.append(bias)
+            activations.append(activation)
+        return cls(kernels, biases, activations)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as arrays:
+            activations = [str(a) for a in arrays["activations"]]
+            kernels = [arrays[f"kernel_{i}"] for i in range(len(activations))]
+            biases = [arrays[f"bias_{i}"] for i in range(len(activations))]
+        return cls(kernels, biases, activations)
+
+    def save(self, file):
+        arrays = {"activations": np.array(self.layer_activations)}
+        for i, (kernel, bias) in enumerate(zip(self.kernels, self.biases)):
+            arrays[f"kernel_{i}"] = kernel
+            arrays[f"bias_{i}"] = bias
+        with open(file, "wb") as f:
+            np.savez(f, **arrays)
+
+    def predict_on_batch(self, X) -> np.ndarray:
+        """Output matrix (rows, outputs) like Keras predict_on_batch."""
+        y = np.asarray(X, dtype=np.float64)
+        for kernel, bias, activation in zip(self.kernels, self.biases, self.layer_activations):
+            with np.errstate(over="ignore"):  # Overflow in exp of sigmoid gives correct 0
+                y = self.activations[activation](y @ kernel + bias)
+        return y
+
+
 #
 # LC - Linear Classifier
 #
@@ -343,6 +542,7 @@ def train_lc(df_X, df_y, model_config: dict):
     #
     is_scale = model_config.get("train", {}).get("is_scale", True)
     if is_scale:
+        from sklearn.preprocessing import StandardScaler
         scaler = StandardScaler()
         scaler.fit(df_X)
         X_train = scaler.transform(df_X)
@@ -358,6 +558,7 @@ def train_lc(df_X, df_y, model_config: dict):
     args = model_config.get("params").copy()
     args["n_jobs"] = -1
     args["verbose"] = 0
+    from sklearn.linear_model import LogisticRegression
     model = LogisticRegression(**args)
 
     #
@@ -430,6 +631,7 @@ def train_svc(df_X, df_y, model_config: dict):
     # Prepare data
     #
     if is_scale:
+        from sklearn.preprocessing import StandardScaler
         scaler = StandardScaler()
         scaler.fit(df_X)
         X_train = scaler.transform(df_X)
@@ -444,6 +646,7 @@ def train_svc(df_X, df_y, model_config: dict):
     #
     args = model_config.get("params").copy()
     args['probability'] = True  # Required if we are going to use predict_proba()
+    from sklearn.svm import SVC
     model = SVC(**args)
 
     #
@@ -493,12 +696,215 @@ def predict_svc(models: tuple, df_X_test, model_config: dict):
     return sr_ret
 
 
+#
+# Algorithm backends
+#
+
+# Algorithm type ("algo" in the algorithm config) -> train and predict functions as 'module:function' names.
+# A backend module (and the libraries it imports) is loaded only when the algorithm is used
+algorithm_backends = {
+    "gb": ("common.classifiers:train_gb", "common.classifiers:predict_gb"),
+    "nn": ("common.classifiers:train_nn", "common.classifiers:predict_nn"),
+    "lc": ("common.classifiers:train_lc", "common.classifiers:predict_lc"),
+    "svc": ("common.classifiers:train_svc", "common.classifiers:predict_svc"),
+}
+
+
+def register_algorithm(algo_type: str, train, predict):
+    """Add an algorithm type. The functions are either function references or 'module:function' names."""
+    algorithm_backends[algo_type] = (train, predict)
+
+
+def get_algorithm_backend(algo_type: str) -> tuple:
+    """Train and predict functions of the algorithm type."""
+    backend = algorithm_backends.get(algo_type)
+    if backend is None:
+        raise ValueError(f"Unknown algorithm type '{algo_type}'. Check algorithm list.")
+    return tuple(_resolve_function(f) for f in backend)
+
+
+def train_predict(algo_type: str, df_X, df_y, df_X_test, model_config: dict):
+    """Train a model of the algorithm type and return its predictions for the test data."""
+    train, predict = get_algorithm_backend(algo_type)
+    model_pair = train(df_X, df_y, model_config)
+    return predict(model_pair, df_X_test, model_config)
+
+
+def _resolve_function(name):
+    if callable(name):
+        return name
+    module_name, function_name = name.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+#
+# Batch scoring
+#
+
+class ScoringPlan:
+    """
+    Scores of many models computed together for the same input rows.
+
+    Models with the same input transformation (shifts and scaler) are grouped so that the transformation
+    is computed once for each group. Linear models (logistic regression and linear SVC) of a group are evaluated
+    by one matrix multiplication. All scores are written into one preallocated array.
+    Rows with NaN in the transformed input get NaN scores like in the predict functions.
+    """
+
+    def __init__(self, columns: list, models: list, labels: list = None):
+        """
+        :param columns: input columns
+        :param models: list of (score column name, model pair, model config)
+        :param labels: label column of each model (optional)
+        """
+        self.columns = list(columns)
+        self.names = [name for name, model_pair, model_config in models]
+        self.labels = list(labels) if labels is not None else [None] * len(models)
+        self.groups = []
+
+        groups = {}
+        for i, (name, model_pair, model_config) in enumerate(models):
+            if model_pair is None:
+                raise ValueError(f"Model '{name}' not found in the model registry")
+            model, scaler = model_pair
+            shifts = tuple(model_config.get("train", {}).get("shifts") or ())
+            key = (shifts, None if scaler is None else pickle.dumps(scaler))  # Scalers fitted on the same data are equal
+            group = groups.get(key)
+            if group is None:
+                group = {"shifts": shifts, "scaler": scaler, "linear": [], "other": []}
+                groups[key] = group
+                self.groups.append(group)
+
+            model = _fast_model(model)
+            linear = _linear_model(model)
+            if linear is not None:
+                group["linear"].append((i, *linear))
+            else:
+                group["other"].append((i, model))
+
+        # Coefficients of all linear models of a group in one matrix
+        for group in self.groups:
+            linear = group.pop("linear")
+            group["linear_columns"] = np.array([l[0] for l in linear], dtype=np.int64)
+            group["weights"] = np.column_stack([l[1] for l in linear]) if linear else None
+            group["intercepts"] = np.array([l[2] for l in linear])
+            group["platt"] = [(j, l[3]) for j, l in enumerate(linear) if l[3] is not None]  # Linear SVC
+
+    def predict(self, df: pd.DataFrame) -> pd.DataFrame:
+        X = df[self.columns].to_numpy(dtype=np.float64)
+        scores = np.full((len(X), len(self.names)), np.nan)
+
+        for group in self.groups:
+            X_group = _transform(X, group["shifts"], group["scaler"])
+            valid = ~np.isnan(X_group).any(axis=1)
+            X_valid = X_group[valid]
+            if not len(X_valid):
+                continue
+
+            if group["weights"] is not None:
+                z = X_valid @ group["weights"] + group["intercepts"]
+                with np.errstate(over="ignore"):
+                    y = 1.0 / (1.0 + np.exp(-z))  # Logistic regression
+                for j, (A, B) in group["platt"]:
+                    y[:, j] = _svc_probability(z[:, j], A, B)
+                scores[np.ix_(valid, group["linear_columns"])] = y
+
+            for i, model in group["other"]:
+                scores[valid, i] = _predict_model(model, X_valid)
+
+        return pd.DataFrame(scores, index=df.index, columns=self.names)
+
+
+def _fast_model(model):
+    """Replace LightGBM boosters and Keras networks by their array versions if possible."""
+    if hasattr(model, "dump_model"):
+        return TreeEnsemble.from_lightgbm(model) or model
+    if hasattr(model, "layers"):
+        return NumpyNetwork.from_keras(model) or model
+    return model
+
+
+def _linear_model(model):
+    """Coefficients, intercept and Platt parameters (for SVC) of a binary linear model or None if it is not linear."""
+    if not type(model).__module__.startswith("sklearn."):
+        return None  # Do not import sklearn for other models
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.svm import SVC
+    if isinstance(model, LogisticRegression) and model.coef_.shape[0] == 1:
+        return model.coef_[0], model.intercept_[0], None
+    if isinstance(model, SVC) and model.kernel == "linear" and model.probability and len(model.classes_) == 2:
+        return model.coef_[0], model.intercept_[0], (model.probA_[0], model.probB_[0])
+    return None
+
+
+def _predict_model(model, X: np.ndarray) -> np.ndarray:
+    if isinstance(model, TreeEnsemble):
+        return model.predict(X)
+    if hasattr(model, "predict_proba"):
+        return model.predict_proba(X)[:, 1]
+    if hasattr(model, "predict_on_batch"):
+        return np.asarray(model.predict_on_batch(X))[:, 0]
+    return model.predict(X)
+
+
+def _transform(X: np.ndarray, shifts: tuple, scaler) -> np.ndarray:
+    """Shifted copies of the columns (like double_columns) and scaling."""
+    if shifts:
+        parts = [X]
+        for shift in shifts:
+            shifted = np.full_like(X, np.nan)
+            if shift < len(X):  # Otherwise all values are missing like in df.shift
+                shifted[shift:] = X[:len(X) - shift]
+            parts.append(shifted)
+        X = np.hstack(parts)
+    if scaler is None:
+        return X
+    from sklearn.preprocessing import StandardScaler  # Already imported by unpickling the scaler
+    if isinstance(scaler, StandardScaler):
+        # The same as transform but without checking feature names of a data frame
+        # Mean is computed also if it is not subtracted (with_mean=False)
+        if scaler.with_mean and scaler.mean_ is not None:
+            X = X - scaler.mean_
+        if scaler.with_std and scaler.scale_ is not None:
+            X = X / scaler.scale_
+        return X
+    return scaler.transform(X)
+
+
+def _svc_probability(decision: np.ndarray, A: float, B: float) -> np.ndarray:
+    """
+    Probability of the second class of a binary SVC like predict_proba: Platt scaling of the decision values
+    followed by the iterative pairwise coupling of libsvm (which does not give exactly the Platt probability).
+    """
+    min_prob = 1e-7
+    with np.errstate(over="ignore"):
+        r = np.clip(1.0 / (1.0 + np.exp(-decision * A + B)), min_prob, 1 - min_prob)  # Probability of the first class
+    Q = np.array([[(1 - r) ** 2, -(1 - r) * r], [-(1 - r) * r, r ** 2]])
+    p = np.full((2, len(r)), 0.5)
+    active = np.ones(len(r), dtype=bool)
+    for _ in range(100):
+        Qp = np.einsum("tjn,jn->tn", Q, p)
+        pQp = (p * Qp).sum(axis=0)
+        active &= np.abs(Qp - pQp).max(axis=0) >= 0.005 / 2  # Rows stop iterating independently
+        if not active.any():
+            break
+        for t in range(2):
+            diff = np.where(active, (pQp - Qp[t]) / Q[t, t], 0.0)
+            p[t] += diff
+            pQp = (pQp + diff * (diff * Q[t, t] + 2 * Qp[t])) / (1 + diff) / (1 + diff)
+            Qp = (Qp + diff * Q[t]) / (1 + diff)
+            p = p / (1 + diff)
+    return p[1]
+
+
 #
 # Utils
 #
 
 def compute_scores(y_true, y_hat):
     """Compute several scores and return them as dict."""
+    from sklearn import metrics
+
     y_true = y_true.astype(int)
     y_hat_class = np.where(y_hat.values > 0.5, 1, 0)
 
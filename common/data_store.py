@@ -0,0 +1,424 @@
+import io
+import os
+import shutil
+from pathlib import Path
+from typing import List, Union
+
+import pandas as pd
+
+"""
+Storage of time series data (klines, merged data, features, matrices etc.) in files.
+
+A file name with extension 'csv' or 'parquet' refers to one file with all rows.
+A file with extension 'arrow' is an uncompressed Arrow IPC file which is memory-mapped when loaded.
+Its numeric columns are not copied into memory so that large matrices can be sliced by rows and columns
+(e.g., for training) without materializing them. These columns are read-only.
+A name without extension refers to a data set, that is, a folder with Parquet files partitioned by month:
+
+    <name>/month=2024-01/part-0.parquet
+    <name>/month=2024-02/part-0.parquet
+
+The columns of a data set have the types of its first file. Reading a data set loads only the requested columns
+and only the partitions (and row groups) within the requested time range. New rows are appended
+by adding files (segments) to the partitions instead of rewriting the whole data. Segments are merged by compaction.
+New rows of a CSV file are appended to its end, and only its tail is read to find the overlapping rows.
+"""
+
+partition_column = "month"
+
+
+def is_dataset(path: Path) -> bool:
+    """Whether the path refers to a partitioned data set rather than one file."""
+    return Path(path).suffix == ""
+
+
+def source_path(folder: Path, name: str, data_format: str = "csv") -> Path:
+    """Path of a source data file (e.g., klines) stored in the specified format: 'csv', 'parquet' or 'dataset'."""
+    if data_format == "dataset":
+        return Path(folder) / name
+    return (Path(folder) / name).with_suffix("." + data_format)
+
+
+def data_exists(path: Path) -> bool:
+    path = Path(path)
+    return path.is_dir() if is_dataset(path) else path.is_file()
+
+
+def data_size(path: Path) -> int:
+    """Size of the file or all files of the data set in bytes."""
+    path = Path(path)
+    if not is_dataset(path):
+        return os.path.getsize(path)
+    return sum(f.stat().st_size for f in path.rglob("*.parquet"))
+
+
+def data_columns(path: Path) -> List[str]:
+    """Column names without loading the data."""
+    path = Path(path)
+    if path.suffix == ".csv":
+        return pd.read_csv(path, nrows=0).columns.to_list()
+    elif path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    elif path.suffix == ".arrow":
+        import pyarrow as pa
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_file(source).schema.names
+    return [name for name in _dataset(path).schema.names if name != partition_column]
+
+
+def load_data(path: Path, time_column: str, columns: List[str] = None, start=None, end=None, tail_rows: int = 0, nrows: int = None) -> pd.DataFrame:
+    """
+    Load rows with timestamps in [start, end) (if specified) and only the specified columns (if specified).
+    If the number of tail rows is specified then only these last rows are returned.
+    For data sets, the filters are applied while reading, and the rows are returned in the order of time.
+    """
+    path = Path(path)
+    if columns is not None and time_column not in columns:
+        columns = [time_column] + list(columns)
+
+    if path.suffix == ".csv" and tail_rows and not nrows:
+        df = _read_csv_tail(path, tail_rows, parse_dates=[time_column], date_format="ISO8601", usecols=columns)
+        if columns is not None:
+            df = df[columns]
+        df = _filter_time(df, time_column, start, end)
+    elif path.suffix == ".csv":
+        df = pd.read_csv(path, parse_dates=[time_column], date_format="ISO8601", nrows=nrows, usecols=columns)
+        if columns is not None:
+            df = df[columns]  # The order of columns as requested
+        df = _filter_time(df, time_column, start, end)
+    elif path.suffix == ".parquet":
+        df = pd.read_parquet(path, columns=columns)
+        if nrows:
+            df = df.iloc[:nrows]
+        df = _filter_time(df, time_column, start, end)
+    elif path.suffix == ".arrow":
+        df = _load_arrow(path, time_column, columns, start, end)
+        if nrows:
+            df = df.iloc[:nrows]
+    elif is_dataset(path):
+        df = _load_dataset(path, time_column, columns, start, end, tail_rows)
+        if nrows:
+            df = df.iloc[:nrows]
+    else:
+        raise ValueError(f"Unknown extension of the data file '{path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
+
+    if tail_rows:
+        df = df.iloc[-tail_rows:]
+
+    df.index = pd.RangeIndex(len(df))  # Unlike reset_index, it does not copy the data
+    return df
+
+
+def store_data(df: pd.DataFrame, path: Path, time_column: str, float_format: str = None):
+    """Write all rows replacing the existing data."""
+    path = Path(path)
+    if path.suffix == ".csv":
+        df.to_csv(path, index=False, float_format=float_format)
+    elif path.suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    elif path.suffix == ".arrow":
+        # The old file might be still mapped by a loaded data frame so a new file replaces it
+        tmp_path = path.with_name(path.name + ".tmp")
+        _write_arrow(df, tmp_path)
+        os.replace(tmp_path, path)
+    elif is_dataset(path):
+        # Write a new data set next to the old one and then replace it
+        tmp_path = path.with_name(path.name + ".tmp")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        _write_partitions(df, tmp_path, time_column, schema=None)
+        if path.exists():
+            shutil.rmtree(path)
+        tmp_path.rename(path)
+    else:
+        raise ValueError(f"Unknown extension of the data file '{path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
+
+
+def append_data(df: pd.DataFrame, path: Path, time_column: str, float_format: str = None):
+    """
+    Append rows to the data. Existing rows with the same or younger timestamps are replaced by the new rows.
+    Only the tail of a CSV file is read and rewritten. Only segments of a data set with replaced rows are rewritten
+    and the new rows are written to new segments. A parquet or arrow file is rewritten completely.
+    The new rows are converted to the types of the existing data.
+    """
+    path = Path(path)
+    if not data_exists(path):
+        return store_data(df, path, time_column, float_format=float_format)
+    if len(df) == 0:
+        return
+
+    columns = data_columns(path)
+    if set(columns) != set(df.columns):
+        raise ValueError(f"Columns of the appended data do not match the columns of {path}")
+    first_time = pd.Timestamp(df[time_column].iloc[0])
+
+    if path.suffix == ".csv":
+        _truncate_lines(path, _csv_rows_since(path, time_column, first_time, len(df)))
+        df[columns].to_csv(path, mode="a", header=False, index=False, float_format=float_format)
+    elif path.suffix in (".parquet", ".arrow"):
+        old_df = load_data(path, time_column)
+        old_df = old_df[pd.to_datetime(old_df[time_column]) < first_time]
+        store_data(pd.concat([old_df, df[columns]], ignore_index=True), path, time_column)
+    elif is_dataset(path):
+        _append_dataset(df, path, time_column, first_time)
+    else:
+        raise ValueError(f"Unknown extension of the data file '{path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
+
+
+def compact_data(path: Path, min_segments: int = 8) -> int:
+    """
+    Merge the segments of each partition of the data set having at least the specified number of segments into one file.
+    Return the number of merged partitions. It can be run in background (e.g., in a thread) between appends.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    if not is_dataset(path) or not data_exists(path):
+        return 0
+
+    merged = 0
+    for month in sorted(_partition_months(path)):
+        month_path = path / f"{partition_column}={month}"
+        files = _segments(month_path)
+        if len(files) < min_segments:
+            continue
+
+        # Segments are added in the order of time so they are concatenated in this order
+        table = pa.concat_tables([pq.read_table(f) for f in files])
+        tmp_file = month_path / "part-0.parquet.tmp"  # It is not read as part of the data set
+        pq.write_table(table, tmp_file)
+        for f in files:
+            f.unlink()
+        os.replace(tmp_file, month_path / "part-0.parquet")
+        merged += 1
+
+    return merged
+
+
+def _write_arrow(df: pd.DataFrame, file: Path):
+    import pyarrow as pa
+
+    arrays = []
+    for name in df.columns:
+        values = df[name]
+        if values.dtype.kind in "fiu":
+            # NaN are stored as values (not as nulls) so that the columns can be mapped without conversion
+            arrays.append(pa.array(values.to_numpy(), from_pandas=False))
+        else:
+            arrays.append(pa.array(values, from_pandas=True))
+    table = pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+
+    with pa.OSFile(str(file), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _load_arrow(path: Path, time_column: str, columns, start, end) -> pd.DataFrame:
+    import pyarrow as pa
+
+    with pa.memory_map(str(path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+
+    # Rows are sorted by time so the range is a slice of the table
+    if start is not None or end is not None:
+        times = pd.Series(table.column(time_column).to_pandas())
+        first = times.searchsorted(pd.Timestamp(start)) if start is not None else 0
+        last = times.searchsorted(pd.Timestamp(end)) if end is not None else len(times)
+        table = table.slice(first, max(0, last - first))
+
+    data = {}
+    for name, column in zip(table.column_names, table.columns):
+        numeric = pa.types.is_floating(column.type) or pa.types.is_integer(column.type)
+        if numeric and column.num_chunks == 1 and column.null_count == 0:
+            data[name] = column.chunk(0).to_numpy(zero_copy_only=True)  # View of the mapped file
+        else:
+            data[name] = column.to_pandas()
+    return pd.DataFrame(data, copy=False)
+
+
+def _dataset(path: Path):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    partitioning = ds.partitioning(pa.schema([(partition_column, pa.string())]), flavor="hive")
+    return ds.dataset(path, format="parquet", partitioning=partitioning)
+
+
+def _load_dataset(path: Path, time_column: str, columns, start, end, tail_rows):
+    import pyarrow.dataset as ds
+
+    dataset = _dataset(path)
+
+    if tail_rows:
+        # Partitions are counted from the latest one until they have enough rows. Then the start of the tail is found in them
+        months = sorted(_partition_months(path), reverse=True)
+        count = 0
+        for month in months:
+            count += dataset.count_rows(filter=ds.field(partition_column) == month)
+            if count >= tail_rows:
+                break
+        if count:
+            times = dataset.to_table(columns=[time_column], filter=ds.field(partition_column) >= month).column(0).to_pandas()
+            tail_start = times.sort_values().iloc[-min(tail_rows, len(times))]
+            start = tail_start if start is None else max(pd.Timestamp(start), tail_start)
+
+    condition = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        condition = _and(condition, (ds.field(partition_column) >= _month(start)) & (ds.field(time_column) >= start))
+    if end is not None:
+        end = pd.Timestamp(end)
+        condition = _and(condition, (ds.field(partition_column) <= _month(end)) & (ds.field(time_column) < end))
+
+    table = dataset.to_table(columns=columns or [c for c in dataset.schema.names if c != partition_column], filter=condition)
+    df = table.to_pandas()
+
+    if not df[time_column].is_monotonic_increasing:
+        df = df.sort_values(time_column, kind="stable")
+
+    return df
+
+
+def _partition_months(path: Path) -> List[str]:
+    return [p.name.split("=", 1)[1] for p in Path(path).glob(f"{partition_column}=*") if p.is_dir()]
+
+
+def _append_dataset(df: pd.DataFrame, path: Path, time_column: str, first_time):
+    import pyarrow as pa
+
+    dataset = _dataset(path)
+    schema = pa.schema([f for f in dataset.schema if f.name != partition_column])
+
+    months = _months(df[time_column])
+    for month in months.unique():
+        month_df = df[(months == month).to_numpy()]
+        month_path = path / f"{partition_column}={month}"
+        files = _segments(month_path)
+
+        # Segments with replaced rows are the last ones. Their remaining rows are written together with the new rows
+        replaced = [f for f in files if _max_time(f, time_column) >= first_time]
+        if replaced:
+            old_df = pd.concat([pd.read_parquet(f) for f in replaced], ignore_index=True)
+            old_df = old_df[old_df[time_column] < first_time]
+            month_df = pd.concat([old_df, month_df], ignore_index=True)
+
+        _write_partition(month_df, month_path / f"part-{_segment_number(files[-1]) + 1 if files else 0}.parquet", schema)
+        for f in replaced:
+            f.unlink()
+
+    # Rows of later partitions (if any) are deleted because they are replaced by the new rows
+    for month in _partition_months(path):
+        if month > months.iloc[-1]:
+            shutil.rmtree(path / f"{partition_column}={month}")
+
+
+def _segments(month_path: Path) -> List[Path]:
+    """Files of the partition in the order they have been added."""
+    return sorted(month_path.glob("part-*.parquet"), key=_segment_number)
+
+
+def _segment_number(file: Path) -> int:
+    return int(file.stem.split("-", 1)[1])
+
+
+def _write_partitions(df: pd.DataFrame, path: Path, time_column: str, schema):
+    months = _months(df[time_column])
+    for month in months.unique():
+        _write_partition(df[(months == month).to_numpy()], path / f"{partition_column}={month}" / "part-0.parquet", schema)
+
+
+def _write_partition(df: pd.DataFrame, file: Path, schema):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    file.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if schema is not None:
+        table = table.select(schema.names).cast(schema)
+    pq.write_table(table, file)
+
+
+def _max_time(file: Path, time_column: str):
+    """Maximum time of the file from its statistics (without reading the data if statistics are available)."""
+    import pyarrow.parquet as pq
+    metadata = pq.ParquetFile(file).metadata
+    i = metadata.schema.names.index(time_column)
+    statistics = [metadata.row_group(g).column(i).statistics for g in range(metadata.num_row_groups)]
+    if all(st is not None and st.has_min_max for st in statistics):
+        return max(pd.Timestamp(st.max) for st in statistics)
+    return pq.read_table(file, columns=[time_column]).column(0).to_pandas().max()
+
+
+def _months(times: pd.Series) -> pd.Series:
+    return pd.to_datetime(times).dt.strftime("%Y-%m")
+
+
+def _month(time) -> str:
+    return pd.Timestamp(time).strftime("%Y-%m")
+
+
+def _filter_time(df: pd.DataFrame, time_column: str, start, end) -> pd.DataFrame:
+    if start is not None:
+        df = df[df[time_column] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df[time_column] < pd.Timestamp(end)]
+    return df
+
+
+def _and(condition, other):
+    return other if condition is None else condition & other
+
+
+def _read_csv_tail(path: Path, rows: int, **kwargs) -> pd.DataFrame:
+    """Read the header and the specified number of last rows of a CSV file without reading the whole file."""
+    with open(path, "rb") as f:
+        header = f.readline()
+        data_start = f.tell()
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > data_start and tail.count(b"\n") <= rows:
+            size = min(1 << 16, pos - data_start)
+            pos -= size
+            f.seek(pos)
+            tail = f.read(size) + tail
+    lines = tail.splitlines(keepends=True)[-rows:]  # The first line might be incomplete
+    return pd.read_csv(io.BytesIO(header + b"".join(lines)), **kwargs)
+
+
+def _csv_rows_since(path: Path, time_column: str, time, rows: int) -> int:
+    """Number of last rows of a CSV file with the specified or younger timestamps."""
+    while True:
+        tail = _read_csv_tail(path, rows, usecols=[time_column])
+        times = pd.to_datetime(tail[time_column], format="ISO8601")
+        count = int((times >= time).sum())
+        if count < len(tail) or len(tail) < rows:  # An older row is found or the file has no more rows
+            return count
+        rows *= 2
+
+
+def _truncate_lines(path: Path, n: int, block_size: int = 1 << 16):
+    """Delete n last lines of a text file without reading the whole file."""
+    if n <= 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        newlines = 0
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            block = f.read(size)
+            # The last character is the newline of the last line
+            for i in range(len(block) - 1, -1, -1):
+                if block[i] == ord("\n") and pos + i < end - 1:
+                    newlines += 1
+                    if newlines == n:
+                        f.truncate(pos + i + 1)
+                        return
+        raise ValueError(f"File {path} has less than {n} lines")
@@ -33,18 +33,10 @@ def depth_to_df(depth: list):
     windows = [1, 2, 5, 10, 20]  # No of price bins for aggregate/smoothing
 
     #
-    # Generate a table with feature records
+    # Compute features for all records at once
     #
-    table = []
-    for entry in depth:
-        record = depth_to_features(entry, windows, bin_size)
-        table.append(record)
-
-    #
-    # Convert json table to data frame
-    #
-    df = pd.DataFrame.from_dict(table)
-    # Alternatively, from_records() or json_normalize()
+    timestamps, bids, asks = depth_arrays(depth)
+    df = depth_features_batch(timestamps, bids, asks, windows, bin_size)
 
     # Timestamp is an index
     df["timestamp"] = pd.to_datetime(df["timestamp"], unit='ms')
@@ -112,6 +104,79 @@ def depth_to_features(entry: list, windows: list, bin_size: float):
 
     return record
 
+def depth_arrays(depth: list):
+    """
+    Convert a list of order books (dicts with float bids and asks) into arrays of timestamps, bids and asks.
+    Bids and asks have shape (snapshots, levels, 2) where shorter order books are padded with NaN.
+    """
+    levels = max([max(len(e.get("bids")), len(e.get("asks"))) for e in depth], default=0)
+    timestamps = np.array([e.get("timestamp") for e in depth], dtype=np.int64)
+    bids = np.full((len(depth), levels, 2), np.nan)
+    asks = np.full((len(depth), levels, 2), np.nan)
+    for i, e in enumerate(depth):
+        b, a = np.asarray(e.get("bids"), dtype=np.float64), np.asarray(e.get("asks"), dtype=np.float64)
+        bids[i, :len(b)] = b
+        asks[i, :len(a)] = a
+    return timestamps, bids, asks
+
+
+def depth_features_batch(timestamps, bids: np.ndarray, asks: np.ndarray, windows: list, bin_size: float) -> pd.DataFrame:
+    """
+    Features of many order books computed at once. The result is the same as from depth_to_features for each order book.
+    Bids and asks are arrays of shape (snapshots, levels, 2) padded with NaN.
+    """
+    # Gap feature
+    gap = np.maximum(asks[:, 0, 0] - bids[:, 0, 0], 0.0)
+
+    # Price feature
+    price = bids[:, 0, 0] + (gap / 2)
+
+    # Densities for bids and asks (volume per price unit)
+    bid_densities = _batch_densities(bids, False, windows, bin_size)
+    ask_densities = _batch_densities(asks, True, windows, bin_size)
+
+    columns = {"timestamp": timestamps, "gap": gap, "price": price}
+    for i, length in enumerate(windows):
+        columns[f"bids_{length}"] = bid_densities[:, i]
+        columns[f"asks_{length}"] = ask_densities[:, i]
+
+    return pd.DataFrame(columns)
+
+
+def _batch_densities(side: np.ndarray, price_increase: bool, windows: list, bin_size: float) -> np.ndarray:
+    """Mean volumes of the first bins for all order books and windows like in mean_volumes. Only the bins needed for the windows are computed."""
+    prices, volumes = side[:, :, 0], side[:, :, 1]
+    n = len(prices)
+    rows = np.arange(n)[:, None]
+
+    # Distances from the first point increase for both sides. Padding is NaN
+    distances = prices - prices[:, :1] if price_increase else prices[:, :1] - prices
+    counts = np.sum(~np.isnan(prices), axis=1)
+    bin_counts = (distances[np.arange(n), counts - 1] // bin_size).astype(np.int64) + 1
+
+    # Area under the step function till each point
+    area = np.zeros_like(distances)
+    area[:, 1:] = np.cumsum(volumes[:, :-1] * np.diff(distances, axis=1), axis=1)
+
+    # Last point before each bin border (points are sorted by distance so it is the number of points till the border)
+    bins = max(windows)
+    borders = np.arange(bins + 1) * bin_size
+    ids = np.empty((n, bins + 1), dtype=np.int64)
+    for j, border in enumerate(borders):
+        ids[:, j] = np.sum(distances <= border, axis=1) - 1
+
+    border_area = area[rows, ids] + volumes[rows, ids] * (borders - distances[rows, ids])
+    bin_volumes = np.diff(border_area, axis=1) / bin_size
+
+    # Means of the existing bins for each window (NaNs are ignored like in nanmean)
+    valid = (np.arange(bins)[None, :] < bin_counts[:, None]) & ~np.isnan(bin_volumes)
+    sums = np.cumsum(np.where(valid, bin_volumes, 0.0), axis=1)
+    valid_counts = np.cumsum(valid, axis=1)
+    ends = np.minimum(np.asarray(windows)[None, :], bin_counts[:, None]) - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums[rows, ends] / valid_counts[rows, ends]
+
+
 #
 # Utils
 #
@@ -171,18 +236,17 @@ def depth_accumulate(depth: list, start, end):
 
 def discretize(side: str, depth: list, bin_size: float, start: float):
     """
-    Main problem: current point can contribute to this bin (till bin end) and next bin (from bin end till next point)
-    Iterate over bins. For each iteration, initial function value must be provided which works till first point or end
-      With each bin iteration, iterate over points (global pointer).
-      If point within this bin, the set current volume instead of initial, and compute contribution of the previous value
-      If point in next bin, then still use current volume for the next bin, compute contribution till end only. Do not iterate point (it is needed when starting next bin)
-        When we start next bin, compute contribution
-
-    :param side:
-    :param depth:
-    :param bin_size:
-    :param start:
-    :return:
+    Find (volume) area of each price bin given the step function volume(price) and divide it by the bin size.
+
+    The step function is represented by points (price, volume) where a volume is valid from its price till the next point.
+    The area till each point is computed by a cumulative sum, and the bin borders are located in the points
+    by a binary search. The area of a bin is the difference of the areas at its borders.
+
+    :param side: "ask" (prices in depth list increase) or "bid" (prices in depth list decrease)
+    :param depth: list of (price, volume) pairs or an array with two columns
+    :param bin_size: price interval of one bin
+    :param start: price of the first bin start (the first point if None)
+    :return: list of mean volumes of the bins
     """
     if side.startswith("ask") or side.startswith("sell"):
         price_increase = True
@@ -191,80 +255,35 @@ def discretize(side: str, depth: list, bin_size: float, start: float):
     else:
         print("Wrong use. Side is either bid or ask.")
 
+    depth = np.asarray(depth, dtype=np.float64)
+    prices, volumes = depth[:, 0], depth[:, 1]
+
     # Start is either explict or first point
     if start is None:
-        start = depth[0][0]  # First point
-
-    # End covers the last point
-    bin_count = int(abs(depth[-1][0] - start) // bin_size) + 1
-    all_bins_length = bin_count * bin_size
-    end = start + all_bins_length if price_increase else start - all_bins_length
-
-    bin_volumes = []
-    for b in range(bin_count):
-        bin_start = start + b*bin_size if price_increase else start - b*bin_size
-        bin_end = bin_start + bin_size if price_increase else bin_start - bin_size
-
-        # Find point ids within this bin
-        if price_increase:
-            bin_point_ids = [i for i, x in enumerate(depth) if bin_start <= x[0] < bin_end]
-        else:
-            bin_point_ids = [i for i, x in enumerate(depth) if bin_end < x[0] <= bin_start]
-
-        if bin_point_ids:
-            first_point_id = min(bin_point_ids)
-            last_point_id = max(bin_point_ids)
-            prev_point = depth[first_point_id-1] if first_point_id >= 1 else None
-        else:
-            first_point_id = None
-            last_point_id = None
-
-        #
-        # Iterate over points in this bin by collecting their contribution using previous interval
-        #
-        prev_price = bin_start
-        prev_volume = prev_point[1] if prev_point else 0.0
-        bin_volume = 0.0
-
-        if first_point_id is None:  # Bin is empty
-            # Update current bin volume
-            price = bin_end
-            price_delta = abs(price - prev_price)
-            price_coeff = price_delta / bin_size  # Portion of this interval in bin
-            bin_volume += prev_volume * price_coeff  # Each point in the bin contributes to this bin final value
+        start = prices[0]  # First point
 
-            # Store current bin as finished
-            bin_volumes.append(bin_volume)
+    # Distances from the start increase for both sides
+    distances = prices - start if price_increase else start - prices
 
-            continue
+    # End covers the last point
+    bin_count = int(abs(prices[-1] - start) // bin_size) + 1
 
-        # Bin is not empty
-        for point_id in range(first_point_id, last_point_id+1):
-            point = depth[point_id]
+    return _bin_volumes(distances, volumes, bin_size, bin_count).tolist()
 
-            # Update current bin volume
-            price = point[0]
-            price_delta = abs(price - prev_price)
-            price_coeff = price_delta / bin_size  # Portion of this interval in bin
-            bin_volume += prev_volume * price_coeff  # Each point in the bin contributes to this bin final value
 
-            # Iterate
-            prev_price = point[0]
-            prev_volume = point[1]
-            prev_point = point
-        #
-        # Last point contributes till the end of this bin
-        #
-        # Update current bin volume
-        price = bin_end
-        price_delta = abs(price - prev_price)
-        price_coeff = price_delta / bin_size  # Portion of this interval in bin
-        bin_volume += prev_volume * price_coeff  # Each point in the bin contributes to this bin final value
+def _bin_volumes(distances: np.ndarray, volumes: np.ndarray, bin_size: float, bin_count: int) -> np.ndarray:
+    # Area under the step function from the first point till each point. Before the first point volume is 0
+    area = np.concatenate(([0.0], np.cumsum(volumes[:-1] * np.diff(distances))))
 
-        # Store current bin as finished
-        bin_volumes.append(bin_volume)
+    # Area till each bin border: area till the last point before the border plus the area of this point till the border
+    borders = np.arange(bin_count + 1) * bin_size
+    ids = np.searchsorted(distances, borders, side="right") - 1
+    before = ids < 0  # Borders before the first point
+    ids[before] = 0
+    border_area = area[ids] + volumes[ids] * (borders - distances[ids])
+    border_area[before] = 0.0
 
-    return bin_volumes
+    return np.diff(border_area) / bin_size
 
 
 # OBSOLETE: Because works only for increasing prices (ask). Use general version instead.
@@ -354,14 +373,25 @@ def mean_volumes(depth: list, windows: list, bin_size: 1.0):
     bid_volumes = discretize(side="bid", depth=depth.get("bids"), bin_size=bin_size, start=None)
     ask_volumes = discretize(side="ask", depth=depth.get("asks"), bin_size=bin_size, start=None)
 
-    ret = {}
-    for length in windows:
-        density = np.nanmean(bid_volumes[0:min(length, len(bid_volumes))])
-        feature_name = f"bids_{length}"
-        ret[feature_name] = density
+    # Means for all windows are computed from one cumulative sum
+    bid_densities = window_densities(bid_volumes, windows)
+    ask_densities = window_densities(ask_volumes, windows)
 
-        density = np.nanmean(ask_volumes[0:min(length, len(ask_volumes))])
-        feature_name = f"asks_{length}"
-        ret[feature_name] = density
+    ret = {}
+    for i, length in enumerate(windows):
+        ret[f"bids_{length}"] = bid_densities[i]
+        ret[f"asks_{length}"] = ask_densities[i]
 
     return ret
+
+
+def window_densities(bin_volumes: list, windows: list) -> np.ndarray:
+    """Mean volume of the first bins for each window (number of bins). All bins are used if a window is longer."""
+    bin_volumes = np.asarray(bin_volumes, dtype=np.float64)
+    valid = ~np.isnan(bin_volumes)
+    sums = np.cumsum(np.where(valid, bin_volumes, 0.0))
+    counts = np.cumsum(valid)
+
+    ends = np.minimum(np.asarray(windows), len(bin_volumes)) - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums[ends] / counts[ends]  # NaNs are ignored like in nanmean
@@ -0,0 +1,131 @@
+import time
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+"""
+Binary format of order book snapshots collected by the depth collector.
+
+A file starts with a header (magic string, version and the number of levels) followed by fixed-size records.
+A record has the timestamps of the request and the price-volume pairs of bids and asks as float64 arrays
+with a fixed number of levels. Missing levels (if the order book is shorter) are NaN.
+A file can be read as a memory-mapped structured array without parsing it.
+"""
+
+depth_magic = b"ITBDEPTH"
+depth_version = 1
+depth_header_size = 32  # Magic (8 bytes), version (4 bytes), levels (4 bytes), reserved
+
+
+def depth_dtype(levels: int) -> np.dtype:
+    """Type of one snapshot record with the specified number of levels for each side."""
+    return np.dtype([
+        ("timestamp", np.int64),
+        ("request_time", np.int64),
+        ("response_time", np.int64),
+        ("bid_count", np.int32),
+        ("ask_count", np.int32),
+        ("bids", np.float64, (levels, 2)),
+        ("asks", np.float64, (levels, 2)),
+    ])
+
+
+def depth_to_record(depth: dict, levels: int) -> np.ndarray:
+    """Convert an order book response (with string prices and volumes) to an array with one record."""
+    record = np.zeros(1, dtype=depth_dtype(levels))
+    record["timestamp"] = depth.get("timestamp", 0)
+    record["request_time"] = depth.get("requestTime", 0)
+    record["response_time"] = depth.get("responseTime", 0)
+    for side in ("bids", "asks"):
+        values = np.asarray(depth.get(side)[:levels], dtype=np.float64).reshape(-1, 2)  # Strings are parsed by numpy
+        record[side][0, :len(values)] = values
+        record[side][0, len(values):] = np.nan
+        record[side[:3] + "_count"] = len(values)
+    return record
+
+
+def read_depth(path: Path) -> np.memmap:
+    """
+    Memory-mapped array of all snapshots of the file. An incomplete last record
+    (e.g., if the writing process was stopped) is ignored.
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        header = f.read(depth_header_size)
+    if header[:8] != depth_magic:
+        raise ValueError(f"File {path} is not an order book file")
+    levels = int(np.frombuffer(header, dtype=np.int32, count=1, offset=12)[0])
+
+    dtype = depth_dtype(levels)
+    count = (path.stat().st_size - depth_header_size) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=depth_header_size, shape=(count,))
+
+
+def depth_entries(records: np.ndarray) -> Iterator[dict]:
+    """Snapshots as dicts with (float) bid and ask arrays like the entries used for feature generation."""
+    for record in records:
+        yield {
+            "timestamp": int(record["timestamp"]),
+            "bids": record["bids"][:record["bid_count"]],
+            "asks": record["asks"][:record["ask_count"]],
+        }
+
+
+class DepthWriter:
+    """
+    Appends snapshots to binary files. Files are kept open and written through a buffer
+    which is flushed when it is full or when the flush period has passed since the last flush.
+    """
+
+    def __init__(self, levels: int, flush_period: float = 60.0, buffer_size: int = 1 << 20):
+        self.levels = levels
+        self.dtype = depth_dtype(levels)
+        self.flush_period = flush_period
+        self.buffer_size = buffer_size
+        self.files = {}
+        self.last_flush = time.monotonic()
+
+    def write(self, path: Path, depth: dict):
+        f = self.files.get(path)
+        if f is None:
+            f = self._open(Path(path))
+            self.files[path] = f
+
+        f.write(depth_to_record(depth, self.levels).tobytes())
+
+        if time.monotonic() - self.last_flush >= self.flush_period:
+            self.flush()
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def _open(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.is_file() and path.stat().st_size >= depth_header_size:
+            levels = int(np.fromfile(path, dtype=np.int32, count=1, offset=12)[0])
+            if levels != self.levels:
+                raise ValueError(f"File {path} has {levels} levels but {self.levels} levels are written")
+            # An incomplete last record is removed so that next records are aligned
+            size = path.stat().st_size
+            complete = depth_header_size + (size - depth_header_size) // self.dtype.itemsize * self.dtype.itemsize
+            f = open(path, "r+b", buffering=self.buffer_size)
+            f.truncate(complete)
+            f.seek(complete)
+            return f
+
+        f = open(path, "wb", buffering=self.buffer_size)
+        header = np.zeros(depth_header_size, dtype=np.uint8)
+        header[:8] = np.frombuffer(depth_magic, dtype=np.uint8)
+        header[8:16] = np.frombuffer(np.array([depth_version, self.levels], dtype=np.int32).tobytes(), dtype=np.uint8)
+        f.write(header.tobytes())
+        return f
@@ -0,0 +1,151 @@
+import json
+import gzip
+import time
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+
+"""
+Persistence of stream events in a dedicated writer thread.
+
+The stream callback only puts an event into a bounded queue. The writer thread serializes the events and appends them
+to one file per channel, symbol and month (like "depthUpdate-BTCUSDT-202401.txt"). The files are kept open
+with large write buffers (and optionally gzip compression) and are flushed when the written size or the time
+since the last flush exceed their limits.
+
+If the queue is full (the writer cannot keep up with the stream) then the callback either waits (overflow "block")
+or the event is dropped (overflow "drop"). Dropped events are counted.
+"""
+
+
+class EventWriter:
+
+    def __init__(
+            self, path: Path, max_events: int = 100_000, overflow: str = "block",
+            flush_period: float = 5.0, flush_size: int = 1 << 20, buffer_size: int = 1 << 20, compression: str = None,
+    ):
+        if overflow not in ("block", "drop"):
+            raise ValueError(f"Unknown overflow policy '{overflow}'. Only 'block' and 'drop' are supported.")
+        if compression not in (None, "gzip"):
+            raise ValueError(f"Unknown compression '{compression}'. Only 'gzip' is supported.")
+
+        self.path = Path(path)
+        self.overflow = overflow
+        self.flush_period = flush_period
+        self.flush_size = flush_size
+        self.buffer_size = buffer_size
+        self.compression = compression
+
+        self.queue = queue.Queue(maxsize=max_events)
+        self.files = {}  # (channel, symbol) -> (month, file)
+        self.thread = None
+
+        # Counters (only the writer thread changes all except received and dropped)
+        self.received = 0
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def start(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, event: dict) -> bool:
+        """Submit an event for writing (called from the stream callback). Return False if it has been dropped."""
+        self.received += 1
+        if self.overflow == "block":
+            self.queue.put(event)
+            return True
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        """Write all submitted events and close the files."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received, "written": self.written, "dropped": self.dropped,
+            "queued": self.queue.qsize(), "flushes": self.flushes, "errors": self.errors,
+        }
+
+    def _run(self):
+        pending = 0  # Bytes written since the last flush
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(last_flush + self.flush_period - time.monotonic(), 0.0)
+            try:
+                event = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                event = ...  # Time to flush
+
+            if event is None:
+                break
+
+            if event is not ...:
+                try:
+                    pending += self._write(event)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Exception while writing event: {e}")
+
+            if pending and (pending >= self.flush_size or time.monotonic() - last_flush >= self.flush_period):
+                self._flush()
+                pending = 0
+            if not pending:
+                last_flush = time.monotonic()
+
+        self._close_files()
+
+    def _write(self, event: dict) -> int:
+        channel, symbol = event.get("e"), event.get("s")
+        now = datetime.utcnow()
+        month = f"{now:%Y}{now:%m}"  # Monthly files
+
+        month_file = self.files.get((channel, symbol))
+        if month_file is None or month_file[0] != month:
+            if month_file is not None:
+                _close_file(month_file[1])
+            month_file = (month, self._open(f"{channel}-{symbol}-{month}"))
+            self.files[(channel, symbol)] = month_file
+
+        line = (json.dumps(event) + "\n").encode()
+        month_file[1].write(line)
+        self.written += 1
+        return len(line)
+
+    def _open(self, file_name: str):
+        if self.compression == "gzip":
+            # Appending adds a new gzip member to the file. A file with several members is read as one stream
+            f = open(self.path / (file_name + ".txt.gz"), "ab", buffering=self.buffer_size)
+            return gzip.GzipFile(fileobj=f, mode="ab")
+        return open(self.path / (file_name + ".txt"), "ab", buffering=self.buffer_size)
+
+    def _flush(self):
+        for month, f in self.files.values():
+            f.flush()  # Gzip file also flushes its file object
+        self.flushes += 1
+
+    def _close_files(self):
+        for month, f in self.files.values():
+            _close_file(f)
+        self.files = {}
+
+
+def _close_file(f):
+    if isinstance(f, gzip.GzipFile):
+        fileobj = f.fileobj
+        f.close()  # Does not close the file object which it has not opened
+        fileobj.close()
+    else:
+        f.close()
@@ -13,7 +13,7 @@ import scipy.stats as stats
 
 from common.utils import *
 from common.gen_features_rolling_agg import *
-from common.gen_features_rolling_agg import _aggregate_last_rows
+from common.gen_features_rolling_agg import _aggregate_last_rows, _aggregate_last_rows_windows, _rolling_aggregate
 
 """
 Feature generators. 
@@ -23,14 +23,13 @@ A feature generator knows how to generate features from its delcarative specific
 
 def generate_features_tsfresh(df, config: dict, last_rows: int = 0):
     """
-    This feature generator relies on tsfresh functions.
+    This feature generator computes the statistics of tsfresh (skewness, kurtosis, mean second derivative central,
+    longest strike below mean, first location of maximum) for rolling windows.
 
-    tsfresh depends on matrixprofile for which binaries are not available for many versions.
-    Therefore, the use of tsfresh may require Python 3.8
+    The statistics are computed by native vectorized implementations which are equivalent to the tsfresh functions.
+    Therefore, tsfresh is not needed (its binary dependencies are not available for many Python versions).
+    The same functions are also available in the itbstats generator.
     """
-    # It is imported here in order to avoid installation of tsfresh if it is not used
-    import tsfresh.feature_extraction.feature_calculators as tsf
-
     # Transform str/list and list to dict with argument names as keys and column names as values
     column_names = config.get('columns')
     if not column_names:
@@ -51,52 +50,31 @@ def generate_features_tsfresh(df, config: dict, last_rows: int = 0):
     if not isinstance(windows, list):
         windows = [windows]
 
-    features = []
-    for w in windows:
-        ro = column.rolling(window=w, min_periods=max(1, w // 2))
-
-        #
-        # Statistics
-        #
-        feature_name = column_name + "_skewness_" + str(w)
-        if not last_rows:
-            df[feature_name] = ro.apply(tsf.skewness, raw=True)
+    # Names of tsfresh statistics and their equivalent functions
+    functions = [
+        ("skewness", pandas_skew_fn),
+        ("kurtosis", pandas_kurtosis_fn),
+        ("msdc", msdc_fn),  # mean_second_derivative_central
+        ("lsbm", lsbm_fn),  # longest_strike_below_mean
+        ("fmax", fmax_fn),  # first_location_of_maximum
+    ]
+
+    outs = {}
+    for func_name, fn in functions:
+        if last_rows:
+            keys = [column_name + "_" + func_name + "_" + str(w) for w in windows]
+            fn_outs = _aggregate_last_rows_windows(column, windows, last_rows, fn, keys=keys)
         else:
-            df[feature_name] = _aggregate_last_rows(column, w, last_rows, tsf.skewness)  # OR skew (but it computes different values)
-        features.append(feature_name)
+            fn_outs = [_rolling_aggregate(column, w, fn) for w in windows]
+        for w, out in zip(windows, fn_outs):
+            outs[column_name + "_" + func_name + "_" + str(w)] = out
 
-        feature_name = column_name + "_kurtosis_" + str(w)
-        if not last_rows:
-            df[feature_name] = ro.apply(tsf.kurtosis, raw=True)
-        else:
-            df[feature_name] = _aggregate_last_rows(column, w, last_rows, tsf.kurtosis)  # OR kurtosis
-        features.append(feature_name)
-
-        # count_above_mean, benford_correlation, mean_changes
-        feature_name = column_name + "_msdc_" + str(w)
-        if not last_rows:
-            df[feature_name] = ro.apply(tsf.mean_second_derivative_central, raw=True)
-        else:
-            df[feature_name] = _aggregate_last_rows(column, w, last_rows, tsf.mean_second_derivative_central)
-        features.append(feature_name)
-
-        #
-        # Counts
-        # first/last_location_of_maximum/minimum
-        #
-        feature_name = column_name + "_lsbm_" + str(w)
-        if not last_rows:
-            df[feature_name] = ro.apply(tsf.longest_strike_below_mean, raw=True)
-        else:
-            df[feature_name] = _aggregate_last_rows(column, w, last_rows, tsf.longest_strike_below_mean)
-        features.append(feature_name)
-
-        feature_name = column_name + "_fmax_" + str(w)
-        if not last_rows:
-            df[feature_name] = ro.apply(tsf.first_location_of_maximum, raw=True)
-        else:
-            df[feature_name] = _aggregate_last_rows(column, w, last_rows, tsf.first_location_of_maximum)
-        features.append(feature_name)
+    features = []
+    for w in windows:
+        for func_name, fn in functions:
+            feature_name = column_name + "_" + func_name + "_" + str(w)
+            df[feature_name] = outs[feature_name]
+            features.append(feature_name)
 
     return features
 
@@ -154,15 +132,7 @@ def generate_features_talib(df, config: dict, last_rows: int = 0):
         except Exception as e:
             raise ValueError(f"Cannot import module {mod_name}. Check if talib is installed correctly")
 
-    mod_name = "talib.stream"  # Functions which are applied to single window and return one value
-    talib_mod_stream = sys.modules.get(mod_name)  # Try to load
-    if talib_mod_stream is None:  # If not yet imported
-        try:
-            talib_mod_stream = importlib.import_module(mod_name)  # Try to import
-        except Exception as e:
-            raise ValueError(f"Cannot import module {mod_name}. Check if talib is installed correctly")
-
-    mod_name = "talib.abstract"  # We need this to get function annotations, particularly, if they are unstable (support stream mode)
+    mod_name = "talib.abstract"  # We need this to get function annotations, particularly, if they are unstable, and their lookback
     talib_mod_abstract = sys.modules.get(mod_name)  # Try to load
     if talib_mod_abstract is None:  # If not yet imported
         try:
@@ -203,6 +173,9 @@ def generate_features_talib(df, config: dict, last_rows: int = 0):
 
     names = config.get('names')
 
+    # In online mode, the state of EMA-like functions and results of parity checks are stored in the engine
+    engine = get_online_engine() if last_rows else None
+
     #
     # For each function, make several calls for each window size
     #
@@ -218,59 +191,33 @@ def generate_features_talib(df, config: dict, last_rows: int = 0):
         except AttributeError as e:
             raise ValueError(f"Cannot resolve talib function name '{func_name}'. Check the (existence of) name of the function")
         is_streamable_function = fn.function_flags is None or 'Function has an unstable period' not in fn.function_flags
-
-        # TODO: Currently disable stream functions
-        is_streamable_function = False
+        is_streamable_function = (is_streamable_function or func_name in _talib_recursive_functions) and len(fn.output_names) == 1
 
         # Now this function will be called for each window as a parameter
         for j, w in enumerate(windows):
 
+            #
+            # Online: Compute only the last rows from a trimmed tail or from the state of the previous call
+            #
+            out = None
+            if engine is not None and w and is_streamable_function and not (w == 1 and len(columns) == 1):
+                key = f"talib_{col_out_names}_{func_name}_{w}"
+                out = _talib_last_rows(engine, key, func_name, talib_mod, talib_mod_abstract, columns, w, last_rows)
+
             #
             # Offline: The function will be executed in a rolling manner and applied to rolling windows
             # Only aggregation functions have window argument (arithmetic row-level functions do not have it)
             #
-            if not last_rows or not w or not is_streamable_function:
+            if out is None:
                 try:
                     fn = getattr(talib_mod, func_name)  # Resolve function name
                 except AttributeError as e:
                     raise ValueError(f"Cannot resolve talib function name '{func_name}'. Check the (existence of) name of the function")
 
-                args = columns.copy()
-                if w:
-                    args['timeperiod'] = w
                 if w == 1 and len(columns) == 1:  # For window 1 use the original values (because talib fails to do this)
                     out = next(iter(columns.values()))
                 else:
-                    out = fn(**args)
-
-            #
-            # Online: In a loop, compute the specified number of single values for the manually prepared windows
-            #
-            else:
-                try:
-                    fn = getattr(talib_mod_stream, func_name)  # Resolve function name
-                except AttributeError as e:
-                    raise ValueError(f"Cannot resolve talib.stream function name '{func_name}'. Check the (existence of) name of the function")
-
-                # Here fn (function) is a different function from a different module (this function is applied to a single window rather than to rolling windows)
-                out_values = []
-                for r in range(last_rows):
-                    # Remove r elements from the end
-                    # Note that we do not remove elements from the start so the length is limited from one side only
-                    args = {k: v.iloc[:len(v)-r] for k, v in columns.items()}
-                    if w:
-                        args['timeperiod'] = w
-
-                    if w == 1 and len(columns) == 1:  # For window 1 use the original values (because talib fails to do this)
-                        col = next(iter(columns.values()))
-                        out_val = col.iloc[-r-1]
-                    else:
-                        out_val = fn(**args)
-                    out_values.append(out_val)
-
-                # Then these values are transformed to a series
-                out = pd.Series(data=np.nan, index=df.index, dtype=float)
-                out.iloc[-last_rows:] = list(reversed(out_values))  # Assign values to the last elements
+                    out = cached_call(_talib_call, columns, fn, w)
 
             #
             # Name of the output column
@@ -311,6 +258,130 @@ def generate_features_talib(df, config: dict, last_rows: int = 0):
     return features
 
 
+def _talib_call(fn, w, **columns):
+    """Apply a talib function to the whole columns (the window is passed only to aggregation functions)."""
+    if w:
+        return fn(**columns, timeperiod=w)
+    return fn(**columns)
+
+
+# EMA-like talib functions with unstable period: coefficients of the nested EMAs (EMA of EMA etc.) in the output
+_talib_recursive_functions = {
+    'EMA': [1.0],
+    'DEMA': [2.0, -1.0],
+    'TEMA': [3.0, -3.0, 1.0],
+}
+
+
+# Number of previous values needed to compute one output of a talib function (for function name and window)
+_talib_lookbacks = {}
+
+
+def _talib_last_rows(engine, key, func_name, talib_mod, talib_mod_abstract, columns: dict, w: int, last_rows: int):
+    """
+    Compute a talib function only for the last rows in online mode.
+    Return None if it has to be computed for the whole history.
+
+    EMA-like functions (with unstable period) continue smoothing from the state stored in the engine during the previous call.
+    Other functions (without unstable period) depend only on the lookback values and hence are applied to a trimmed tail.
+    The first time for each feature, the result is compared with the computation over the whole history,
+    and if they do not match, then the feature is always computed from the whole history.
+    """
+    check_key = (engine.scope, key)
+    if engine.checks.get(check_key) is False:
+        return None
+
+    index = next(iter(columns.values())).index
+
+    if func_name in _talib_recursive_functions:
+        if len(columns) != 1:
+            return None
+        column = next(iter(columns.values()))
+        state = engine.update_state(key, column, w, last_rows, func_name, (), _TalibEmaState)
+        if state is None or state.outputs is None:
+            engine.states.pop((engine.scope, key), None)
+            return None
+        values = state.outputs
+    else:
+        lookback = _talib_lookbacks.get((func_name, w))
+        if lookback is None:
+            f = talib_mod_abstract.Function(func_name)
+            f.set_parameters(timeperiod=w)
+            lookback = _talib_lookbacks[(func_name, w)] = f.lookback
+        tail_length = lookback + last_rows
+        tail_columns = {arg: col.to_numpy(dtype=float)[-tail_length:] for arg, col in columns.items()}
+        if any(len(col) < tail_length or np.isnan(col).any() for col in tail_columns.values()):
+            return None
+        values = getattr(talib_mod, func_name)(**tail_columns, timeperiod=w)[-last_rows:]
+
+    if check_key not in engine.checks:
+        expected = np.asarray(getattr(talib_mod, func_name)(**columns, timeperiod=w))[-last_rows:]
+        engine.checks[check_key] = bool(np.allclose(values, expected, rtol=1e-8, atol=1e-12, equal_nan=True))
+        if not engine.checks[check_key]:
+            print(f"WARNING: Online computation of talib function '{func_name}' with window {w} does not match the offline computation. It will be computed from the whole history.")
+            return None
+
+    out = np.full(len(index), np.nan)
+    out[-last_rows:] = values
+    return pd.Series(data=out, index=index)
+
+
+class _TalibEmaState:
+    """
+    Values of nested EMAs at the last row which are used to continue EMA-like talib functions for new rows.
+    The EMAs are initialized by talib for the history without the last rows, which are then processed recursively.
+    """
+
+    def __init__(self, fn, window, last_rows, args, values):
+        self.fn = fn
+        self.window = window
+        self.last_rows = last_rows
+        self.args = args
+
+        self.last_timestamp = None
+        self.tail = None
+        self.ticks = 0
+
+        self.coefficients = _talib_recursive_functions[fn]
+        self.k = 2.0 / (window + 1)  # The same smoothing factor as in talib
+
+        self.outputs = None
+        if len(values) <= last_rows:
+            return
+
+        talib_mod = importlib.import_module("talib")
+        series = values[:len(values) - last_rows]
+        self.emas = []
+        for i in range(len(self.coefficients)):
+            try:
+                series = talib_mod.EMA(series, timeperiod=window)
+            except Exception:  # For example, all values are NaN
+                return
+            self.emas.append(series[-1])
+        if np.isnan(self.emas).any():
+            return  # Not enough data
+
+        self.outputs = self._step(values[len(values) - last_rows:])
+
+    def advance(self, values, new_rows):
+        """Process the specified number of new rows appended at the end of the data."""
+        if self.outputs is None:
+            return
+        self.outputs = np.concatenate((self.outputs[new_rows:], self._step(values[len(values) - new_rows:])))
+        self.ticks += 1
+
+    def _step(self, values):
+        outputs = np.empty(len(values), dtype=float)
+        emas = self.emas
+        for j, x in enumerate(values):
+            value = x
+            for i in range(len(emas)):
+                emas[i] = ((value - emas[i]) * self.k) + emas[i]
+                value = emas[i]
+            outputs[j] = sum(c * e for c, e in zip(self.coefficients, emas))
+        return outputs
+
+
 def _convert_to_relative(fn_outs: list, rel_base, rel_func, percentage):
     # Convert to relative values and percentage (except for the last output)
     rel_outs = []
@@ -420,19 +491,21 @@ def generate_features_itbstats(df, config: dict, last_rows: int = 0):
         args = tuple()
         bias = config.get('parameters', {}).get('bias', False)  # By default false (as in pandas)
         if func_name.lower() == 'scipy_skew':
-            fn = stats.skew  # scipy skew is very slow
+            fn = stats.skew  # Computed from rolling power sums (scipy itself is very slow)
             args = (0, bias)
         elif func_name.lower() == 'pandas_skew':
-            fn = lambda x: pd.Series(x).skew()
+            fn = pandas_skew_fn
         elif func_name.lower() == 'scipy_kurtosis':
             fn = stats.kurtosis
             args = (0, bias)
         elif func_name.lower() == 'pandas_kurtosis':
-            fn = lambda x: pd.Series(x).kurtosis()
+            fn = pandas_kurtosis_fn
         elif func_name.lower() == 'lsbm':
             fn = lsbm_fn
         elif func_name.lower() == 'fmax':
             fn = fmax_fn
+        elif func_name.lower() == 'msdc':
+            fn = msdc_fn
         elif func_name.lower() == 'mean':
             fn = np.nanmean
         elif func_name.lower() == 'std':
@@ -448,14 +521,17 @@ def generate_features_itbstats(df, config: dict, last_rows: int = 0):
         fn_outs = []
         fn_out_names = []
 
+        if last_rows:
+            keys = [column_name + "_" + func_name + "_" + str(w) for w in windows]
+            last_rows_outs = _aggregate_last_rows_windows(column, windows, last_rows, fn, *args, keys=keys)
+
         # Now this function will be called for each window as a parameter
         for j, w in enumerate(windows):
             out_name = column_name + "_" + func_name + "_" + str(w)
             if not last_rows:
-                ro = column.rolling(window=w, min_periods=max(1, w // 2))
-                out = ro.apply(fn, args=args, raw=True)
+                out = _rolling_aggregate(column, w, fn, *args)
             else:
-                out = _aggregate_last_rows(column, w, last_rows, fn, *args)
+                out = last_rows_outs[j]
 
             fn_out_names.append(out_name)
             out.name = out_name
@@ -473,32 +549,6 @@ def generate_features_itbstats(df, config: dict, last_rows: int = 0):
     return features
 
 
-def fmax_fn(x):
-    return np.argmax(x) / len(x) if len(x) > 0 else np.NaN
-
-
-def lsbm_fn(x):
-    """
-    The longest consecutive interval of values higher than the mean.
-    A similar feature might be higher than the last (current) value.
-    Area under mean/last value is also a variation of this approach but instead of computing the sum of length, we compute their integral (along with the values).
-
-    Equivalent of tsfresh.feature_extraction.feature_calculators.longest_strike_below_mean
-    """
-
-    def _get_length_sequences_where(x):
-        # [0,1,0,0,1,1,1,0,0,1,0,1,1] -> [1, 3, 1, 2]
-        # [0,True,0,0,True,True,True,0,0,True,0,True,True] -> [1, 3, 1, 2]
-        # [0,True,0,0,1,True,1,0,0,True,0,1,True] -> [1, 3, 1, 2]
-        if len(x) == 0:
-            return [0]
-        else:
-            res = [len(list(group)) for value, group in itertools.groupby(x) if value == 1]
-            return res if len(res) > 0 else [0]
-
-    return np.max(_get_length_sequences_where(x < np.mean(x))) if x.size > 0 else 0
-
-
 def generate_features_itblib(df, config: dict, last_rows: int = 0):
     """
     Generate derived features by adding them as new columns to the data frame.
@@ -3,13 +3,17 @@ import pytz
 from datetime import datetime, timezone, timedelta
 from typing import Union, List
 import json
+import itertools
+import hashlib
+from collections import OrderedDict
 from decimal import *
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
 
-from sklearn import linear_model
 from scipy import stats
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 def add_past_weighted_aggregations(df, column_name: str, weight_column_name: str, fn, windows: Union[int, List[int]], suffix=None, rel_column_name: str = None, rel_factor: float = 1.0, last_rows: int = 0):
@@ -55,13 +59,17 @@ def _add_aggregations(df, is_future: bool, column_name: str, fn, windows: Union[
     if suffix is None:
         suffix = "_" + fn.__name__
 
+    if last_rows:
+        keys = [column_name + suffix + '_' + str(w) for w in windows]
+        all_features = _aggregate_last_rows_windows(column, windows, last_rows, fn, keys=keys)
+
     features = []
-    for w in windows:
+    for j, w in enumerate(windows):
         # Aggregate
         if not last_rows:
-            feature = column.rolling(window=w, min_periods=max(1, w // 2)).apply(fn, raw=True)
+            feature = _rolling_aggregate(column, w, fn)
         else:  # Only for last row
-            feature = _aggregate_last_rows(column, w, last_rows, fn)
+            feature = all_features[j]
 
         # Convert past aggregation to future aggregation
         if is_future:
@@ -102,18 +110,23 @@ def _add_weighted_aggregations(df, is_future: bool, column_name: str, weight_col
     if suffix is None:
         suffix = "_" + fn.__name__
 
+    if last_rows:
+        keys = [column_name + suffix + '_' + str(w) for w in windows]
+        all_features = _aggregate_last_rows_windows(products_column, windows, last_rows, fn, keys=[k + ':products' for k in keys])
+        all_weights = _aggregate_last_rows_windows(weight_column, windows, last_rows, fn, keys=[k + ':weights' for k in keys])
+
     features = []
-    for w in windows:
+    for j, w in enumerate(windows):
         if not last_rows:
             # Sum of products
-            feature = products_column.rolling(window=w, min_periods=max(1, w // 2)).apply(fn, raw=True)
+            feature = _rolling_aggregate(products_column, w, fn)
             # Sum of weights
-            weights = weight_column.rolling(window=w, min_periods=max(1, w // 2)).apply(fn, raw=True)
+            weights = _rolling_aggregate(weight_column, w, fn)
         else:  # Only for last row
             # Sum of products
-            feature = _aggregate_last_rows(products_column, w, last_rows, fn)
+            feature = all_features[j]
             # Sum of weights
-            weights = _aggregate_last_rows(weight_column, w, last_rows, fn)
+            weights = all_weights[j]
 
         # Weighted feature
         feature = feature / weights
@@ -146,13 +159,15 @@ def add_area_ratio(df, is_future: bool, column_name: str, windows: Union[int, Li
     if suffix is None:
         suffix = "_" + "area_ratio"
 
+    if not last_rows:
+        all_features = cached_call(rolling_area_ratios, [column], tuple(windows), is_future)
+    else:  # Only for last rows
+        keys = [column_name + suffix + '_' + str(w) for w in windows]
+        all_features = _aggregate_last_rows_windows(column, windows, last_rows, area_fn, is_future, keys=keys)
+
     features = []
-    for w in windows:
-        if not last_rows:
-            ro = column.rolling(window=w, min_periods=max(1, w // 2))
-            feature = ro.apply(area_fn, kwargs=dict(is_future=is_future), raw=True)
-        else:  # Only for last row
-            feature = _aggregate_last_rows(column, w, last_rows, area_fn, is_future)
+    for j, w in enumerate(windows):
+        feature = all_features[j]
 
         feature_name = column_name + suffix + '_' + str(w)
 
@@ -196,13 +211,15 @@ def add_linear_trends(df, is_future: bool, column_name: str, windows: Union[int,
     if suffix is None:
         suffix = "_" + "trend"
 
+    if not last_rows:
+        all_features = cached_call(rolling_slopes, [column], tuple(windows))
+    else:  # Only for last rows
+        keys = [column_name + suffix + '_' + str(w) for w in windows]
+        all_features = _aggregate_last_rows_windows(column, windows, last_rows, slope_fn, keys=keys)
+
     features = []
-    for w in windows:
-        if not last_rows:
-            ro = column.rolling(window=w, min_periods=max(1, w // 2))
-            feature = ro.apply(slope_fn, raw=True)
-        else:  # Only for last row
-            feature = _aggregate_last_rows(column, w, last_rows, slope_fn)
+    for j, w in enumerate(windows):
+        feature = all_features[j]
 
         feature_name = column_name + suffix + '_' + str(w)
 
@@ -238,6 +255,293 @@ def slope_fn(x):
     return slope
 
 
+def fmax_fn(x):
+    return np.argmax(x) / len(x) if len(x) > 0 else np.nan
+
+
+def lsbm_fn(x):
+    """
+    The longest consecutive interval of values higher than the mean.
+    A similar feature might be higher than the last (current) value.
+    Area under mean/last value is also a variation of this approach but instead of computing the sum of length, we compute their integral (along with the values).
+
+    Equivalent of tsfresh.feature_extraction.feature_calculators.longest_strike_below_mean
+    """
+
+    def _get_length_sequences_where(x):
+        # [0,1,0,0,1,1,1,0,0,1,0,1,1] -> [1, 3, 1, 2]
+        # [0,True,0,0,True,True,True,0,0,True,0,True,True] -> [1, 3, 1, 2]
+        # [0,True,0,0,1,True,1,0,0,True,0,1,True] -> [1, 3, 1, 2]
+        if len(x) == 0:
+            return [0]
+        else:
+            res = [len(list(group)) for value, group in itertools.groupby(x) if value == 1]
+            return res if len(res) > 0 else [0]
+
+    return np.max(_get_length_sequences_where(x < np.mean(x))) if x.size > 0 else 0
+
+
+def msdc_fn(x):
+    """
+    Mean second derivative (central approximation) of the series.
+
+    Equivalent of tsfresh.feature_extraction.feature_calculators.mean_second_derivative_central
+    """
+    return (x[-1] - x[-2] - x[1] + x[0]) / (2 * (len(x) - 2)) if len(x) > 2 else np.nan
+
+
+def pandas_skew_fn(x):
+    """Unbiased skewness ignoring NaNs (the same as tsfresh skewness)."""
+    return pd.Series(x).skew()
+
+
+def pandas_kurtosis_fn(x):
+    """Unbiased excess kurtosis ignoring NaNs (the same as tsfresh kurtosis)."""
+    return pd.Series(x).kurtosis()
+
+
+def rolling_slopes(column, windows: List[int], block_rows: int = 1024):
+    """
+    Rolling slopes of linear regression (the same as rolling apply of slope_fn) for all windows in one pass.
+
+    The slope is computed in closed form from window sums of x, y, x*x and x*y over valid (non-NaN) values.
+    These sums are differences of prefix sums which are computed within blocks of rows so that positions
+    (and hence rounding errors) remain small. The values are also centered within each block.
+    """
+    y = column.to_numpy(dtype=float)
+    length = len(y)
+    max_window = max(windows)
+    outs = [np.full(length, np.nan) for w in windows]
+
+    for start in range(0, length, block_rows):
+        end = min(start + block_rows, length)
+        begin = max(0, start - max_window + 1)  # Block data include the windows of its first rows
+
+        seg = y[begin:end]
+        valid = ~np.isnan(seg)
+        center = seg[valid].mean() if valid.any() else 0.0
+        yv = np.where(valid, seg - center, 0.0)
+        xv = np.where(valid, np.arange(len(seg), dtype=float), 0.0)
+
+        # Prefix sums with leading zero: window sum for rows [lo, hi] is c[hi+1] - c[lo]
+        c_n, c_x, c_xx, c_y, c_xy = (
+            np.concatenate(([0.0], np.cumsum(a)))
+            for a in (valid.astype(float), xv, xv * xv, yv, xv * yv)
+        )
+
+        hi = np.arange(start - begin, end - begin) + 1
+        for j, w in enumerate(windows):
+            lo = np.maximum(hi - w, 0)
+            n = c_n[hi] - c_n[lo]
+            sx = c_x[hi] - c_x[lo]
+            sxx = c_xx[hi] - c_xx[lo]
+            sy = c_y[hi] - c_y[lo]
+            sxy = c_xy[hi] - c_xy[lo]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+            slope[(n < 2) | (n < max(1, w // 2))] = np.nan
+            outs[j][start:end] = slope
+
+    return [pd.Series(out, index=column.index) for out in outs]
+
+
+def rolling_area_ratios(column, windows: List[int], is_future: bool):
+    """
+    Rolling area ratios (the same as rolling apply of area_fn) for all windows.
+
+    The ratio is equal to a / b where a is the sum of differences from the level and b is the sum of their absolute values.
+    Both are computed for blocks of rows from one strided window view of the data (without copying windows).
+    """
+    outs = []
+    for w in windows:
+        out = _rolling_view_apply(column, w, _area_rows, is_future)
+        out[_below_min_periods(column, w)] = np.nan
+        outs.append(pd.Series(out, index=column.index))
+    return outs
+
+
+def rolling_skew(column, window: int, bias: bool = True, skipna: bool = False):
+    """
+    Rolling skewness computed from rolling power sums.
+    If skipna is true, then it is the same as pandas skew (unbiased, NaNs ignored) and otherwise the same as scipy skew.
+    """
+    sums = _rolling_central_sums(column, window)
+    out = _pandas_skew(*sums) if skipna else _scipy_skew(*sums, bias=bias)
+    out[_below_min_periods(column, window)] = np.nan
+    return pd.Series(out, index=column.index)
+
+
+def rolling_kurtosis(column, window: int, fisher: bool = True, bias: bool = True, skipna: bool = False):
+    """
+    Rolling kurtosis computed from rolling power sums.
+    If skipna is true, then it is the same as pandas kurtosis (unbiased, excess, NaNs ignored) and otherwise the same as scipy kurtosis.
+    """
+    sums = _rolling_central_sums(column, window)
+    out = _pandas_kurtosis(*sums) if skipna else _scipy_kurtosis(*sums, fisher=fisher, bias=bias)
+    out[_below_min_periods(column, window)] = np.nan
+    return pd.Series(out, index=column.index)
+
+
+def rolling_window_stat(column, window: int, kernel, *args, pad_value=np.nan):
+    """Apply a kernel to all rolling windows with the standard min_periods (half of the window)."""
+    out = _rolling_view_apply(column, window, kernel, *args, pad_value=pad_value)
+    out[_below_min_periods(column, window)] = np.nan
+    return pd.Series(out, index=column.index)
+
+
+def _below_min_periods(column, window):
+    """Rows where rolling windows have less valid values than min_periods (half of the window)."""
+    counts = column.notna().rolling(window=window, min_periods=1).sum().to_numpy()
+    return counts < max(1, window // 2)
+
+
+def _rolling_view_apply(column, window, kernel, *args, pad_value=np.nan, max_block_size=2**20):
+    """
+    Apply a kernel to all rolling windows in blocks of rows.
+    The kernel gets a matrix with one window per row (strided view without copying) and the number of padding values
+    at the start of each row because windows of the first rows are shorter than the window size.
+    """
+    y = column.to_numpy(dtype=float)
+    length = len(y)
+    padded = np.concatenate((np.full(window - 1, pad_value), y))
+    out = np.full(length, np.nan)
+
+    block_rows = max(1, max_block_size // window)
+    for start in range(0, length, block_rows):
+        end = min(start + block_rows, length)
+        view = sliding_window_view(padded[start:end + window - 1], window)
+        pad = np.maximum(window - 1 - np.arange(start, end), 0)
+        out[start:end] = kernel(view, *args, pad=pad)
+
+    return out
+
+
+def _rolling_central_sums(column, window, block_rows: int = 256, small_window: int = 32):
+    """
+    Number of values, mean and sums of 2nd, 3rd and 4th powers of deviations from the mean for rolling windows.
+
+    They are computed from window sums of powers (differences of prefix sums) within blocks of rows where values
+    are centered in order to reduce rounding errors. Windows with constant values get exactly zero sums.
+    Small windows (where power sums lose too much precision relative to the window variance) are computed directly.
+    Windows with NaNs have NaN mean (as in scipy) and their other sums are computed from valid values (as in pandas).
+    """
+    y = column.to_numpy(dtype=float)
+    length = len(y)
+    n, mean, s2, s3, s4 = (np.zeros(length) for _ in range(5))
+
+    if window <= small_window:
+        padded = np.concatenate((np.full(window - 1, np.nan), y))
+        for start in range(0, length, block_rows):
+            end = min(start + block_rows, length)
+            view = sliding_window_view(padded[start:end + window - 1], window)
+            pad = np.maximum(window - 1 - np.arange(start, end), 0)
+            n[start:end], mean[start:end], s2[start:end], s3[start:end], s4[start:end] = _central_sums_rows(view, skipna=True)
+            mean[start:end][np.isnan(view).sum(axis=1) > pad] = np.nan
+        return n, mean, s2, s3, s4
+
+    for start in range(0, length, block_rows):
+        end = min(start + block_rows, length)
+        begin = max(0, start - window + 1)  # Block data include the windows of its first rows
+
+        seg = y[begin:end]
+        valid = ~np.isnan(seg)
+        center = seg[valid].mean() if valid.any() else 0.0
+        d = np.where(valid, seg - center, 0.0)
+        d2 = d * d
+
+        hi = np.arange(start - begin, end - begin) + 1
+        lo = np.maximum(hi - window, 0)
+        # Prefix sums with leading zero: window sum for rows [lo, hi] is c[hi+1] - c[lo]
+        prefix_sums = (np.concatenate(([0.0], np.cumsum(a))) for a in (valid.astype(float), d, d2, d2 * d, d2 * d2))
+        c, p1, p2, p3, p4 = (ps[hi] - ps[lo] for ps in prefix_sums)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m = p1 / c
+        n[start:end] = c
+        mean[start:end] = np.where(c < hi - lo, np.nan, m + center)
+        s2[start:end] = np.maximum(p2 - c * m * m, 0.0)
+        s3[start:end] = p3 - 3 * m * p2 + 2 * c * m ** 3
+        s4[start:end] = np.maximum(p4 - 4 * m * p3 + 6 * m * m * p2 - 3 * c * m ** 4, 0.0)
+
+    ro = column.rolling(window=window, min_periods=1)
+    constant = (ro.max() == ro.min()).to_numpy()
+    s2[constant] = 0.0
+    s3[constant] = 0.0
+    s4[constant] = 0.0
+
+    return n, mean, s2, s3, s4
+
+
+def _central_sums_rows(view, skipna):
+    """Number of values, mean and sums of powers of deviations from the mean for each row of the matrix."""
+    if skipna:
+        valid = ~np.isnan(view)
+        n = valid.sum(axis=1).astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(valid, view, 0.0).sum(axis=1) / n
+        d = np.where(valid, view - mean[:, None], 0.0)
+    else:
+        n = np.full(len(view), float(view.shape[1]))
+        mean = view.mean(axis=1)
+        d = view - mean[:, None]
+    d2 = d * d
+    return n, mean, d2.sum(axis=1), (d2 * d).sum(axis=1), (d2 * d2).sum(axis=1)
+
+
+def _scipy_skew(n, mean, s2, s3, s4, bias=True):
+    with np.errstate(all='ignore'):
+        m2 = s2 / n
+        m3 = s3 / n
+        zero = m2 <= (np.finfo(float).eps * mean) ** 2
+        vals = np.where(zero, np.nan, m3 / m2 ** 1.5)
+        if not bias:
+            nval = ((n - 1.0) * n) ** 0.5 / (n - 2.0) * m3 / m2 ** 1.5
+            vals = np.where(~zero & (n > 2), nval, vals)
+    vals[np.isnan(mean)] = np.nan
+    return vals
+
+
+def _scipy_kurtosis(n, mean, s2, s3, s4, fisher=True, bias=True):
+    with np.errstate(all='ignore'):
+        m2 = s2 / n
+        m4 = s4 / n
+        zero = m2 <= (np.finfo(float).eps * mean) ** 2
+        vals = np.where(zero, np.nan, m4 / m2 ** 2.0)
+        if not bias:
+            nval = 1.0 / (n - 2) / (n - 3) * ((n ** 2 - 1.0) * m4 / m2 ** 2.0 - 3 * (n - 1) ** 2.0)
+            vals = np.where(~zero & (n > 3), nval + 3.0, vals)
+    if fisher:
+        vals = vals - 3.0
+    vals[np.isnan(mean)] = np.nan
+    return vals
+
+
+def _zero_out_fperr(x):
+    return np.where(np.abs(x) < 1e-14, 0.0, x)
+
+
+def _pandas_skew(n, mean, s2, s3, s4):
+    s2 = _zero_out_fperr(s2)
+    s3 = _zero_out_fperr(s3)
+    with np.errstate(all='ignore'):
+        vals = (n * (n - 1) ** 0.5 / (n - 2)) * (s3 / s2 ** 1.5)
+    vals = np.where(s2 == 0, 0.0, vals)
+    vals[n < 3] = np.nan
+    return vals
+
+
+def _pandas_kurtosis(n, mean, s2, s3, s4):
+    with np.errstate(all='ignore'):
+        adj = 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+        numerator = _zero_out_fperr(n * (n + 1) * (n - 1) * s4)
+        denominator = _zero_out_fperr((n - 2) * (n - 3) * s2 ** 2)
+        vals = numerator / denominator - adj
+    vals = np.where(denominator == 0, 0.0, vals)
+    vals[n < 4] = np.nan
+    return vals
+
+
 def to_log_diff(sr):
     return np.log(sr).diff()
 
@@ -259,10 +563,535 @@ def to_diff(sr):
     return diff
 
 
-def _aggregate_last_rows(column, window, last_rows, fn, *args):
+#
+# Rolling kernels
+#
+
+# Reducers which ignore NaNs and have native rolling implementations with the same semantics.
+# Windows with less than min_periods valid values produce NaN in both cases (min/max use monotonic deques in pandas).
+_rolling_kernels = {
+    np.nanmean: lambda ro: ro.mean(),
+    np.nanstd: lambda ro: ro.std(ddof=0),
+    np.nansum: lambda ro: ro.sum(),
+    np.nanmin: lambda ro: ro.min(),
+    np.nanmax: lambda ro: ro.max(),
+}
+
+# Reducers which propagate NaNs. They are equivalent to native rolling methods only if there are no NaNs
+_rolling_kernels_no_nan = {
+    np.mean: lambda ro: ro.mean(),
+    np.std: lambda ro: ro.std(ddof=0),
+    np.sum: lambda ro: ro.sum(),
+    np.min: lambda ro: ro.min(),
+    np.max: lambda ro: ro.max(),
+}
+
+
+# Functions of one window with vectorized implementations for all rolling windows of a column
+_rolling_column_kernels = {
+    slope_fn: lambda column, w: rolling_slopes(column, [w])[0],
+    area_fn: lambda column, w, is_future=False: rolling_area_ratios(column, [w], is_future)[0],
+    stats.skew: lambda column, w, axis=0, bias=True: rolling_skew(column, w, bias=bias),
+    stats.kurtosis: lambda column, w, axis=0, fisher=True, bias=True: rolling_kurtosis(column, w, fisher=fisher, bias=bias),
+    pandas_skew_fn: lambda column, w: rolling_skew(column, w, skipna=True),
+    pandas_kurtosis_fn: lambda column, w: rolling_kurtosis(column, w, skipna=True),
+    lsbm_fn: lambda column, w: rolling_window_stat(column, w, _lsbm_rows),
+    fmax_fn: lambda column, w: rolling_window_stat(column, w, _fmax_rows, pad_value=-np.inf),
+    msdc_fn: lambda column, w: rolling_window_stat(column, w, _msdc_rows),
+}
+
+
+def _rolling_aggregate(column, window, fn, *args):
+    """
+    Rolling aggregation of all rows with the standard min_periods (half of the window).
+    Known reducers are computed by native vectorized rolling methods and other functions are applied to each window.
+    """
+    return cached_call(_rolling_aggregate_column, [column], window, fn, *args)
+
+
+def _rolling_aggregate_column(column, window, fn, *args):
+    ro = column.rolling(window=window, min_periods=max(1, window // 2))
+
+    kernel = _rolling_column_kernels.get(fn)
+    if kernel is not None:
+        return kernel(column, window, *args)
+
+    kernel = None
+    if not args:
+        kernel = _rolling_kernels.get(fn)
+        if kernel is None and fn in _rolling_kernels_no_nan and not column.isna().any():
+            kernel = _rolling_kernels_no_nan[fn]
+
+    if kernel is not None:
+        return kernel(ro)
+    return ro.apply(fn, args=args, raw=True)
+
+
+def _aggregate_last_rows(column, window, last_rows, fn, *args, key=None):
     """Rolling aggregation for only n last rows"""
+    return _aggregate_last_rows_windows(column, [window], last_rows, fn, *args, keys=[key] if key is not None else None)[0]
+
+
+def _aggregate_last_rows_windows(column, windows: List[int], last_rows, fn, *args, keys: List[str] = None):
+    """
+    Rolling aggregation for only n last rows for all windows.
+
+    If an online engine is active and the keys are provided then the results are computed incrementally from its state.
+    Otherwise, known reducers are applied to a strided view of the column tail with one row per window (no copying).
+    Other functions are applied to each window separately.
+    """
+    outs = [None] * len(windows)
+    if _online_engine is not None and keys is not None:
+        for j, w in enumerate(windows):
+            outs[j] = _online_engine.aggregate_last_rows(keys[j], column, w, last_rows, fn, *args)
+
+    missing = [j for j, out in enumerate(outs) if out is None]
+    if missing:
+        missing_outs = cached_call(_aggregate_tail_windows, [column], tuple(windows[j] for j in missing), last_rows, fn, *args)
+        for j, out in zip(missing, missing_outs):
+            outs[j] = out
+
+    return outs
+
+
+def _aggregate_tail_windows(column, windows, last_rows, fn, *args):
     length = len(column)
-    values = [fn(column.iloc[-window - r:length - r].to_numpy(), *args) for r in range(last_rows)]
-    feature = pd.Series(data=np.nan, index=column.index, dtype=float)
-    feature.iloc[-last_rows:] = list(reversed(values))
-    return feature
+    kernel = _window_kernels.get(fn)
+    max_window = max(windows)
+    # The oldest of the last rows need values for the largest window
+    tail = column.to_numpy(dtype=float)[-(max_window + last_rows - 1):] if kernel is not None else None
+    if tail is not None and len(tail) < max_window + last_rows - 1:
+        # Windows of the first rows are shorter than in the data, which is equivalent to NaNs for some reducers
+        tail = np.concatenate((np.full(max_window + last_rows - 1 - len(tail), np.nan), tail))
+
+    outs = []
+    for w in windows:
+        if kernel is not None and (length >= w + last_rows - 1 or fn in _window_kernels_nan_padding):
+            values = kernel(sliding_window_view(tail[max_window - w:], w), *args)
+        else:
+            values = list(reversed([fn(column.iloc[-w - r:length - r].to_numpy(), *args) for r in range(last_rows)]))
+        feature = pd.Series(data=np.nan, index=column.index, dtype=float)
+        feature.iloc[-last_rows:] = values
+        outs.append(feature)
+
+    return outs
+
+
+def _slope_rows(view):
+    """The same as slope_fn applied to each row of the matrix (NaNs are ignored)."""
+    valid = ~np.isnan(view)
+    n = valid.sum(axis=1)
+    x = np.where(valid, np.arange(view.shape[1], dtype=float), 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.where(valid, view - np.nanmean(view, axis=1, keepdims=True), 0.0)
+        sx = x.sum(axis=1)
+        slope = (n * (x * y).sum(axis=1) - sx * y.sum(axis=1)) / (n * (x * x).sum(axis=1) - sx * sx)
+    slope[n < 2] = np.nan
+    return slope
+
+
+def _area_rows(view, is_future, pad=None):
+    """The same as area_fn applied to each row of the matrix."""
+    if is_future:
+        level = view[:, 0] if pad is None else view[np.arange(len(view)), pad]
+    else:
+        level = view[:, -1]
+    x_diff = view - level[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nansum(x_diff, axis=1) / np.nansum(np.absolute(x_diff), axis=1)
+
+
+def _lsbm_rows(view, pad=None):
+    """The same as lsbm_fn applied to each row of the matrix (padding values are NaNs)."""
+    if pad is None:
+        mean = view.mean(axis=1)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.nanmean(view, axis=1)
+        mean[np.isnan(view).sum(axis=1) > pad] = np.nan  # NaNs in the data (not padding) result in NaN mean
+    below = view < mean[:, None]
+
+    # Length of the run of values below the mean which ends at each position
+    positions = np.arange(view.shape[1])
+    last_above = np.maximum.accumulate(np.where(below, -1, positions), axis=1)
+    return (positions - last_above).max(axis=1).astype(float)
+
+
+def _fmax_rows(view, pad=None):
+    """The same as fmax_fn applied to each row of the matrix (padding values are -inf)."""
+    if pad is None:
+        pad = 0
+    return (np.argmax(view, axis=1) - pad) / (view.shape[1] - pad)
+
+
+def _msdc_rows(view, pad=None):
+    """The same as msdc_fn applied to each row of the matrix."""
+    rows = np.arange(len(view))
+    if pad is None:
+        pad = np.zeros(len(view), dtype=int)
+    lengths = view.shape[1] - pad
+    if view.shape[1] < 3:
+        return np.full(len(view), np.nan)
+    first = view[rows, pad]
+    second = view[rows, np.minimum(pad + 1, view.shape[1] - 1)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = (view[:, -1] - view[:, -2] - second + first) / (2 * (lengths - 2))
+    out[lengths <= 2] = np.nan
+    return out
+
+
+# Functions of one window which can be applied to all rows of a window matrix
+_window_kernels = {
+    np.nanmean: lambda view: np.nanmean(view, axis=1),
+    np.nanstd: lambda view: np.nanstd(view, axis=1),
+    np.nansum: lambda view: np.nansum(view, axis=1),
+    np.nanmin: lambda view: np.nanmin(view, axis=1),
+    np.nanmax: lambda view: np.nanmax(view, axis=1),
+    np.mean: lambda view: np.mean(view, axis=1),
+    np.std: lambda view: np.std(view, axis=1),
+    np.sum: lambda view: np.sum(view, axis=1),
+    np.min: lambda view: np.min(view, axis=1),
+    np.max: lambda view: np.max(view, axis=1),
+    slope_fn: _slope_rows,
+    area_fn: _area_rows,
+    stats.skew: lambda view, axis=0, bias=True: _scipy_skew(*_central_sums_rows(view, skipna=False), bias=bias),
+    stats.kurtosis: lambda view, axis=0, fisher=True, bias=True: _scipy_kurtosis(*_central_sums_rows(view, skipna=False), fisher=fisher, bias=bias),
+    pandas_skew_fn: lambda view: _pandas_skew(*_central_sums_rows(view, skipna=True)),
+    pandas_kurtosis_fn: lambda view: _pandas_kurtosis(*_central_sums_rows(view, skipna=True)),
+    lsbm_fn: _lsbm_rows,
+    fmax_fn: _fmax_rows,
+    msdc_fn: _msdc_rows,
+}
+
+# Kernels which ignore NaNs and hence windows shorter than the window size can be padded by NaNs
+_window_kernels_nan_padding = (np.nanmean, np.nanstd, np.nansum, np.nanmin, np.nanmax, slope_fn, pandas_skew_fn, pandas_kurtosis_fn)
+
+
+#
+# Online (incremental) aggregation
+#
+
+# Engine used by _aggregate_last_rows (if any). It is set only for the duration of online feature generation.
+_online_engine = None
+
+
+def get_online_engine():
+    """Engine which is currently active for online feature generation (or None)."""
+    return _online_engine
+
+
+@contextmanager
+def online_aggregation(engine, scope=None):
+    """
+    Compute rolling aggregations of last rows incrementally using the state stored in the engine.
+    The scope distinguishes states of the same features computed in different contexts (e.g., different feature sets).
+    If the engine is None, then all aggregations are computed from scratch as usual.
+    """
+    global _online_engine
+    previous_engine = _online_engine
+    if engine is not None:
+        engine.scope = scope
+    _online_engine = engine
+    try:
+        yield engine
+    finally:
+        _online_engine = previous_engine
+
+
+class OnlineFeatureEngine:
+    """
+    Running state of rolling aggregations (mean, std, sum, slope, area) for the last rows of the online data.
+
+    Each call of the analyzer provides the same data shifted by (normally) one new kline. For each feature,
+    we store running sums of the window ending at the last row and the aggregations for the last rows computed
+    during previous calls. Then only new rows are processed by adding the entering value and removing the exiting value.
+    The state is re-initialized from scratch if the history has been rewritten (stored tail does not match the data),
+    if there are too many new rows, and periodically in order to avoid accumulation of numeric errors.
+    """
+
+    def __init__(self, verify_rows: int = 5, resync_period: int = 1440):
+        self.verify_rows = verify_rows
+        self.resync_period = resync_period
+        self.scope = None
+        self.states = {}
+        self.checks = {}  # Results of parity checks of online and offline computations (if they are needed)
+
+    def reset(self):
+        self.states = {}
+        self.checks = {}
+
+    def aggregate_last_rows(self, key, column, window, last_rows, fn, *args):
+        """
+        The same as _aggregate_last_rows but computed incrementally.
+        Return None if the function is not supported or there is not enough data (the caller then computes it from scratch).
+        """
+        if fn not in _online_functions or len(column) < window + last_rows:
+            return None
+        state = self.update_state(key, column, window, last_rows, fn, args, _RollingState)
+        if state is None:
+            return None
+
+        feature = pd.Series(data=np.nan, index=column.index, dtype=float)
+        feature.iloc[-last_rows:] = state.outputs
+        return feature
+
+    def update_state(self, key, column, window, last_rows, fn, args, state_class):
+        """
+        Get the state of the key advanced to the last row of the column. A new state is created if the stored one cannot be reused.
+        The state class is created from (fn, window, last_rows, args, values) and has to provide advance(values, new_rows),
+        outputs (values for the last rows) and ticks (number of advances). Return None if the index is not ordered.
+        """
+        index = column.index
+        if not index.is_monotonic_increasing:
+            return None
+
+        values = column.to_numpy(dtype=float)
+
+        state_key = (self.scope, key)
+        state = self.states.get(state_key)
+        new_rows = self._get_new_rows(state, index, values, window, last_rows, fn, args)
+
+        if new_rows is None:
+            state = state_class(fn, window, last_rows, args, values)
+            self.states[state_key] = state
+        elif new_rows > 0:
+            state.advance(values, new_rows)
+
+        state.last_timestamp = index[-1]
+        state.tail = values[-self.verify_rows:].copy()
+
+        return state
+
+    def _get_new_rows(self, state, index, values, window, last_rows, fn, args):
+        """Number of rows appended since the previous call or None if the state cannot be reused."""
+        if state is None:
+            return None
+        if state.fn != fn or state.window != window or state.last_rows != last_rows or state.args != args:
+            return None
+        if state.ticks >= self.resync_period:
+            return None
+
+        pos = index.searchsorted(state.last_timestamp)
+        if pos >= len(index) or index[pos] != state.last_timestamp:
+            return None  # Previous last row is not in the data anymore
+        new_rows = len(index) - 1 - pos
+        if new_rows > last_rows:
+            return None
+
+        # Rows which existed during the previous call must not have changed
+        tail = values[max(0, pos + 1 - len(state.tail)):pos + 1]
+        if not np.array_equal(tail, state.tail[-len(tail):], equal_nan=True):
+            return None
+
+        return new_rows
+
+
+class _RollingState:
+    """Running sums of one aggregation over the window ending at the last row."""
+
+    def __init__(self, fn, window, last_rows, args, values):
+        self.fn = fn
+        self.window = window
+        self.last_rows = last_rows
+        self.args = args
+
+        self.last_timestamp = None
+        self.tail = None
+        self.ticks = 0
+
+        length = len(values)
+        end = length - last_rows  # The oldest of the last rows (its window is computed from scratch)
+        start = end - window + 1
+
+        # Values are shifted by the first valid value and positions are counted from the window start for numeric stability
+        x = values[start:end + 1]
+        valid = ~np.isnan(x)
+        self.shift = float(x[valid][0]) if valid.any() else 0.0
+        self.offset = -start  # Position of a row is its index in the current data plus this offset
+        self.last_pos = end + self.offset
+
+        y = x[valid] - self.shift
+        pos = np.arange(window, dtype=float)[valid]
+        self.n = float(len(y))
+        self.s1 = float(np.sum(y))
+        self.s2 = float(np.sum(y * y))
+        self.sx = float(np.sum(pos))
+        self.sxx = float(np.sum(pos * pos))
+        self.sxy = float(np.sum(pos * y))
+
+        self.outputs = np.empty(last_rows, dtype=float)
+        self.outputs[0] = self._output(values, end)
+        for j, i in enumerate(range(end + 1, length), 1):
+            self._step(values, i)
+            self.outputs[j] = self._output(values, i)
+
+    def advance(self, values, new_rows):
+        """Process the specified number of new rows appended at the end of the data."""
+        length = len(values)
+        # The previous last row is now followed by the new rows (old rows might have been removed from the start)
+        self.offset = self.last_pos - (length - 1 - new_rows)
+        outputs = np.empty(new_rows, dtype=float)
+        for j, i in enumerate(range(length - new_rows, length)):
+            self._step(values, i)
+            outputs[j] = self._output(values, i)
+        self.outputs = np.concatenate((self.outputs[new_rows:], outputs))
+        self.ticks += 1
+
+    def _step(self, values, i):
+        self._add(values[i], i + self.offset)
+        self._add(values[i - self.window], i - self.window + self.offset, -1.0)
+        self.last_pos = i + self.offset
+
+    def _add(self, value, pos, sign=1.0):
+        if np.isnan(value):
+            return
+        y = value - self.shift
+        self.n += sign
+        self.s1 += sign * y
+        self.s2 += sign * y * y
+        self.sx += sign * pos
+        self.sxx += sign * pos * pos
+        self.sxy += sign * pos * y
+
+    def _output(self, values, i):
+        fn = self.fn
+        n = self.n
+        if fn is np.nansum:
+            return self.s1 + n * self.shift if n > 0 else 0.0
+        if fn is np.nanmean:
+            return self.s1 / n + self.shift if n > 0 else np.nan
+        if fn is np.nanstd:
+            if n <= 0:
+                return np.nan
+            if n == 1:
+                return 0.0
+            mean = self.s1 / n
+            return np.sqrt(max(self.s2 / n - mean * mean, 0.0))
+        if fn is slope_fn:
+            if n < 2:
+                return np.nan
+            return (n * self.sxy - self.sx * self.s1) / (n * self.sxx - self.sx * self.sx)
+        if fn is area_fn:
+            # Sum of absolute deviations from the current level cannot be maintained by running sums
+            return area_fn(values[i - self.window + 1:i + 1], *self.args)
+        return np.nan
+
+
+_online_functions = (np.nanmean, np.nanstd, np.nansum, slope_fn, area_fn)
+
+
+#
+# Computation cache
+#
+
+# Cache of rolling computations (if any). It is set only for the duration of generating a list of feature sets.
+_computation_cache = None
+
+
+@contextmanager
+def computation_cache(cache):
+    """
+    Share results of rolling computations between features and feature sets which apply the same function
+    with the same parameters to the same data. If the cache is None, then all computations are performed as usual.
+    """
+    global _computation_cache
+    previous_cache = _computation_cache
+    _computation_cache = cache
+    try:
+        yield cache
+    finally:
+        _computation_cache = previous_cache
+
+
+def cached_call(func, columns: Union[list, dict], *params):
+    """
+    Call the function with the columns and parameters or return its result stored in the active cache.
+    A list of columns is passed before the parameters and a dict of columns is passed as keyword arguments.
+    The result (series or list of series) must not depend on anything else, and the parameters must be hashable.
+    """
+    if _computation_cache is None:
+        return _call(func, columns, params)
+    return _computation_cache.call(func, columns, *params)
+
+
+def _call(func, columns, params):
+    if isinstance(columns, dict):
+        return func(*params, **columns)
+    return func(*columns, *params)
+
+
+class ComputationCache:
+    """
+    Results of rolling computations within one run of feature generation.
+
+    The key of a result consists of the function, its parameters and the fingerprints of the input columns,
+    that is, the same computation is recognized even if its input column has a different name in another feature set.
+    Returned series are shallow copies so that the callers can rename them. Results are evicted in the least
+    recently used order if their total size exceeds the limit.
+    """
+
+    def __init__(self, max_bytes: int = 2**30):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.results = OrderedDict()  # Key -> (result, size)
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, func, columns: Union[list, dict], *params):
+        names = tuple(columns.keys()) if isinstance(columns, dict) else None
+        fingerprints = tuple(column_fingerprint(c) for c in (columns.values() if names else columns))
+        if any(f is None for f in fingerprints):
+            return _call(func, columns, params)
+        key = (func, names, fingerprints, params)
+
+        entry = self.results.get(key)
+        if entry is not None:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return _copy_result(entry[0])
+        self.misses += 1
+
+        result = _call(func, columns, params)
+
+        size = _result_nbytes(result)
+        if size <= self.max_bytes:
+            self.results[key] = (result, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self.results.popitem(last=False)
+                self.nbytes -= evicted_size
+
+        return _copy_result(result)
+
+
+def column_fingerprint(column):
+    """Digest of the values and index of a numeric series or None if it cannot be computed."""
+    values = column.to_numpy()
+    if values.dtype.kind not in 'biufmM':
+        return None
+    index = column.index
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(values.dtype).encode())
+    h.update(np.ascontiguousarray(values).view(np.uint8))
+    if isinstance(index, pd.RangeIndex):
+        h.update(repr((index.start, index.stop, index.step)).encode())
+    elif index.dtype.kind in 'iufmM':
+        h.update(str(index.dtype).encode())
+        h.update(np.ascontiguousarray(index.to_numpy()).view(np.uint8))
+    else:
+        return None
+    return h.digest()
+
+
+def _copy_result(result):
+    if isinstance(result, pd.Series):
+        return result.copy(deep=False)
+    if isinstance(result, list):
+        return [_copy_result(r) for r in result]
+    return result
+
+
+def _result_nbytes(result):
+    if isinstance(result, list):
+        return sum(_result_nbytes(r) for r in result)
+    return getattr(result, 'nbytes', 0)
@@ -1,4 +1,8 @@
 from typing import Tuple
+from datetime import datetime
+import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import numpy as np
 import pandas as pd
@@ -6,6 +10,7 @@ import pandas as pd
 from common.classifiers import *
 from common.model_store import *
 from common.gen_features import *
+from common.gen_features_rolling_agg import ComputationCache, computation_cache, get_online_engine
 from common.gen_labels_highlow import generate_labels_highlow, generate_labels_highlow2
 from common.gen_labels_topbot import generate_labels_topbot, generate_labels_topbot2
 from common.gen_signals import (
@@ -14,6 +19,134 @@ from common.gen_signals import (
 )
 
 
+def generate_feature_sets(df: pd.DataFrame, feature_sets: list, last_rows: int = 0, kind: str = None, cache_bytes: int = 2**30, workers: int = 1) -> Tuple[pd.DataFrame, list]:
+    """
+    Apply all feature sets (or label or signal sets) to the input data set according to their execution plan.
+
+    Duplicate sets are executed only once. Rolling and talib computations are shared by all sets via a cache,
+    that is, the same function applied to the same data with the same window is computed only once.
+    If more than one worker is specified, then independent sets are executed in parallel processes
+    (only for all rows). Their results are added to the data frame in the order of the sets, that is,
+    the result is the same as for sequential execution.
+    If the kind of sets (feature, label, signal) is specified, then the progress is printed.
+    """
+    plan = plan_feature_sets(feature_sets, df.columns)
+    engine = get_online_engine()
+
+    pool = None
+    if workers > 1 and len(feature_sets) > 1 and not last_rows and engine is None:
+        pool = FeatureSetPool(df, workers, cache_bytes=cache_bytes)
+
+    all_features = []
+    set_features = {}
+    try:
+        with computation_cache(ComputationCache(max_bytes=cache_bytes)):
+            for i, fs in enumerate(feature_sets):
+                duplicate_of = plan[i]["duplicate_of"]
+                if duplicate_of is not None and any(set(set_features[k]) & set(set_features[duplicate_of]) for k in range(duplicate_of + 1, i)):
+                    duplicate_of = None  # Its output has been overwritten by another set, so it must be written again
+                if duplicate_of is not None:
+                    new_features = set_features[duplicate_of]
+                    # Move its columns to the end as if they were generated again
+                    df = df.drop(columns=new_features).join(df[new_features])
+                    if kind:
+                        print(f"Skip {kind} set {i}/{len(feature_sets)}. Generator {fs.get('generator')}. The same as {kind} set {duplicate_of}.")
+                elif pool is not None:
+                    # All sets which depend only on already added sets can be generated in background
+                    for j in range(i, len(feature_sets)):
+                        if j not in pool.futures and plan[j]["duplicate_of"] is None and all(k < i for k in plan[j]["depends_on"]):
+                            if kind:
+                                print(f"Start {kind} set {j}/{len(feature_sets)}. Generator {feature_sets[j].get('generator')}...")
+                            pool.submit(j, feature_sets[j])
+                    if i not in pool.futures:
+                        pool.submit(i, fs)  # Duplicate whose result has been overwritten
+
+                    f_df, fs_elapsed = pool.result(i)
+                    df = add_features(df, f_df)
+                    pool.share(df, f_df.columns)
+                    new_features = f_df.columns.to_list()
+                    if kind:
+                        print(f"Finished {kind} set {i}/{len(feature_sets)}. Generator {fs.get('generator')}. {kind.capitalize()}s: {len(new_features)}. Time: {str(fs_elapsed).split('.')[0]}")
+                else:
+                    fs_now = datetime.now()
+                    if kind:
+                        print(f"Start {kind} set {i}/{len(feature_sets)}. Generator {fs.get('generator')}...")
+                    if engine is not None:
+                        engine.scope = i  # States of the same features in different sets are stored separately
+                    df, new_features = generate_feature_set(df, fs, last_rows=last_rows)
+                    fs_elapsed = datetime.now() - fs_now
+                    if kind:
+                        print(f"Finished {kind} set {i}/{len(feature_sets)}. Generator {fs.get('generator')}. {kind.capitalize()}s: {len(new_features)}. Time: {str(fs_elapsed).split('.')[0]}")
+
+                set_features[i] = new_features
+                all_features.extend(new_features)
+    finally:
+        if pool is not None:
+            pool.close()
+
+    return df, all_features
+
+
+def plan_feature_sets(feature_sets: list, source_columns: list) -> list:
+    """
+    Execution plan of feature sets: for each set, the previous sets it depends on and whether it is a duplicate.
+
+    A set reads the columns listed in its 'columns' parameter (with the column prefix) and it depends on all previous
+    sets which might write these columns (the ones without feature prefix or with the prefix of the column).
+    Sets which do not list their input columns while using derived data (labels, signals, custom generators)
+    are assumed to depend on all previous sets. The order of the sets in the configuration is one valid execution order.
+    A set is a duplicate if it has the same definition as a previous set and none of its inputs were modified in between.
+    """
+    source_columns = set(source_columns)
+
+    plan = []
+    definitions = {}
+    for i, fs in enumerate(feature_sets):
+        inputs = _feature_set_inputs(fs)
+        if inputs is None and fs.get("generator") in _source_generators:
+            inputs = []  # Only source data are used
+
+        if inputs is None:
+            depends_on = list(range(i))
+        else:
+            derived = [c for c in inputs if c not in source_columns]
+            depends_on = [j for j in range(i) if any(_may_write(feature_sets[j], c) for c in derived)]
+
+        definition = json.dumps(fs, sort_keys=True, default=str)
+        duplicate_of = definitions.get(definition)
+        if duplicate_of is not None and any(j > duplicate_of for j in depends_on):
+            duplicate_of = None  # Inputs might have been changed since the previous execution
+        definitions[definition] = i if duplicate_of is None else duplicate_of
+
+        plan.append({"depends_on": depends_on, "duplicate_of": duplicate_of})
+
+    return plan
+
+
+# Generators which read only source (input) columns without listing them in the configuration
+_source_generators = ["itblib", "depth", "highlow", "topbot"]
+
+
+def _feature_set_inputs(fs: dict):
+    """Columns (with prefix) read by the feature set or None if they are not listed."""
+    columns = fs.get("config", {}).get("columns")
+    if not columns:
+        return None
+    if isinstance(columns, str):
+        columns = [columns]
+    elif isinstance(columns, dict):
+        columns = list(columns.values())
+
+    cp = fs.get("column_prefix")
+    return [cp + "_" + c for c in columns] if cp else list(columns)
+
+
+def _may_write(fs: dict, column: str) -> bool:
+    """Whether the feature set might produce this column."""
+    fp = fs.get("feature_prefix")
+    return not fp or column.startswith(fp + "_")
+
+
 def generate_feature_set(df: pd.DataFrame, fs: dict, last_rows: int) -> Tuple[pd.DataFrame, list]:
     """
     Apply the specified resolved feature generator to the input data set.
@@ -100,15 +233,21 @@ def generate_feature_set(df: pd.DataFrame, fs: dict, last_rows: int) -> Tuple[pd
 
     new_features = f_df.columns.to_list()
 
-    # Delete new columns if they already exist
-    df.drop(list(set(df.columns) & set(new_features)), axis=1, inplace=True)
-
-    df = df.join(f_df)  # Attach all derived features to the main frame
+    df = add_features(df, f_df)
 
     return df, new_features
 
 
-def predict_feature_set(df, fs, config, models: dict):
+def add_features(df: pd.DataFrame, f_df: pd.DataFrame) -> pd.DataFrame:
+    """Attach all derived features to the main frame replacing existing columns with the same names."""
+    # Delete new columns if they already exist
+    df.drop(list(set(df.columns) & set(f_df.columns)), axis=1, inplace=True)
+
+    return df.join(f_df)
+
+
+def build_scoring_plan(fs, config, models: dict) -> ScoringPlan:
+    """Plan for computing the scores of all label-algorithm models of the feature set. It is built once after the models are loaded."""
 
     labels = fs.get("config").get("labels")
     if not labels:
@@ -126,42 +265,39 @@ def predict_feature_set(df, fs, config, models: dict):
     if not train_features:
         train_features = config.get("train_features")
 
-    train_df = df[train_features]
-
-    features = []
-    scores = dict()
-    out_df = pd.DataFrame(index=train_df.index)  # Collect predictions
-
+    plan_models = []
+    plan_labels = []
     for label in labels:
         for model_config in algorithms:
-
-            algo_name = model_config.get("name")
             algo_type = model_config.get("algo")
-            score_column_name = label + label_algo_separator + algo_name
-            algo_train_length = model_config.get("train", {}).get("length")
+            if algo_type not in algorithm_backends:
+                raise ValueError(f"Unknown algorithm type '{algo_type}'")
+
+            score_column_name = label + label_algo_separator + model_config.get("name")
 
             # It is an entry from loaded model dict
             model_pair = models.get(score_column_name)  # Trained model from model registry
+            plan_models.append((score_column_name, model_pair, model_config))
+            plan_labels.append(label)
 
-            print(f"Predict '{score_column_name}'. Algorithm {algo_name}. Label: {label}. Train length {len(train_df)}. Train columns {len(train_df.columns)}")
+    return ScoringPlan(train_features, plan_models, plan_labels)
 
-            if algo_type == "gb":
-                df_y_hat = predict_gb(model_pair, train_df, model_config)
-            elif algo_type == "nn":
-                df_y_hat = predict_nn(model_pair, train_df, model_config)
-            elif algo_type == "lc":
-                df_y_hat = predict_lc(model_pair, train_df, model_config)
-            elif algo_type == "svc":
-                df_y_hat = predict_svc(model_pair, train_df, model_config)
-            else:
-                raise ValueError(f"Unknown algorithm type '{algo_type}'")
 
-            out_df[score_column_name] = df_y_hat
-            features.append(score_column_name)
+def predict_feature_set(df, fs, config, models: dict, plan: ScoringPlan = None):
+
+    if plan is None:
+        plan = build_scoring_plan(fs, config, models)
+
+    print(f"Predict {len(plan.names)} scores {plan.names}. Rows {len(df)}. Train columns {len(plan.columns)}")
+
+    out_df = plan.predict(df)  # Collect predictions
+    features = list(plan.names)
 
-            # For each new score, compare it with the label true values
-            if label in df:
-                scores[score_column_name] = compute_scores(df[label], df_y_hat)
+    # For each new score, compare it with the label true values
+    scores = dict()
+    for score_column_name, label in zip(features, plan.labels):
+        if label in df:
+            scores[score_column_name] = compute_scores(df[label], out_df[score_column_name])
 
     return out_df, features, scores
 
@@ -188,6 +324,9 @@ def train_feature_set(df, fs, config):
     scores = dict()
     out_df = pd.DataFrame()  # Collect predictions
 
+    # Train features are copied once for all labels trained on the same number of rows
+    train_X = dict()
+
     for label in labels:
         for model_config in algorithms:
 
@@ -201,30 +340,21 @@ def train_feature_set(df, fs, config):
                 train_df = df.tail(algo_train_length)
             else:
                 train_df = df
-            df_X = train_df[train_features]
+            if len(train_df) not in train_X:
+                train_X[len(train_df)] = train_df[train_features]
+            df_X = train_X[len(train_df)]
             df_y = train_df[label]
 
             print(f"Train '{score_column_name}'. Algorithm {algo_name}. Label: {label}. Train length {len(df_X)}. Train columns {len(df_X.columns)}")
 
-            if algo_type == "gb":
-                model_pair = train_gb(df_X, df_y, model_config)
-                models[score_column_name] = model_pair
-                df_y_hat = predict_gb(model_pair, df_X, model_config)
-            elif algo_type == "nn":
-                model_pair = train_nn(df_X, df_y, model_config)
-                models[score_column_name] = model_pair
-                df_y_hat = predict_nn(model_pair, df_X, model_config)
-            elif algo_type == "lc":
-                model_pair = train_lc(df_X, df_y, model_config)
-                models[score_column_name] = model_pair
-                df_y_hat = predict_lc(model_pair, df_X, model_config)
-            elif algo_type == "svc":
-                model_pair = train_svc(df_X, df_y, model_config)
-                models[score_column_name] = model_pair
-                df_y_hat = predict_svc(model_pair, df_X, model_config)
-            else:
+            if algo_type not in algorithm_backends:
                 print(f"ERROR: Unknown algorithm type {algo_type}. Check algorithm list.")
                 return
+            train, predict = get_algorithm_backend(algo_type)
+
+            model_pair = train(df_X, df_y, model_config)
+            models[score_column_name] = model_pair
+            df_y_hat = predict(model_pair, df_X, model_config)
 
             scores[score_column_name] = compute_scores(df_y, df_y_hat)
             out_df[score_column_name] = df_y_hat
@@ -261,3 +391,103 @@ def resolve_generator_name(gen_name: str):
         return None
 
     return func
+
+
+#
+# Parallel execution
+#
+
+class FeatureSetPool:
+    """
+    Process pool which generates feature sets for all rows of a data frame.
+
+    Numeric columns of the data frame are placed in shared memory so that they are passed to the workers without
+    pickling. Other columns (if any) are passed with each task. The main process adds the results
+    (only the new features) to its data frame and shares them so that dependent sets can use them.
+    """
+
+    def __init__(self, df: pd.DataFrame, workers: int, cache_bytes: int = 2**30):
+        self.index = df.index
+        self.blocks = {}  # Column name -> shared memory with its values
+        self.retired = []  # Shared memory of replaced columns which still might be attached by running tasks
+        self.futures = {}  # Feature set index -> result future
+        self.columns = []
+        self.other_columns = pd.DataFrame(index=df.index)
+        self.share(df, df.columns)
+
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_bytes,))
+
+    def share(self, df: pd.DataFrame, columns: list):
+        """Make the current values of these columns available to the workers."""
+        for name in columns:
+            self._release(name)
+            values = df[name].to_numpy()
+            if isinstance(df[name].dtype, np.dtype) and df[name].dtype.kind in 'biufmM':
+                shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+                self.blocks[name] = (shm, values.dtype)
+            else:
+                self.other_columns[name] = df[name]
+        # Columns in the order of the data frame because the generators might depend on it
+        self.columns = df.columns.to_list()
+
+    def submit(self, i: int, fs: dict):
+        columns = self.columns
+        cp = fs.get("column_prefix")
+        if cp:
+            columns = [c for c in columns if c.startswith(cp + "_")]  # Only these columns are selected by the generator
+        blocks = {name: (self.blocks[name][0].name, self.blocks[name][1]) for name in columns if name in self.blocks}
+        other_columns = self.other_columns[[c for c in columns if c in self.other_columns]]
+        self.futures[i] = self.executor.submit(_generate_feature_set_worker, fs, columns, blocks, other_columns, self.index)
+
+    def result(self, i: int):
+        """Generated features of the set and the time of generation."""
+        return self.futures.pop(i).result()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for name in list(self.blocks):
+            self._release(name)
+        for shm in self.retired:
+            shm.close()
+            shm.unlink()
+        self.retired = []
+
+    def _release(self, name):
+        if name in self.blocks:
+            shm, _ = self.blocks.pop(name)
+            self.retired.append(shm)
+        if name in self.other_columns:
+            del self.other_columns[name]
+
+
+# Computation cache of the worker process shared by all feature sets it generates
+_worker_cache = None
+
+
+def _init_worker(cache_bytes):
+    global _worker_cache
+    _worker_cache = ComputationCache(max_bytes=cache_bytes)
+
+
+def _generate_feature_set_worker(fs: dict, columns: list, blocks: dict, other_columns: pd.DataFrame, index):
+    fs_now = datetime.now()
+
+    attached = {name: shared_memory.SharedMemory(name=shm_name) for name, (shm_name, _) in blocks.items()}
+    try:
+        data = {}
+        for name in columns:
+            if name in blocks:
+                data[name] = np.ndarray((len(index),), dtype=blocks[name][1], buffer=attached[name].buf)
+            else:
+                data[name] = other_columns[name].to_numpy()
+        df = pd.DataFrame(data, index=index, copy=True)  # Generators work on copies anyway
+        data = None  # Release the shared memory buffers
+
+        with computation_cache(_worker_cache):
+            df, new_features = generate_feature_set(df, fs, last_rows=0)
+    finally:
+        for shm in attached.values():
+            shm.close()
+
+    return df[new_features], datetime.now() - fs_now
@@ -0,0 +1,160 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Tuple, Union
+
+import pandas as pd
+
+from common.generators import plan_feature_sets
+from common.data_store import is_dataset, data_exists, data_size, load_data, store_data, append_data
+
+"""
+Incremental update of the output files of the offline pipeline (features, labels, signals).
+
+The state of an output file is stored in a metadata file next to it. If the feature sets have not changed
+and the input data extends the processed data, then only the new rows are generated (together with the previous rows
+they need) and appended to the output file. Otherwise, the whole output is generated and written again.
+"""
+
+# Lookback of EMA-like functions (talib functions with unstable period, float windows) relative to their window
+unstable_lookback_factor = 10
+
+
+def feature_sets_hash(feature_sets: list) -> str:
+    """Digest of the definitions of the feature sets. Any change of a generator configuration changes it."""
+    definition = json.dumps(feature_sets, sort_keys=True, default=str)
+    return hashlib.sha256(definition.encode()).hexdigest()
+
+
+def feature_set_context(fs: dict) -> Union[Tuple[int, int], None]:
+    """
+    Number of previous rows (lookback) and next rows (horizon) needed to generate one row of the feature set.
+    None means that the feature set cannot be generated incrementally (e.g., an unknown generator).
+    """
+    generator = fs.get("generator")
+    config = fs.get("config", {})
+
+    if generator in ("itbstats", "tsfresh"):
+        return _max_window(config.get("windows")), 0
+    elif generator == "talib":
+        return _max_window(config.get("windows")) * unstable_lookback_factor, 0
+    elif generator == "itblib":
+        return max(_max_window(config.get("base_window")), _max_window(config.get("windows"))) + 1, 0  # Differences need one more row
+
+    elif generator in ("highlow", "highlow2"):
+        return 0, config.get("horizon")
+
+    elif generator == "smoothen":
+        window = config.get("window")
+        if isinstance(window, float):
+            return int(window * unstable_lookback_factor), 0
+        return window or 0, 0
+    elif generator in ("combine", "threshold_rule", "threshold_rule2"):
+        return 0, 0
+
+    return None
+
+
+def feature_sets_context(feature_sets: list, source_columns: list) -> Union[Tuple[int, int], None]:
+    """
+    Lookback and horizon of all feature sets. A feature set which uses the output of other feature sets
+    needs also their lookback and horizon.
+    """
+    plan = plan_feature_sets(feature_sets, source_columns)
+
+    lookbacks, horizons = [], []
+    for i, fs in enumerate(feature_sets):
+        context = feature_set_context(fs)
+        if context is None or context[1] is None:
+            return None
+        lookbacks.append(context[0] + max([lookbacks[j] for j in plan[i]["depends_on"]], default=0))
+        horizons.append(context[1] + max([horizons[j] for j in plan[i]["depends_on"]], default=0))
+
+    return max(lookbacks, default=0), max(horizons, default=0)
+
+
+def meta_path(out_path: Path) -> Path:
+    return out_path.with_name(out_path.name + ".json")
+
+
+def incremental_rows(df: pd.DataFrame, feature_sets: list, out_path: Path, time_column: str) -> Union[Tuple[int, int, int], None]:
+    """
+    Rows of the input data which have to be used (context start) and generated (start) in order to update the output file,
+    and the number of input rows which have already been processed (end). The rows between start and end are replaced.
+    None means that the output has to be generated for all rows because the output does not exist,
+    the feature sets or input columns have changed, or the input data do not continue the processed data.
+    """
+    path = meta_path(out_path)
+    if not data_exists(out_path) or not path.is_file():
+        return None
+    with open(path, "r") as f:
+        meta = json.load(f)
+
+    if meta.get("hash") != feature_sets_hash(feature_sets):
+        print(f"Feature definitions have changed since the last run. All rows will be generated.")
+        return None
+    if meta.get("input_columns") != df.columns.to_list():
+        print(f"Input columns have changed since the last run. All rows will be generated.")
+        return None
+    if meta.get("size") != data_size(out_path):
+        print(f"Output file has been modified since the last run. All rows will be generated.")
+        return None
+
+    context = feature_sets_context(feature_sets, df.columns)
+    if context is None:
+        print(f"Some feature sets cannot be generated incrementally. All rows will be generated.")
+        return None
+    lookback, horizon = context
+
+    # Position of the last processed row in the new data
+    last_time = pd.Timestamp(meta.get("last_time"))
+    times = pd.to_datetime(df[time_column])
+    if (times.dt.tz is None) != (last_time.tz is None):
+        return None
+    pos = times.searchsorted(last_time)
+    if pos >= len(times) or times.iloc[pos] != last_time:
+        print(f"Last processed row {last_time} not found in the input data. All rows will be generated.")
+        return None
+
+    # Rows with incomplete future (horizon) are generated again
+    start = pos + 1 - horizon
+    if start <= 0:
+        return None
+
+    return max(0, start - lookback), start, pos + 1
+
+
+def store_incremental(out_df: pd.DataFrame, out_path: Path, replace_rows: int, time_column: str, float_format: str = "%.6f"):
+    """Replace the specified number of last rows of the output file and append the new rows."""
+    if out_path.suffix in (".parquet", ".arrow"):
+        df = load_data(out_path, time_column)
+        if replace_rows:
+            df = df.iloc[:-replace_rows]
+        df = pd.concat([df, out_df], ignore_index=True)
+        store_data(df, out_path, time_column)
+    elif out_path.suffix == ".csv" or is_dataset(out_path):
+        append_data(out_df, out_path, time_column, float_format=float_format)  # The replaced rows have the same timestamps as the first new rows
+    else:
+        raise ValueError(f"Unknown extension of the output file '{out_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
+
+
+def store_meta(out_df: pd.DataFrame, feature_sets: list, input_columns: list, out_path: Path, time_column: str):
+    """Store the state of the output file after it has been written."""
+    meta = {
+        "hash": feature_sets_hash(feature_sets),
+        "input_columns": list(input_columns),
+        "last_time": str(out_df[time_column].iloc[-1]),
+        "size": data_size(out_path),
+    }
+    with open(meta_path(out_path), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _max_window(windows) -> int:
+    if isinstance(windows, (list, tuple)):
+        return max([_max_window(w) for w in windows], default=0)
+    if isinstance(windows, dict):
+        return _max_window(list(windows.values()))
+    if isinstance(windows, (int, float)) and not isinstance(windows, bool):
+        return int(windows)
+    return 0
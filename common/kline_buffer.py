@@ -0,0 +1,143 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+"""
+Fixed-capacity in-memory store for the latest klines of one symbol.
+It is used by the online analyzer instead of lists of (string) kline records.
+"""
+
+# Columns as they are returned by the Binance API (one kline is a list of values in this order)
+kline_columns = [
+    'timestamp',
+    'open', 'high', 'low', 'close', 'volume',
+    'close_time',
+    'quote_av', 'trades', 'tb_base_av', 'tb_quote_av',
+    'ignore'
+]
+
+# Integer columns (milliseconds and counts) and float columns (prices and volumes) are stored in two separate blocks
+kline_int_columns = ['timestamp', 'close_time', 'trades']
+kline_float_columns = ['open', 'high', 'low', 'close', 'volume', 'quote_av', 'tb_base_av', 'tb_quote_av', 'ignore']
+
+_int_ids = [kline_columns.index(c) for c in kline_int_columns]
+_float_ids = [kline_columns.index(c) for c in kline_float_columns]
+
+
+class KlineBuffer:
+    """
+    Columnar ring buffer with typed arrays for the latest klines of one symbol.
+
+    Each row is written twice: at its physical position and at the same position shifted by the capacity.
+    Therefore, the latest rows (up to the capacity) always occupy one contiguous region of the arrays,
+    and they can be exposed as a data frame without copying.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"Capacity of kline buffer must be positive: {capacity}")
+        self.capacity = capacity
+
+        self._ints = np.zeros((2 * capacity, len(kline_int_columns)), dtype=np.int64)
+        self._floats = np.full((2 * capacity, len(kline_float_columns)), np.nan, dtype=np.float64)
+
+        self._head = 0  # Physical position where the next row will be written
+        self._count = 0  # Number of valid rows
+
+    def __len__(self):
+        return self._count
+
+    def _range(self):
+        end = self._head + self.capacity
+        return end - self._count, end
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Open times (ms) of the stored klines in increasing order. It is a view and must not be modified."""
+        start, end = self._range()
+        return self._ints[start:end, 0]
+
+    def column(self, name: str) -> np.ndarray:
+        """Values of one kline column in increasing time order (view)."""
+        start, end = self._range()
+        if name in kline_float_columns:
+            return self._floats[start:end, kline_float_columns.index(name)]
+        return self._ints[start:end, kline_int_columns.index(name)]
+
+    def get_last_timestamp(self) -> int:
+        if self._count == 0:
+            return 0
+        return int(self._ints[self._head + self.capacity - 1, 0])
+
+    def get_last_kline(self) -> list:
+        """Last kline as a list of values in the order of the API."""
+        if self._count == 0:
+            return None
+        pos = self._head + self.capacity - 1
+        kline = [None] * len(kline_columns)
+        for i, c in enumerate(_int_ids):
+            kline[c] = int(self._ints[pos, i])
+        for i, c in enumerate(_float_ids):
+            kline[c] = float(self._floats[pos, i])
+        return kline
+
+    def append_klines(self, klines: List[list]) -> int:
+        """
+        Append new klines (lists of values as returned by the API) ordered by time.
+        All existing klines with the same or younger timestamps are deleted and replaced by the new klines.
+        If the capacity is exceeded, then the oldest klines are overwritten.
+
+        :return: number of existing klines deleted because they overlap with new klines
+        """
+        if not klines:
+            return 0
+
+        # Only new records are parsed (strings from the API are converted to numbers)
+        ints = np.array([[k[i] for i in _int_ids] for k in klines], dtype=np.int64)
+        floats = np.array([[k[i] for i in _float_ids] for k in klines], dtype=np.float64)
+
+        # Find the overlap by binary search and delete all klines starting from the first new timestamp
+        pos = int(np.searchsorted(self.timestamps, ints[0, 0], side='left'))
+        num_deleted = self._count - pos
+        if num_deleted > 0:
+            self._head = (self._head - num_deleted) % self.capacity
+            self._count = pos
+
+        # Only the last rows can be stored
+        if len(ints) > self.capacity:
+            ints = ints[-self.capacity:]
+            floats = floats[-self.capacity:]
+
+        # Write each row twice in order to have a contiguous view of the latest rows
+        positions = (self._head + np.arange(len(ints))) % self.capacity
+        self._ints[positions] = ints
+        self._ints[positions + self.capacity] = ints
+        self._floats[positions] = floats
+        self._floats[positions + self.capacity] = floats
+
+        self._head = (self._head + len(ints)) % self.capacity
+        self._count = min(self.capacity, self._count + len(ints))
+
+        return num_deleted
+
+    def is_regular(self, interval_length_ms: int) -> bool:
+        """Check that timestamps are a regular time series with the specified interval."""
+        if self._count < 2:
+            return True
+        return bool(np.all(np.diff(self.timestamps) == interval_length_ms))
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        Data frame with the stored klines and the same columns as produced by binance_klines_to_df.
+        Float columns are a view of the buffer (no copy) and hence the data frame is valid only until the next append.
+        """
+        start, end = self._range()
+
+        index = pd.DatetimeIndex(pd.to_datetime(self._ints[start:end, 0], unit='ms'), name='timestamp')
+        df = pd.DataFrame(self._floats[start:end], index=index, columns=kline_float_columns, copy=False)
+
+        df.insert(kline_columns.index('close_time') - 1, 'close_time', pd.to_datetime(self._ints[start:end, 1], unit='ms'))
+        df.insert(kline_columns.index('trades') - 1, 'trades', self._ints[start:end, 2])
+
+        return df
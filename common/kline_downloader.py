@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import asyncio
+from pathlib import Path
+from typing import List, Tuple
+
+"""
+Concurrent download of historic klines from the Binance REST API.
+
+The requested time range is split into chunks (pages) of the maximum size of one request. The chunks are downloaded
+concurrently under a weight-based rate limit, and each downloaded chunk is stored in a checkpoint folder.
+If the download is interrupted then the next run downloads only the missing chunks.
+"""
+
+spot_klines_url = "https://api.binance.com/api/v3/klines"
+futures_klines_url = "https://fapi.binance.com/fapi/v1/klines"
+
+max_klines_limit = 1000  # Maximum number of klines returned by one request
+
+
+def klines_weight(limit: int) -> int:
+    """Request weight of the klines endpoint which depends on the number of requested klines."""
+    if limit < 100:
+        return 1
+    elif limit < 500:
+        return 2
+    elif limit <= 1000:
+        return 5
+    return 10
+
+
+class TokenBucket:
+    """
+    Rate limiter with the capacity equal to the weight limit of the server per minute.
+    Tokens are refilled continuously and a request waits until the bucket has tokens for its weight.
+    """
+
+    def __init__(self, weight_per_minute: int):
+        self.capacity = weight_per_minute
+        self.rate = weight_per_minute / 60.0  # Tokens per second
+        self.tokens = float(weight_per_minute)
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, weight: int):
+        async with self.lock:  # Requests get tokens in the order of their arrival
+            while True:
+                self._refill()
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                await asyncio.sleep((weight - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Remove all tokens so that no requests are sent during this time (e.g., after the server responded with 429)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+
+def split_range(start_ms: int, end_ms: int, interval_ms: int, limit: int = max_klines_limit) -> List[Tuple[int, int]]:
+    """Split the time range [start, end) into chunks each having at most limit klines."""
+    start_ms = start_ms - start_ms % interval_ms  # Open time of the first kline
+    step = interval_ms * limit
+    return [(s, min(s + step, end_ms)) for s in range(start_ms, end_ms, step)]
+
+
+async def download_klines(
+        url: str, symbol: str, interval: str, interval_ms: int, start_ms: int, end_ms: int,
+        checkpoint_path: Path, weight_per_minute: int = 1200, concurrency: int = 8, limit: int = max_klines_limit,
+        retries: int = 5, session=None,
+) -> list:
+    """
+    Download klines with open time in [start, end) and return them in the order of time without duplicates.
+    Downloaded chunks are stored in the checkpoint folder and are not downloaded again by next calls.
+    """
+    import aiohttp
+
+    checkpoint_path = Path(checkpoint_path)
+    checkpoint_path.mkdir(parents=True, exist_ok=True)
+
+    chunks = split_range(start_ms, end_ms, interval_ms, limit)
+    bucket = TokenBucket(weight_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_chunk(session, chunk):
+        file = _chunk_file(checkpoint_path, chunk)
+        if file.is_file():
+            return
+        params = {"symbol": symbol, "interval": interval, "startTime": chunk[0], "endTime": chunk[1] - 1, "limit": limit}
+        async with semaphore:
+            klines = await _request(session, url, params, bucket, klines_weight(limit), retries)
+        _store_chunk(file, klines)
+
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession()
+    try:
+        # All chunks are finished (and stored) even if some of them fail
+        results = await asyncio.gather(*[get_chunk(session, chunk) for chunk in chunks], return_exceptions=True)
+    finally:
+        if own_session:
+            await session.close()
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        raise errors[0]
+
+    return merge_chunks(checkpoint_path, chunks)
+
+
+def merge_chunks(checkpoint_path: Path, chunks: List[Tuple[int, int]]) -> list:
+    """Concatenate the klines of the stored chunks in the order of time removing duplicates."""
+    klines = []
+    last_open = None
+    for chunk in chunks:
+        with open(_chunk_file(checkpoint_path, chunk), "r") as f:
+            for kline in json.load(f):
+                if last_open is not None and kline[0] <= last_open:
+                    continue
+                klines.append(kline)
+                last_open = kline[0]
+    return klines
+
+
+def remove_checkpoints(checkpoint_path: Path):
+    checkpoint_path = Path(checkpoint_path)
+    if not checkpoint_path.is_dir():
+        return
+    for file in checkpoint_path.iterdir():
+        file.unlink()
+    checkpoint_path.rmdir()
+
+
+async def _request(session, url: str, params: dict, bucket: TokenBucket, weight: int, retries: int) -> list:
+    import aiohttp
+
+    for attempt in range(retries + 1):
+        await bucket.acquire(weight)
+        try:
+            async with session.get(url, params=params) as response:
+                if response.status in (418, 429):
+                    # Request rate exceeded. The server specifies how long to wait
+                    bucket.pause(float(response.headers.get("Retry-After", 60)))
+                    continue
+                if response.status < 500:
+                    response.raise_for_status()  # Wrong requests are not repeated
+                    return await response.json()
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+            if attempt == retries:
+                raise
+        await asyncio.sleep(2 ** attempt)  # Server errors and connection errors
+
+    raise RuntimeError(f"Could not download klines with parameters {params} after {retries} retries")
+
+
+def _chunk_file(checkpoint_path: Path, chunk: Tuple[int, int]) -> Path:
+    return checkpoint_path / f"{chunk[0]}-{chunk[1]}.json"
+
+
+def _store_chunk(file: Path, klines: list):
+    # A chunk file is either complete or does not exist if the process is interrupted while writing it
+    tmp_file = file.with_name(file.name + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(klines, f)
+    os.replace(tmp_file, file)
@@ -1,9 +1,11 @@
 import itertools
+import hashlib
+from collections.abc import MutableMapping
 from pathlib import Path
 
 from joblib import dump, load
 
-from keras.models import Sequential, save_model, load_model
+from common.classifiers import NumpyNetwork, TreeEnsemble
 
 label_algo_separator = "_"
 
@@ -40,32 +42,60 @@ def save_model_pair(model_path, score_column_name: str, model_pair: tuple):
     dump(scaler, scaler_file_name)
     # Save prediction model
     if score_column_name.endswith("_nn"):
-        model_extension = ".h5"
-        model_file_name = (model_path / score_column_name).with_suffix(model_extension)
-        save_model(model, model_file_name)
+        if isinstance(model, NumpyNetwork):
+            network = model
+        else:
+            from keras.models import save_model
+            model_extension = ".h5"
+            model_file_name = (model_path / score_column_name).with_suffix(model_extension)
+            save_model(model, model_file_name)
+            network = NumpyNetwork.from_keras(model)
+        # Weights as arrays for prediction without TensorFlow
+        _save_array_model(network, (model_path / score_column_name).with_suffix(".npz"))
     else:
         model_extension = ".pickle"
         model_file_name = (model_path / score_column_name).with_suffix(model_extension)
         dump(model, model_file_name)
+        # Trees of LightGBM boosters as arrays for fast prediction of few rows
+        trees = TreeEnsemble.from_lightgbm(model) if hasattr(model, "dump_model") else None
+        _save_array_model(trees, (model_path / score_column_name).with_suffix(".npz"))
+
 
+def _save_array_model(model, file: Path):
+    # A previous export has to be removed because it is loaded instead of the new model
+    if model is not None:
+        model.save(file)
+    elif file.is_file():
+        file.unlink()
 
-def load_model_pair(model_path, score_column_name: str):
-    """Load a pair consisting of scaler model (possibly null) and prediction model from two files."""
+
+def load_model_pair(model_path, score_column_name: str, mmap_mode: str = None):
+    """
+    Load a pair consisting of scaler model (possibly null) and prediction model from two files.
+    If mmap_mode is specified then arrays in pickled models are memory-mapped instead of read.
+    """
     if not isinstance(model_path, Path):
         model_path = Path(model_path)
     model_path = model_path.absolute()
     # Load scaler
     scaler_file_name = (model_path / score_column_name).with_suffix(".scaler")
-    scaler = load(scaler_file_name)
+    scaler = load(scaler_file_name, mmap_mode=mmap_mode)
     # Load prediction model
     if score_column_name.endswith("_nn"):
-        model_extension = ".h5"
-        model_file_name = (model_path / score_column_name).with_suffix(model_extension)
-        model = load_model(model_file_name)
+        numpy_file_name = (model_path / score_column_name).with_suffix(".npz")
+        if numpy_file_name.is_file():
+            model = NumpyNetwork.load(numpy_file_name)  # TensorFlow is not needed
+        else:
+            from keras.models import load_model
+            model_extension = ".h5"
+            model_file_name = (model_path / score_column_name).with_suffix(model_extension)
+            model = load_model(model_file_name)
+    elif (model_path / score_column_name).with_suffix(".npz").is_file():
+        model = TreeEnsemble.load((model_path / score_column_name).with_suffix(".npz"))
     else:
         model_extension = ".pickle"
         model_file_name = (model_path / score_column_name).with_suffix(model_extension)
-        model = load(model_file_name)
+        model = load(model_file_name, mmap_mode=mmap_mode)
 
     return (model, scaler)
 
@@ -80,6 +110,116 @@ def load_models(model_path, labels: list, algorithms: list):
     return models
 
 
+class ModelRegistry(MutableMapping):
+    """
+    Models for all combinations of labels and algorithms which are loaded on first access.
+
+    The registry knows the files of each model and a content hash and version of the loaded model.
+    refresh() checks the files and loads the models whose content has changed (e.g., after retraining).
+    The new models are swapped in together only after all of them have been loaded successfully.
+    """
+
+    model_extensions = (".scaler", ".pickle", ".h5", ".npz")
+
+    def __init__(self, model_path, labels: list, algorithms: list, mmap_mode: str = "r"):
+        self.model_path = Path(model_path).absolute()
+        self.mmap_mode = mmap_mode
+        self.names = [label + label_algo_separator + algorithm["name"] for label, algorithm in itertools.product(labels, algorithms)]
+
+        self.models = {}  # Loaded model pairs
+        self.hashes = {}  # Content hash of the model files
+        self.versions = {}  # Version is incremented each time new model files are loaded
+        self.stats = {name: self._file_stats(name) for name in self.names}  # Size and modification time of the files
+        self.pending = {}  # Changed file stats which are loaded if they do not change till the next check
+
+    def __getitem__(self, name: str) -> tuple:
+        model_pair = self.models.get(name)
+        if model_pair is None:
+            if name not in self.names:
+                raise KeyError(name)
+            model_pair = self._load(name)
+        return model_pair
+
+    def __setitem__(self, name: str, model_pair: tuple):
+        if name not in self.names:
+            self.names.append(name)
+        self.models[name] = model_pair
+
+    def __delitem__(self, name: str):
+        self.names.remove(name)
+        self.models.pop(name, None)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def refresh(self) -> list:
+        """
+        Load the models whose files have changed and are not being written (not changed since the previous check).
+        Return the names of the models which have been replaced.
+        """
+        changed = []
+        for name in self.names:
+            stats = self._file_stats(name)
+            if stats == self.stats.get(name):
+                self.pending.pop(name, None)
+            elif name not in self.models:
+                self.stats[name] = stats  # Not loaded yet. The new files will be loaded on first access
+            elif stats == self.pending.get(name):
+                changed.append(name)  # Files have not changed since the previous check
+            else:
+                self.pending[name] = stats  # Files may be being written. Check again next time
+
+        loaded = {}
+        for name in changed:
+            if self.hashes.get(name) == self._content_hash(name):
+                self.stats[name] = self.pending.pop(name)  # Only modification time has changed
+                continue
+            try:
+                loaded[name] = self._load(name, swap=False)
+            except Exception as e:
+                print(f"ERROR: Cannot load new version of model '{name}': {e}. The old version is used.")
+                return []
+
+        # Swap in all new models at once
+        for name, (model_pair, content_hash, stats) in loaded.items():
+            self.models[name] = model_pair
+            self.hashes[name] = content_hash
+            self.versions[name] = self.versions.get(name, 0) + 1
+            self.stats[name] = stats
+            self.pending.pop(name, None)
+
+        return list(loaded)
+
+    def _load(self, name: str, swap: bool = True):
+        stats = self._file_stats(name)
+        content_hash = self._content_hash(name)
+        model_pair = load_model_pair(self.model_path, name, mmap_mode=self.mmap_mode)
+        if not swap:
+            return model_pair, content_hash, stats
+
+        self.models[name] = model_pair
+        self.hashes[name] = content_hash
+        self.versions[name] = self.versions.get(name, 0) + 1
+        self.stats[name] = stats
+        return model_pair
+
+    def _files(self, name: str) -> list:
+        return [f for f in ((self.model_path / name).with_suffix(ext) for ext in self.model_extensions) if f.is_file()]
+
+    def _file_stats(self, name: str) -> tuple:
+        return tuple((f.name, f.stat().st_size, f.stat().st_mtime_ns) for f in self._files(name))
+
+    def _content_hash(self, name: str) -> str:
+        digest = hashlib.sha256()
+        for f in self._files(name):
+            digest.update(f.name.encode())
+            digest.update(f.read_bytes())
+        return digest.hexdigest()
+
+
 def score_to_label_algo_pair(score_column_name: str):
     """
     Parse a score column name and return its two constituents: label column name and algorithm name.
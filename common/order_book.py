@@ -0,0 +1,242 @@
+import json
+import gzip
+from collections import deque
+from pathlib import Path
+from typing import Iterator, Union
+
+import numpy as np
+
+from common.depth_processing import depth_to_features
+
+"""
+Local order book maintained from the diff-depth stream (<symbol>@depth or <symbol>@depth@100ms).
+
+Each side is stored as price-sorted arrays of prices and quantities. An update event with first and final
+update ids (U, u) is applied on top of a REST snapshot (lastUpdateId) according to the Binance rules:
+events received before the snapshot are buffered, events older than the snapshot are dropped,
+and each next event has to continue the previous one. If an event is lost then the book is out of sync
+and a new snapshot has to be applied.
+
+Cumulative volumes are computed once after an update so that volume and price queries are binary searches.
+"""
+
+
+class OrderBook:
+
+    def __init__(self, symbol: str = None, max_buffer: int = 10_000):
+        self.symbol = symbol
+        self.last_update_id = None  # None means that the book is not synchronized with the stream
+        self.first = False  # Next event is the first one after the snapshot
+        self.event_time = None
+        self.buffer = deque(maxlen=max_buffer)  # Events received while waiting for a snapshot
+
+        # Prices increase in both sides. The best bid is the last one and the best ask is the first one
+        self.bid_prices, self.bid_volumes = np.empty(0), np.empty(0)
+        self.ask_prices, self.ask_volumes = np.empty(0), np.empty(0)
+        self._cumulative = None
+
+    @property
+    def synced(self) -> bool:
+        return self.last_update_id is not None
+
+    #
+    # Updates
+    #
+
+    def apply_snapshot(self, snapshot: dict) -> bool:
+        """
+        Initialize the book from a REST snapshot (response of get_order_book) and apply the buffered events.
+        Return False if the buffered events do not continue the snapshot (a newer snapshot is needed).
+        """
+        self.bid_prices, self.bid_volumes = _levels(snapshot.get("bids"))
+        self.ask_prices, self.ask_volumes = _levels(snapshot.get("asks"))
+        self._cumulative = None
+        self.last_update_id = snapshot["lastUpdateId"]
+        self.event_time = snapshot.get("E", snapshot.get("timestamp"))
+
+        first = True
+        while self.buffer:
+            event = self.buffer.popleft()
+            if event["u"] < self.last_update_id:
+                continue  # Already in the snapshot
+            if not self._apply(event, first):
+                # Events between the snapshot and the buffered events are lost. They are kept for the next snapshot
+                self.last_update_id = None
+                self.buffer.appendleft(event)
+                return False
+            first = False
+        self.first = first  # If no buffered event has been applied then the next event has to continue the snapshot
+        return True
+
+    def update(self, event: dict) -> bool:
+        """
+        Apply a diff-depth event. Return True if the book has been updated and False if the event has been buffered
+        (no snapshot yet), it has broken the sequence of update ids (the book is reset and needs a new snapshot)
+        or it is older than the book (the book is still synchronized). Use synced to distinguish them.
+        """
+        if not self.synced:
+            self.buffer.append(event)
+            return False
+        if event["u"] < self.last_update_id:
+            return False  # Older than the book
+        if not self._apply(event, self.first):
+            self.reset()
+            self.buffer.append(event)  # It will be applied after a new snapshot if the snapshot is not newer
+            return False
+        self.first = False
+        return True
+
+    def reset(self):
+        """Mark the book as out of sync. Next events are buffered till a new snapshot is applied."""
+        self.last_update_id = None
+        self.buffer.clear()
+
+    def _apply(self, event: dict, first: bool) -> bool:
+        if first:
+            valid = event["U"] <= self.last_update_id + 1 and event["u"] >= self.last_update_id
+        elif "pu" in event:  # Futures stream has the final id of the previous event
+            valid = event["pu"] == self.last_update_id
+        else:
+            valid = event["U"] == self.last_update_id + 1
+        if not valid:
+            return False
+
+        if event.get("b"):
+            self.bid_prices, self.bid_volumes = _merge(self.bid_prices, self.bid_volumes, event["b"])
+        if event.get("a"):
+            self.ask_prices, self.ask_volumes = _merge(self.ask_prices, self.ask_volumes, event["a"])
+        self._cumulative = None
+        self.last_update_id = event["u"]
+        self.event_time = event.get("E", self.event_time)
+        return True
+
+    #
+    # Queries
+    #
+
+    def best_bid(self) -> Union[float, None]:
+        return float(self.bid_prices[-1]) if len(self.bid_prices) else None
+
+    def best_ask(self) -> Union[float, None]:
+        return float(self.ask_prices[0]) if len(self.ask_prices) else None
+
+    def bids(self, levels: int = None) -> np.ndarray:
+        """Bid (price, volume) pairs starting from the best (highest) price."""
+        start = 0 if levels is None else max(len(self.bid_prices) - levels, 0)
+        return np.column_stack((self.bid_prices[start:][::-1], self.bid_volumes[start:][::-1]))
+
+    def asks(self, levels: int = None) -> np.ndarray:
+        """Ask (price, volume) pairs starting from the best (lowest) price."""
+        return np.column_stack((self.ask_prices[:levels], self.ask_volumes[:levels]))
+
+    def price_to_volume(self, side: str, price_limit: float) -> float:
+        """
+        Volume available for a market order on the specified side till the limit price (inclusive).
+        A buy order takes asks with prices not higher than the limit and a sell order takes bids with prices not lower than the limit.
+        """
+        bid_cum, ask_cum = self._cumulatives()
+        if side == "buy":
+            count = np.searchsorted(self.ask_prices, price_limit, side="right")
+            return float(ask_cum[count - 1]) if count else 0.0
+        elif side == "sell":
+            count = len(self.bid_prices) - np.searchsorted(self.bid_prices, price_limit, side="left")
+            return float(bid_cum[count - 1]) if count else 0.0
+        raise ValueError(f"Unknown side '{side}'. Side is either 'buy' or 'sell'.")
+
+    def volume_to_price(self, side: str, volume_limit: float) -> Union[float, None]:
+        """
+        Worst price of a market order on the specified side which executes the volume.
+        None if the book does not have this volume.
+        """
+        bid_cum, ask_cum = self._cumulatives()
+        if side == "buy":
+            prices, cumulative = self.ask_prices, ask_cum
+        elif side == "sell":
+            prices, cumulative = self.bid_prices[::-1], bid_cum
+        else:
+            raise ValueError(f"Unknown side '{side}'. Side is either 'buy' or 'sell'.")
+
+        i = np.searchsorted(cumulative, volume_limit, side="left")
+        return float(prices[i]) if i < len(prices) else None
+
+    def features(self, windows: list, bin_size: float) -> Union[dict, None]:
+        """
+        Depth features (gap, price and densities) of the current state like depth_to_features for collected order books.
+        Only the levels within the price span of the largest window are used.
+        """
+        if not len(self.bid_prices) or not len(self.ask_prices):
+            return None
+        span = max(windows) * bin_size
+        # One more level beyond the span so that the last bin is complete
+        bid_levels = len(self.bid_prices) - np.searchsorted(self.bid_prices, self.bid_prices[-1] - span, side="left") + 1
+        ask_levels = np.searchsorted(self.ask_prices, self.ask_prices[0] + span, side="right") + 1
+        entry = {"timestamp": self.event_time, "bids": self.bids(bid_levels), "asks": self.asks(ask_levels)}
+        return depth_to_features(entry, windows, bin_size)
+
+    def _cumulatives(self):
+        # Cumulative volumes from the best price of each side
+        if self._cumulative is None:
+            self._cumulative = (np.cumsum(self.bid_volumes[::-1]), np.cumsum(self.ask_volumes))
+        return self._cumulative
+
+
+def read_events(path: Path) -> Iterator[dict]:
+    """Diff-depth events from a file stored by the stream collector (one json event per line, optionally gzip compressed)."""
+    path = Path(path)
+    with (gzip.open(path, "rt") if path.suffix == ".gz" else open(path, "r")) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except:
+                continue
+            if event.get("e") == "depthUpdate":
+                yield event
+
+
+def _levels(levels: list):
+    levels = np.asarray(levels, dtype=np.float64).reshape(-1, 2)  # Strings are parsed by numpy
+    levels = levels[levels[:, 1] > 0]
+    order = np.argsort(levels[:, 0])
+    return levels[order, 0], levels[order, 1]
+
+
+def _merge(prices: np.ndarray, volumes: np.ndarray, updates: list):
+    """
+    Price-sorted levels where the updates replace the volumes of their prices. Zero volume removes a level.
+    Existing levels are found by binary search. Their volumes are overwritten in place, and the arrays are
+    copied only if levels are removed or inserted.
+    """
+    updates = np.asarray(updates, dtype=np.float64).reshape(-1, 2)
+    # Stable sort keeps later updates of the same price after earlier ones. The last one is used
+    order = np.argsort(updates[:, 0], kind="stable")
+    update_prices, update_volumes = updates[order, 0], updates[order, 1]
+    if (update_prices[1:] == update_prices[:-1]).any():
+        last = np.append(update_prices[1:] != update_prices[:-1], True)
+        update_prices, update_volumes = update_prices[last], update_volumes[last]
+
+    index = np.searchsorted(prices, update_prices)
+    if len(prices):
+        found = prices.take(index, mode="clip") == update_prices
+        volumes[index[found]] = update_volumes[found]
+    else:
+        found = np.zeros(len(index), dtype=bool)
+
+    # Levels to remove (found with zero volume) and to insert (not found with volume). They are in price order
+    changed = np.flatnonzero(found != (update_volumes > 0))
+    if not len(changed):
+        return prices, volumes  # Only volumes of existing levels have changed
+
+    # New arrays are concatenated from slices of the existing levels and the inserted levels
+    price_pieces, volume_pieces, start = [], [], 0
+    for j, i, insert in zip(changed.tolist(), index[changed].tolist(), (~found[changed]).tolist()):
+        price_pieces.append(prices[start:i])
+        volume_pieces.append(volumes[start:i])
+        if insert:
+            price_pieces.append(update_prices[j:j+1])
+            volume_pieces.append(update_volumes[j:j+1])
+            start = i
+        else:
+            start = i + 1
+    price_pieces.append(prices[start:])
+    volume_pieces.append(volumes[start:])
+    return np.concatenate(price_pieces), np.concatenate(volume_pieces)
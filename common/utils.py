@@ -311,3 +311,29 @@ def notnull_tail_rows(df):
     tail_rows = nan_df[nan_cols].values[::-1].argmax(axis=0).min()
 
     return tail_rows
+
+
+def replace_infinite(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Replace infinite values by NaN. Only columns with infinite values are copied."""
+    for c in columns:
+        values = df[c].to_numpy()
+        if values.dtype.kind == "f" and np.isinf(values).any():
+            df[c] = np.where(np.isinf(values), np.nan, values)
+    return df
+
+
+def dropna_rows(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Remove rows with NaN in the specified columns. If the remaining rows are contiguous (NaNs only in the head
+    and tail which is typical for features and labels) then a slice is returned which does not copy the data.
+    """
+    valid = np.ones(len(df), dtype=bool)
+    for c in columns:
+        valid &= df[c].notna().to_numpy()
+
+    rows = np.flatnonzero(valid)
+    if len(rows) == 0:
+        return df.iloc[0:0]
+    if rows[-1] - rows[0] + 1 == len(rows):
+        return df.iloc[rows[0]:rows[-1] + 1]
+    return df[valid]
@@ -0,0 +1,68 @@
+import sys
+import json
+import subprocess
+
+import click
+
+"""
+Measure startup time and memory of the entry points (server, collectors and scripts).
+Each entry point module is imported in a new process which reports the import time, the peak memory (RSS)
+and which of the heavy libraries have been imported. Algorithm libraries should be loaded only when a model
+of the corresponding algorithm is trained or used.
+"""
+
+entry_points = [
+    "service.server",
+    "collectors.collector_ws",
+    "collectors.collector_depth",
+    "scripts.download_binance",
+    "scripts.merge",
+    "scripts.features",
+    "scripts.labels",
+    "scripts.train",
+    "scripts.predict",
+    "scripts.predict_rolling",
+    "scripts.signals",
+]
+
+heavy_libraries = ["tensorflow", "keras", "lightgbm", "sklearn", "scipy"]
+
+probe = """
+import sys, time, json, resource
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+print(json.dumps({{"time": elapsed, "rss": rss, "libraries": [l for l in {libraries} if l in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int) -> dict:
+    """Best time and RSS of several imports of the module in new processes."""
+    results = []
+    for _ in range(repeat):
+        code = probe.format(module=module, libraries=heavy_libraries)
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if out.returncode != 0:
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return min(results, key=lambda r: r["time"])
+
+
+@click.command()
+@click.option('--module', '-m', 'modules', multiple=True, help='Entry point modules (all if not specified)')
+@click.option('--repeat', '-r', type=int, default=3, help='Number of measurements of each module')
+def main(modules, repeat):
+    modules = modules or entry_points
+
+    print(f"{'Entry point':<30} {'Time (s)':>9} {'RSS (MB)':>9}  Libraries")
+    for module in modules:
+        result = measure(module, repeat)
+        if "error" in result:
+            print(f"{module:<30} ERROR: {result['error']}")
+            continue
+        print(f"{module:<30} {result['time']:>9.2f} {result['rss']:>9.0f}  {', '.join(result['libraries'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import pandas as pd
 import math
-#import os.path
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import json
 import time
@@ -13,12 +16,14 @@ import numpy as np
 from common.utils import *
 from common.gen_features import *
 from common.depth_processing import *
+from common.depth_store import *
 
 """
 Produce features from market depth (json) data for a set of files by writing the result in several output (csv) files.
 Given a file with depth data, produce a time-series file with features extracted from the depth data.
 Input depth data:
 - [json] One line is a json object with timestamp and two time-series "bids" and "asks"
+- [bin] Alternatively, fixed-size binary records with float arrays of bids and asks (see common/depth_store.py)
 - [gaps] It is not necessarily a regular time series and may have gaps (for whatever reason)
 - [higher frequency] The depth records may have higher frequency so the data needs to be filtered
 - [varying depth] the depth (length of ask/bid time series) can theoretically vary so we need at least check it (for output consistency)
@@ -109,6 +114,13 @@ symbol = "BTCUSDT"  # BTCUSDT ETHBTC IOTAUSDT
 
 in_path_name = r"C:\DATA2\BITCOIN\COLLECTED\DEPTH\batch6-partial-till-0307"
 #in_path_name = r"C:\DATA2\BITCOIN\COLLECTED\DEPTH\_test_"
+out_path_name = "."  # One output file with features is written for each day
+
+bin_size = 1.0  # In USDT
+windows = [1, 2, 5, 10, 20]  # No of price bins for aggregate/smoothing
+
+workers = os.cpu_count() or 1  # Chunks of order books are processed in parallel
+chunk_size = 10_000  # Number of order books (lines or records) in one chunk
 
 
 #
@@ -120,9 +132,10 @@ def get_symbol_files(symbol):
     Get a list of file names with data for this symbol and frequency.
     We find all files with this symbol in name in the directly recursively.
     """
-    file_pattern = f"*{symbol}*.txt"
-    paths = Path(in_path_name).rglob(file_pattern)
-    return list(paths)
+    paths = []
+    for suffix in ("txt", "bin"):
+        paths.extend(Path(in_path_name).rglob(f"*{symbol}*.{suffix}"))
+    return paths
 
 
 def find_depth_statistics():
@@ -168,56 +181,135 @@ def find_depth_statistics():
     print(f"Bad lines: {bad_lines}")
 
 
-def main(args=None):
-
-    start_dt = datetime.now()
-    print(f"Start processing...")
-
-    paths = get_symbol_files(symbol)
-    for path in paths:
-
-        # Load file as a list of dict records
-        bad_lines = 0
-        table = []
+def parse_depth_lines(lines):
+    """Parse 1m order books from json lines. Return a list of dict records and the number of bad lines."""
+    bad_lines = 0
+    table = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except:
+            bad_lines += 1
+            continue
+        # File can contain error lines which we skip
+        if not entry.get("bids") or not entry.get("asks"):
+            bad_lines += 1
+            continue
+        # If it is not 1m data then skip
+        timestamp = entry.get("timestamp")
+        if timestamp % 60_000 != 0:
+            continue
+        # Replace all price-volume strings by floats
+        bids = [[float(x[0]), float(x[1])] for x in entry.get("bids")]
+        asks = [[float(x[0]), float(x[1])] for x in entry.get("asks")]
+        entry["bids"] = bids
+        entry["asks"] = asks
+        table.append(entry)
+
+    return table, bad_lines
+
+
+def read_chunks(path):
+    """
+    Split a depth file into chunks which are processed independently.
+    A chunk of a binary file is a range of records (they are mapped by the worker), and a chunk of a text file is a list of lines.
+    """
+    if path.suffix == ".bin":
+        count = len(read_depth(path))
+        for start in range(0, count, chunk_size):
+            yield str(path), start, min(start + chunk_size, count)
+    else:
         with open(path, 'r') as f:
-            for line in f:
-                try:
-                    entry = json.loads(line)
-                except:
-                    bad_lines += 1
-                    continue
-                # File can contain error lines which we skip
-                if not entry.get("bids") or not entry.get("asks"):
-                    bad_lines += 1
-                    continue
-                # If it is not 1m data then skip
-                timestamp = entry.get("timestamp")
-                if timestamp % 60_000 != 0:
-                    continue
-                # Replace all price-volume strings by floats
-                bids = [[float(x[0]), float(x[1])] for x in entry.get("bids")]
-                asks = [[float(x[0]), float(x[1])] for x in entry.get("asks")]
-                entry["bids"] = bids
-                entry["asks"] = asks
-                table.append(entry)
+            while True:
+                lines = list(itertools.islice(f, chunk_size))
+                if not lines:
+                    break
+                yield lines
+
+
+def chunk_features(chunk):
+    """Features of the 1m order books of one chunk. Return the features, the number of order books and the number of bad lines."""
+    if isinstance(chunk, tuple):
+        path, start, end = chunk
+        records = read_depth(path)[start:end]
+        size, bad_lines = len(records), 0
+        records = records[(records["timestamp"] % 60_000 == 0) & (records["bid_count"] > 0) & (records["ask_count"] > 0)]
+        timestamps, bids, asks = records["timestamp"], records["bids"], records["asks"]
+    else:
+        size = len(chunk)
+        table, bad_lines = parse_depth_lines(chunk)
+        timestamps, bids, asks = depth_arrays(table)
+
+    if len(timestamps) == 0:
+        return None, size, bad_lines
+
+    return depth_features_batch(timestamps, bids, asks, windows, bin_size), size, bad_lines
+
+
+def ordered_results(chunks):
+    """Compute features of the chunks in a process pool and return them in the order of chunks. Only a limited number of chunks is in memory."""
+    if workers <= 1:
+        yield from map(chunk_features, chunks)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(chunk_features, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def store_day(df, day):
+    """Store the features of one day in a regular 1m raster."""
+    df = df.drop_duplicates(subset=["timestamp"], keep="last")
+    df.index = pd.to_datetime(df["timestamp"], unit='ms')
+    df = df.drop(columns=["timestamp"])
+    df = df.reindex(pd.date_range(df.index[0], df.index[-1], freq="min"))
+
+    # Make timestamp conform to klines: it has to be start of 1m interval (and not end as it is in collected depth data)
+    df.index = df.index - pd.Timedelta(minutes=1)
+    df.index.name = "timestamp"
+
+    df.to_csv(Path(out_path_name) / f"depth-{symbol}-{day}.csv", float_format="%.4f")
 
-        # Transform json table to data frame with features
-        # ---
-        df = depth_to_df(table)
-        # ---
-        df = df.reset_index().rename(columns={"index": "timestamp"})
 
-        # Make timestamp conform to klines: it has to be start of 1m interval (and not end as it is in collected depth data)
-        df["timestamp"] = df["timestamp"].shift(periods=1)  # Move forward (down) - use previous timestamp
+def main(args=None):
 
-        # Store file with features
-        df.to_csv(path.with_suffix('.csv').name, index=False, float_format="%.4f")
+    start_dt = datetime.now()
+    print(f"Start processing with {workers} workers...")
 
-        print(f"Finished processing file: {path}")
+    # All files are one stream of order books. Chunks are read lazily and only the current day is kept in memory
+    paths = sorted(get_symbol_files(symbol))
+    chunks = itertools.chain.from_iterable(read_chunks(path) for path in paths)
 
-        print(f"Bad lines: {bad_lines}")
+    day_df = None
+    snapshots = 0
+    bad_lines = 0
+    for df, size, bad in ordered_results(chunks):
+        snapshots += size
+        bad_lines += bad
+        if df is not None:
+            day_df = df if day_df is None else pd.concat([day_df, df], ignore_index=True)
+
+            # Days before the last received day are complete
+            days = pd.to_datetime(day_df["timestamp"], unit='ms').dt.strftime("%Y-%m-%d")
+            for day in days.unique()[:-1]:
+                store_day(day_df[(days == day).values], day)
+                print(f"Finished processing day: {day}")
+            day_df = day_df[(days == days.iloc[-1]).values]
+
+        elapsed = (datetime.now() - start_dt).total_seconds()
+        print(f"Processed {snapshots} order books. Throughput: {snapshots / elapsed:.0f} order books per second.")
+
+    if day_df is not None and len(day_df):
+        day = pd.to_datetime(day_df["timestamp"].iloc[-1], unit='ms').strftime("%Y-%m-%d")
+        store_day(day_df, day)
+        print(f"Finished processing day: {day}")
 
-        pass
+    print(f"Bad lines: {bad_lines}")
 
     elapsed = datetime.now() - start_dt
     print(f"Finished processing in {int(elapsed.total_seconds())} seconds.")
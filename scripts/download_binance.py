@@ -11,12 +11,17 @@ import click
 
 #import aiohttp
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from binance.client import Client
 from binance.streams import BinanceSocketManager
 from binance.enums import *
 
+from binance.helpers import interval_to_milliseconds
+
 from common.utils import klines_to_df, binance_freq_from_pandas
+from common.kline_downloader import *
+from common.data_store import *
 from service.App import *
 
 """
@@ -37,7 +42,7 @@ def main(config_file):
     """
     Retrieving historic klines from binance server.
 
-    Client.get_historical_klines
+    GET /api/v3/klines (in concurrent chunks)
     """
     load_config(config_file)
 
@@ -54,6 +59,8 @@ def main(config_file):
     print(f"Binance frequency: {freq}")
 
     save = True
+    weight_per_minute = 1200  # Request weight limit of the server
+    concurrency = 8  # Maximum number of simultaneous requests
 
     App.client = Client(api_key=App.config["api_key"], api_secret=App.config["api_secret"])
 
@@ -63,6 +70,10 @@ def main(config_file):
         App.client.PRIVATE_API_VERSION = "v1"
         App.client.PUBLIC_API_VERSION = "v1"
 
+    # Segments of data sets are merged in background while next data sources are downloaded
+    compaction_executor = ThreadPoolExecutor(max_workers=1)
+    compactions = []
+
     data_sources = App.config["data_sources"]
     for ds in data_sources:
         # Assumption: folder name is equal to the symbol name we want to download
@@ -76,19 +87,19 @@ def main(config_file):
         file_path = data_path / quote
         file_path.mkdir(parents=True, exist_ok=True)  # Ensure that folder exists
 
-        file_name = (file_path / ("futures" if futures else "klines")).with_suffix(".csv")
+        data_format = App.config.get("source_format", "csv")
+        file_name = source_path(file_path, "futures" if futures else "klines", data_format)
 
         # Get a few latest klines to determine the latest available timestamp
         latest_klines = App.client.get_klines(symbol=quote, interval=freq, limit=5)
         latest_ts = pd.to_datetime(latest_klines[-1][0], unit='ms')
 
-        if file_name.is_file():
-            # Load the existing data in order to append newly downloaded data
-            df = pd.read_csv(file_name)
-            df[time_column] = pd.to_datetime(df[time_column], format='ISO8601')
+        if data_exists(file_name):
+            # Only the last rows of the existing data are loaded because new data is appended
+            df = load_data(file_name, time_column, tail_rows=5)
 
             # oldest_point = parser.parse(data["timestamp"].iloc[-1])
-            oldest_point = df["timestamp"].iloc[-5]  # Use an older point so that new data will overwrite old data
+            oldest_point = df["timestamp"].iloc[0]  # Use an older point so that new data will overwrite old data
 
             print(f"File found. Downloaded data for {quote} and {freq} since {str(latest_ts)} will be appended to the existing file {file_name}")
         else:
@@ -103,24 +114,36 @@ def main(config_file):
         #binsizes = {"1m": 1, "5m": 5, "1h": 60, "1d": 1440}
         #delta_lines = math.ceil(delta_minutes / binsizes[freq])
 
-        # === Download from the remote server using binance client
-        klines = App.client.get_historical_klines(
-            symbol=quote,
-            interval=freq,
-            start_str=oldest_point.isoformat(),
-            #end_str=latest_ts.isoformat()  # fetch everything up to now
-        )
+        # === Download from the remote server in concurrent chunks
+        # Chunks are stored in a checkpoint folder so that an interrupted download continues from the missing chunks
+        checkpoint_path = file_path / f"{file_name.stem}.chunks"
+        klines = asyncio.run(download_klines(
+            futures_klines_url if futures else spot_klines_url, quote, freq, interval_to_milliseconds(freq),
+            start_ms=pd.Timestamp(oldest_point).value // 1_000_000,
+            end_ms=latest_klines[-1][0] + 1,  # fetch everything up to now
+            checkpoint_path=checkpoint_path,
+            weight_per_minute=weight_per_minute,
+            concurrency=concurrency,
+        ))
 
-        df = klines_to_df(klines, df)
+        df = klines_to_df(klines, None)
 
         # Remove last row because it represents a non-complete kline (the interval not finished yet)
         df = df.iloc[:-1]
 
         if save:
-            df.to_csv(file_name)
+            # Only new rows are written (overlapping old rows are replaced)
+            append_data(df.reset_index(), file_name, time_column)
+            remove_checkpoints(checkpoint_path)
+            if is_dataset(file_name):
+                compactions.append(compaction_executor.submit(compact_data, file_name))
 
         print(f"Finished downloading '{quote}'. Stored in '{file_name}'")
 
+    for compaction in compactions:
+        compaction.result()
+    compaction_executor.shutdown()
+
     elapsed = datetime.now() - now
     print(f"Finished downloading data in {str(elapsed).split('.')[0]}")
 
@@ -5,6 +5,7 @@ import click
 import yfinance as yf
 
 from service.App import *
+from common.data_store import *
 
 """
 Download quotes from Yahoo
@@ -41,10 +42,11 @@ def main(config_file):
         file_path = data_path / quote
         file_path.mkdir(parents=True, exist_ok=True)  # Ensure that folder exists
 
-        file_name = (file_path / file).with_suffix(".csv")
+        file_name = source_path(file_path, file, App.config.get("source_format", "csv"))
 
-        if file_name.is_file():
-            df = pd.read_csv(file_name, parse_dates=[time_column], date_format="ISO8601")
+        if data_exists(file_name):
+            # Only the last rows of the existing data are loaded because new data is appended
+            df = load_data(file_name, time_column, tail_rows=5)
             #df['Date'] = pd.to_datetime(df['Date'], format="ISO8601")  # "2022-06-07" iso format
             df[time_column] = df[time_column].dt.date
             last_date = df.iloc[-1][time_column]
@@ -60,8 +62,7 @@ def main(config_file):
             new_df.rename({'Date': time_column}, axis=1, inplace=True)
             new_df.columns = new_df.columns.str.lower()
 
-            df = pd.concat([df, new_df])
-            df = df.drop_duplicates(subset=[time_column], keep="last")
+            df = new_df
 
         else:
             print(f"File not found. Full fetch...")
@@ -81,7 +82,7 @@ def main(config_file):
 
         df = df.sort_values(by=time_column)
 
-        df.to_csv(file_name, index=False)
+        append_data(df, file_name, time_column)  # Only new rows are written (overlapping old rows are replaced)
         print(f"Stored in '{file_name}'")
 
     elapsed = datetime.now() - now
@@ -1,3 +1,4 @@
+import os
 from typing import Tuple
 from pathlib import Path
 import click
@@ -6,7 +7,9 @@ import numpy as np
 import pandas as pd
 
 from service.App import *
-from common.generators import generate_feature_set
+from common.data_store import *
+from common.generators import generate_feature_sets
+from common.incremental import incremental_rows, store_incremental, store_meta
 
 
 #
@@ -15,6 +18,8 @@ from common.generators import generate_feature_set
 class P:
     in_nrows = 50_000_000  # Load only this number of records
     tail_rows = int(10.0 * 525_600)  # Process only this number of last rows
+    workers = os.cpu_count() or 1  # Independent feature sets are generated in parallel processes (1 means sequential)
+    incremental = False  # Generate only new rows and append them to the existing output file (if the feature sets have not changed)
 
 
 @click.command()
@@ -33,17 +38,15 @@ def main(config_file):
     data_path = Path(App.config["data_folder"]) / symbol
 
     file_path = data_path / App.config.get("merge_file_name")
-    if not file_path.is_file():
+    if not data_exists(file_path):
         print(f"Data file does not exist: {file_path}")
         return
 
     print(f"Loading data from source data file {file_path}...")
-    if file_path.suffix == ".parquet":
-        df = pd.read_parquet(file_path)
-    elif file_path.suffix == ".csv":
-        df = pd.read_csv(file_path, parse_dates=[time_column], date_format="ISO8601", nrows=P.in_nrows)
+    if file_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        df = load_data(file_path, time_column, tail_rows=P.tail_rows, nrows=P.in_nrows)  # Data sets read only the partitions of the tail
     else:
-        print(f"ERROR: Unknown extension of the 'merge_file_name' file '{file_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'merge_file_name' file '{file_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
     print(f"Finished loading {len(df)} records with {len(df.columns)} columns.")
 
@@ -60,18 +63,25 @@ def main(config_file):
         print(f"ERROR: no feature sets defined. Nothing to process.")
         return
 
+    out_file_name = App.config.get("feature_file_name")
+    out_path = (data_path / out_file_name).resolve()
+    input_columns = df.columns.to_list()
+
+    # In incremental mode, only new rows (and the previous rows they need) are generated
+    rows = incremental_rows(df, feature_sets, out_path, time_column) if P.incremental else None
+    if rows is not None:
+        context_start, start, end = rows
+        if start >= len(df):
+            print(f"No new records in the input data. The output file {out_path} is up to date.")
+            return
+        print(f"Incremental update of {len(df) - end} new records (using {start - context_start} previous records and generating {end - start} records again).")
+        df = df.iloc[context_start:].reset_index(drop=True)
+
     # Apply all feature generators to the data frame which get accordingly new derived columns
     # The feature parameters will be taken from App.config (depending on generator)
     print(f"Start generating features for {len(df)} input records.")
 
-    all_features = []
-    for i, fs in enumerate(feature_sets):
-        fs_now = datetime.now()
-        print(f"Start feature set {i}/{len(feature_sets)}. Generator {fs.get('generator')}...")
-        df, new_features = generate_feature_set(df, fs, last_rows=0)
-        all_features.extend(new_features)
-        fs_elapsed = datetime.now() - fs_now
-        print(f"Finished feature set {i}/{len(feature_sets)}. Generator {fs.get('generator')}. Features: {len(new_features)}. Time: {str(fs_elapsed).split('.')[0]}")
+    df, all_features = generate_feature_sets(df, feature_sets, last_rows=0, kind="feature", workers=P.workers)
 
     print(f"Finished generating features.")
 
@@ -81,17 +91,19 @@ def main(config_file):
     #
     # Store feature matrix in output file
     #
-    out_file_name = App.config.get("feature_file_name")
-    out_path = (data_path / out_file_name).resolve()
-
-    print(f"Storing features with {len(df)} records and {len(df.columns)} columns in output file {out_path}...")
-    if out_path.suffix == ".parquet":
-        df.to_parquet(out_path, index=False)
-    elif out_path.suffix == ".csv":
-        df.to_csv(out_path, index=False, float_format="%.6f")
+    if rows is not None:
+        df = df.iloc[start - context_start:]
+        print(f"Appending features with {len(df)} records and {len(df.columns)} columns to output file {out_path}...")
+        store_incremental(df, out_path, replace_rows=end - start, time_column=time_column)
     else:
-        print(f"ERROR: Unknown extension of the 'feature_file_name' file '{out_path.suffix}'. Only 'csv' and 'parquet' are supported")
-        return
+        print(f"Storing features with {len(df)} records and {len(df.columns)} columns in output file {out_path}...")
+        if out_path.suffix in (".parquet", ".csv", ".arrow", ""):
+            store_data(df, out_path, time_column, float_format="%.6f")
+        else:
+            print(f"ERROR: Unknown extension of the 'feature_file_name' file '{out_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
+            return
+
+    store_meta(df, feature_sets, input_columns, out_path, time_column)
 
     print(f"Stored output file {out_path} with {len(df)} records")
 
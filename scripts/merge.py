@@ -6,7 +6,11 @@ import numpy as np
 
 import click
 
+from pandas.tseries.frequencies import to_offset
+
 from service.App import *
+from common.data_store import *
+from common.kline_buffer import kline_columns
 
 """
 This script is intended for creating one output file from multiple input data files. 
@@ -121,13 +125,13 @@ def main(config_file):
         if not file:
             file = quote
 
-        file_path = (data_path / quote / file).with_suffix(".csv")
-        if not file_path.is_file():
+        file_path = source_path(data_path / quote, file, App.config.get("source_format", "csv"))
+        if not data_exists(file_path):
             print(f"Data file does not exist: {file_path}")
             return
 
         print(f"Reading data file: {file_path}")
-        df = pd.read_csv(file_path, parse_dates=[time_column], date_format="ISO8601")
+        df = load_data(file_path, time_column)
         print(f"Loaded file with {len(df)} records.")
 
         ds["df"] = df
@@ -142,12 +146,10 @@ def main(config_file):
 
     print(f"Storing output file...")
     df_out = df_out.reset_index()
-    if out_path.suffix == ".parquet":
-        df_out.to_parquet(out_path, index=False)
-    elif out_path.suffix == ".csv":
-        df_out.to_csv(out_path, index=False)  # float_format="%.6f"
+    if out_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        store_data(df_out, out_path, time_column)  # float_format="%.6f"
     else:
-        print(f"ERROR: Unknown extension of the 'merge_file_name' file '{out_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'merge_file_name' file '{out_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
 
     range_start = df_out.index[0]
@@ -159,7 +161,125 @@ def main(config_file):
 
 
 def merge_data_sources(data_sources: list):
+    """
+    Merge data sources into one data frame with a common regular time index and prefixed columns.
+    A data source has either a data frame ("df") or a kline buffer ("buffer") used by the online analyzer.
+    Each source row is placed at its integer position in the time raster, and all columns are written
+    into one preallocated block without joining data frames.
+    """
+    time_column = App.config["time_column"]
+    freq = App.config["freq"]
 
+    try:
+        step = to_offset(freq).nanos
+    except ValueError:  # Non-fixed frequency (like month) is not a regular raster of integers
+        return _join_data_sources(data_sources)
+
+    sources = []
+    for ds in data_sources:
+        source = _source_arrays(ds, time_column)
+        if source is None:
+            print(f"ERROR: Timestamp column is absent.")
+            return
+        sources.append(source)
+
+    #
+    # Create common (main) time raster
+    #
+    tz = sources[0]["tz"]
+    range_start = min([src["start"] for src in sources])
+    range_end = min([src["end"] for src in sources])
+    length = max(0, (range_end - range_start) // step + 1)
+
+    index = pd.DatetimeIndex(range_start + np.arange(length, dtype=np.int64) * step, name=time_column)
+    if tz is not None:
+        index = index.tz_localize("UTC").tz_convert(tz)
+
+    # Positions of the source rows in the raster. Rows outside of the raster are skipped
+    num_float = 0
+    for src in sources:
+        offsets = src["times"] - range_start
+        valid = (offsets >= 0) & (offsets % step == 0) & (offsets // step < length)
+        src["positions"] = offsets[valid] // step
+        src["valid"] = valid if not valid.all() else slice(None)
+        src["complete"] = len(np.unique(src["positions"])) == length  # All raster rows have values
+        num_float += sum(1 for v in src["columns"].values() if v.dtype.kind == "f" or not src["complete"] and v.dtype.kind in "iu")
+
+    # One block for all float columns (and integer columns with missing values which are converted to float as in joins)
+    block = np.full((length, num_float), np.nan, dtype=np.float64, order="F")
+    data = {}
+    j = 0
+    for src in sources:
+        for name, values in src["columns"].items():
+            values = values[src["valid"]]
+            if values.dtype.kind == "f" or not src["complete"] and values.dtype.kind in "iu":
+                column = block[:, j]
+                j += 1
+            elif values.dtype.kind == "M":
+                column = np.full(length, np.datetime64("NaT"), dtype=values.dtype)
+            elif src["complete"]:
+                column = np.empty(length, dtype=values.dtype)
+            else:
+                column = np.full(length, np.nan, dtype=object)
+            column[src["positions"]] = values
+            data[name] = column
+
+    df_out = pd.DataFrame(data, index=index, copy=False)
+    for src in sources:
+        for name, column_tz in src["column_tz"].items():
+            df_out[name] = df_out[name].dt.tz_localize("UTC").dt.tz_convert(column_tz)
+
+    return df_out
+
+
+def _source_arrays(ds: dict, time_column: str):
+    """Timestamps (int64 ns in UTC) and prefixed column arrays of one data source."""
+    prefix = ds.get("column_prefix")
+
+    def prefixed(col):
+        # Add prefix if not already there
+        return prefix + "_" + col if prefix and not col.startswith(prefix + "_") else col
+
+    buffer = ds.get("buffer")
+    if buffer is not None:
+        times = buffer.timestamps * 1_000_000
+        columns = {}
+        for name in kline_columns[1:]:
+            values = buffer.column(name)
+            if name == "close_time":
+                values = values.astype("datetime64[ms]").astype("datetime64[ns]")
+            columns[prefixed(name)] = values
+        return {"times": times, "tz": None, "columns": columns, "column_tz": {}, "start": times[0], "end": times[-1]}
+
+    df = ds.get("df")
+    if time_column in df.columns:
+        df = df.set_index(time_column)
+    elif df.index.name == time_column:
+        pass
+    else:
+        return None
+
+    df.columns = [prefixed(col) for col in df.columns]
+    ds["df"] = df
+
+    index = pd.DatetimeIndex(df.index)
+    times = index.asi8
+    start, end = df.first_valid_index(), df.last_valid_index()
+    columns, column_tz = {}, {}
+    for name in df.columns:
+        values = df[name]
+        if isinstance(values.dtype, pd.DatetimeTZDtype):
+            column_tz[name] = values.dt.tz
+            values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+        columns[name] = values.to_numpy()
+    return {
+        "times": times, "tz": index.tz, "columns": columns, "column_tz": column_tz,
+        "start": pd.DatetimeIndex([start]).asi8[0], "end": pd.DatetimeIndex([end]).asi8[0],
+    }
+
+
+def _join_data_sources(data_sources: list):
+    """Merge by joining data frames. It is used for non-fixed frequencies."""
     time_column = App.config["time_column"]
     freq = App.config["freq"]
 
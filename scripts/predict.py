@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 
 from service.App import *
+from common.data_store import *
 from common.model_store import *
 from common.generators import predict_feature_set
 
@@ -39,17 +40,20 @@ def main(config_file):
     data_path = Path(App.config["data_folder"]) / symbol
 
     file_path = data_path / App.config.get("matrix_file_name")
-    if not file_path.is_file():
+    if not data_exists(file_path):
         print(f"ERROR: Input file does not exist: {file_path}")
         return
 
+    # Only the columns needed for prediction (and labels if present) are loaded
+    file_columns = data_columns(file_path)
+    columns = [x for x in ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time'] if x in file_columns]
+    columns += [x for x in App.config.get("train_features") + App.config["labels"] if x not in columns and x in file_columns]
+
     print(f"Loading data from source data file {file_path}...")
-    if file_path.suffix == ".parquet":
-        df = pd.read_parquet(file_path)
-    elif file_path.suffix == ".csv":
-        df = pd.read_csv(file_path, parse_dates=[time_column], date_format="ISO8601", nrows=P.in_nrows)
+    if file_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        df = load_data(file_path, time_column, columns=columns, nrows=P.in_nrows)
     else:
-        print(f"ERROR: Unknown extension of the 'matrix_file_name' file '{file_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'matrix_file_name' file '{file_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
     print(f"Finished loading {len(df)} records with {len(df.columns)} columns.")
 
@@ -149,12 +153,10 @@ def main(config_file):
     out_path = data_path / App.config.get("predict_file_name")
 
     print(f"Storing predictions with {len(out_df)} records and {len(out_df.columns)} columns in output file {out_path}...")
-    if out_path.suffix == ".parquet":
-        out_df.to_parquet(out_path, index=False)
-    elif out_path.suffix == ".csv":
-        out_df.to_csv(out_path, index=False, float_format='%.6f')
+    if out_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        store_data(out_df, out_path, time_column, float_format='%.6f')
     else:
-        print(f"ERROR: Unknown extension of the 'predict_file_name' file '{out_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'predict_file_name' file '{out_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
 
     print(f"Predictions stored in file: {out_path}. Length: {len(out_df)}. Columns: {len(out_df.columns)}")
@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 
 from service.App import *
+from common.data_store import *
 from common.utils import *
 from common.gen_features import *
 from common.classifiers import *
@@ -53,17 +54,20 @@ def main(config_file):
     data_path = Path(App.config["data_folder"]) / symbol
 
     file_path = data_path / App.config.get("matrix_file_name")
-    if not file_path.is_file():
+    if not data_exists(file_path):
         print(f"ERROR: Input file does not exist: {file_path}")
         return
 
+    # Only the columns needed for training and prediction are loaded
+    file_columns = data_columns(file_path)
+    columns = [x for x in [time_column, 'open', 'high', 'low', 'close', 'volume', 'close_time'] if x in file_columns]
+    columns += [x for x in App.config.get("train_features") + App.config["labels"] if x not in columns and x in file_columns]
+
     print(f"Loading data from source data file {file_path}...")
-    if file_path.suffix == ".parquet":
-        df = pd.read_parquet(file_path)
-    elif file_path.suffix == ".csv":
-        df = pd.read_csv(file_path, parse_dates=[time_column], date_format="ISO8601", nrows=P.in_nrows)
+    if file_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        df = load_data(file_path, time_column, columns=columns, nrows=P.in_nrows)
     else:
-        print(f"ERROR: Unknown extension of the 'matrix_file_name' file '{file_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'matrix_file_name' file '{file_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
     print(f"Finished loading {len(df)} records with {len(df.columns)} columns.")
 
@@ -79,7 +83,7 @@ def main(config_file):
         data_end = find_index(df, data_end)
 
     df = df.iloc[data_start:data_end]
-    df = df.reset_index(drop=True)
+    df.index = pd.RangeIndex(len(df))  # Without copying the data
 
     print(f"Input data size {len(df)} records. Range: [{df.iloc[0][time_column]}, {df.iloc[-1][time_column]}]")
 
@@ -126,20 +130,15 @@ def main(config_file):
     # Select necessary features and label
     out_columns = [time_column, 'open', 'high', 'low', 'close', 'volume', 'close_time']
     out_columns = [x for x in out_columns if x in df.columns]
-    labels_present = set(labels).issubset(df.columns)
-    if labels_present:
-        all_features = train_features + labels
-    else:
-        all_features = train_features
-    df = df[out_columns + [x for x in all_features if x not in out_columns]]
+    # Only these columns and features (and labels) have been loaded. Rows are sliced below without copying the data
 
+    df = df.copy(deep=False)  # New columns are added to this frame rather than to the sliced frame
     for label in labels:
         # "category" NN does not work without this (note that we assume a classification task here)
         df[label] = df[label].astype(int)
 
-    df.replace([np.inf, -np.inf], np.nan, inplace=True)
+    df = replace_infinite(df, train_features)
     #in_df = in_df.dropna(subset=labels)
-    df = df.reset_index(drop=True)  # We must reset index after removing rows to remove gaps
 
     # Result rows. Here store only rows for which we make predictions
     labels_hat_df = pd.DataFrame()
@@ -176,7 +175,10 @@ def main(config_file):
             train_start = 0
 
         train_df = df.iloc[train_start:train_end]  # We assume that iloc is equal to index
-        train_df = train_df.dropna(subset=train_features)
+        train_df = dropna_rows(train_df, train_features)
+
+        # Train features are copied once for all labels trained on the same number of rows
+        train_X = dict()
 
         print(f"\n===>>> Start step {step}/{prediction_steps}. Train range: [{train_start}, {train_end}]={train_end-train_start}. Prediction range: [{predict_start}, {predict_end}]={predict_end-predict_start}. Jobs/scores: {len(labels)*len(algorithms)}. {use_multiprocessing=} ")
 
@@ -199,21 +201,16 @@ def main(config_file):
                             train_df_2 = train_df.tail(algo_train_length)
                         else:
                             train_df_2 = train_df
-                        df_X = train_df_2[train_features]
+                        if len(train_df_2) not in train_X:
+                            train_X[len(train_df_2)] = train_df_2[train_features]
+                        df_X = train_X[len(train_df_2)]
                         df_y = train_df_2[label]
                         df_y_test = predict_df[label]
 
-                        if algo_type == "gb":
-                            execution_results[score_column_name] = executor.submit(train_predict_gb, df_X, df_y, df_X_test, model_config)
-                        elif algo_type == "nn":
-                            execution_results[score_column_name] = executor.submit(train_predict_nn, df_X, df_y, df_X_test, model_config)
-                        elif algo_type == "lc":
-                            execution_results[score_column_name] = executor.submit(train_predict_lc, df_X, df_y, df_X_test, model_config)
-                        elif algo_type == "svc":
-                            execution_results[score_column_name] = executor.submit(train_predict_svc, df_X, df_y, df_X_test, model_config)
-                        else:
+                        if algo_type not in algorithm_backends:
                             print(f"ERROR: Unknown algorithm type {algo_type}. Check algorithm list.")
                             return
+                        execution_results[score_column_name] = executor.submit(train_predict, algo_type, df_X, df_y, df_X_test, model_config)
 
                 # Wait for the job finish and collect their results
                 for score_column_name, future in execution_results.items():
@@ -236,21 +233,16 @@ def main(config_file):
                         train_df_2 = train_df.tail(algo_train_length)
                     else:
                         train_df_2 = train_df
-                    df_X = train_df_2[train_features]
+                    if len(train_df_2) not in train_X:
+                        train_X[len(train_df_2)] = train_df_2[train_features]
+                    df_X = train_X[len(train_df_2)]
                     df_y = train_df_2[label]
                     df_y_test = predict_df[label]
 
-                    if algo_type == "gb":
-                        predict_labels_df[score_column_name] = train_predict_gb(df_X, df_y, df_X_test, model_config)
-                    elif algo_type == "nn":
-                        predict_labels_df[score_column_name] = train_predict_nn(df_X, df_y, df_X_test, model_config)
-                    elif algo_type == "lc":
-                        predict_labels_df[score_column_name] = train_predict_lc(df_X, df_y, df_X_test, model_config)
-                    elif algo_type == "svc":
-                        predict_labels_df[score_column_name] = train_predict_svc(df_X, df_y, df_X_test, model_config)
-                    else:
+                    if algo_type not in algorithm_backends:
                         print(f"ERROR: Unknown algorithm type {algo_type}. Check algorithm list.")
                         return
+                    predict_labels_df[score_column_name] = train_predict(algo_type, df_X, df_y, df_X_test, model_config)
 
         #
         # Append predicted *rows* to the end of previous predicted rows
@@ -278,12 +270,10 @@ def main(config_file):
     out_path = data_path / App.config.get("predict_file_name")
 
     print(f"Storing predictions with {len(out_df)} records and {len(out_df.columns)} columns in output file {out_path}...")
-    if out_path.suffix == ".parquet":
-        out_df.to_parquet(out_path, index=False)
-    elif out_path.suffix == ".csv":
-        out_df.to_csv(out_path, index=False, float_format='%.6f')
+    if out_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        store_data(out_df, out_path, time_column, float_format='%.6f')
     else:
-        print(f"ERROR: Unknown extension of the 'predict_file_name' file '{out_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'predict_file_name' file '{out_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
 
     print(f"Predictions stored in file: {out_path}. Length: {len(out_df)}. Columns: {len(out_df.columns)}")
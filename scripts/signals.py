@@ -5,8 +5,10 @@ from tqdm import tqdm
 import numpy as np
 import pandas as pd
 
-from common.generators import generate_feature_set
+from common.generators import generate_feature_sets
+from common.incremental import incremental_rows, store_incremental, store_meta
 from service.App import *
+from common.data_store import *
 
 """
 Generate new derived columns according to the signal definitions.
@@ -22,6 +24,8 @@ class P:
     start_index = 0  # 200_000 for 1m btc
     end_index = None
 
+    incremental = False  # Generate only new rows and append them to the existing output file (if the signal sets have not changed)
+
 
 @click.command()
 @click.option('--config_file', '-c', type=click.Path(), default='', help='Configuration file name')
@@ -51,12 +55,10 @@ def main(config_file):
         return
 
     print(f"Loading predictions from input file: {file_path}...")
-    if file_path.suffix == ".parquet":
-        df = pd.read_parquet(file_path)
-    elif file_path.suffix == ".csv":
-        df = pd.read_csv(file_path, parse_dates=[time_column], date_format="ISO8601", nrows=P.in_nrows)
+    if file_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        df = load_data(file_path, time_column, nrows=P.in_nrows)
     else:
-        print(f"ERROR: Unknown extension of the 'predict_file_name' file '{file_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'predict_file_name' file '{file_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
     print(f"Predictions loaded. Length: {len(df)}. Width: {len(df.columns)}")
 
@@ -74,16 +76,22 @@ def main(config_file):
         print(f"ERROR: no signal sets defined. Nothing to process.")
         return
 
+    signal_path = data_path / App.config.get("signal_file_name")
+    input_columns = df.columns.to_list()
+
+    # In incremental mode, only new rows (and the previous rows they need) are generated
+    rows = incremental_rows(df, feature_sets, signal_path, time_column) if P.incremental else None
+    if rows is not None:
+        context_start, start, end = rows
+        if start >= len(df):
+            print(f"No new records in the input data. The output file {signal_path} is up to date.")
+            return
+        print(f"Incremental update of {len(df) - end} new records (using {start - context_start} previous records and generating {end - start} records again).")
+        df = df.iloc[context_start:].reset_index(drop=True)
+
     print(f"Start generating features for {len(df)} input records.")
 
-    all_features = []
-    for i, fs in enumerate(feature_sets):
-        fs_now = datetime.now()
-        print(f"Start feature set {i}/{len(feature_sets)}. Generator {fs.get('generator')}...")
-        df, new_features = generate_feature_set(df, fs, last_rows=0)
-        all_features.extend(new_features)
-        fs_elapsed = datetime.now() - fs_now
-        print(f"Finished feature set {i}/{len(feature_sets)}. Generator {fs.get('generator')}. Features: {len(new_features)}. Time: {str(fs_elapsed).split('.')[0]}")
+    df, all_features = generate_feature_sets(df, feature_sets, last_rows=0, kind="feature")
 
     print(f"Finished generating features.")
 
@@ -104,14 +112,19 @@ def main(config_file):
     #
     out_path = data_path / App.config.get("signal_file_name")
 
-    print(f"Storing signals with {len(out_df)} records and {len(out_df.columns)} columns in output file {out_path}...")
-    if out_path.suffix == ".parquet":
-        out_df.to_parquet(out_path, index=False)
-    elif out_path.suffix == ".csv":
-        out_df.to_csv(out_path, index=False, float_format='%.6f')
+    if rows is not None:
+        out_df = out_df.iloc[start - context_start:]
+        print(f"Appending signals with {len(out_df)} records and {len(out_df.columns)} columns to output file {out_path}...")
+        store_incremental(out_df, out_path, replace_rows=end - start, time_column=time_column)
     else:
-        print(f"ERROR: Unknown extension of the 'signal_file_name' file '{out_path.suffix}'. Only 'csv' and 'parquet' are supported")
-        return
+        print(f"Storing signals with {len(out_df)} records and {len(out_df.columns)} columns in output file {out_path}...")
+        if out_path.suffix in (".parquet", ".csv", ".arrow", ""):
+            store_data(out_df, out_path, time_column, float_format='%.6f')
+        else:
+            print(f"ERROR: Unknown extension of the 'signal_file_name' file '{out_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
+            return
+
+    store_meta(out_df, feature_sets, input_columns, out_path, time_column)
 
     print(f"Signals stored in file: {out_path}. Length: {len(out_df)}. Columns: {len(out_df.columns)}")
 
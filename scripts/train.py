@@ -7,6 +7,8 @@ import numpy as np
 import pandas as pd
 
 from service.App import *
+from common.data_store import *
+from common.utils import *
 from common.gen_features import *
 from common.classifiers import *
 from common.model_store import *
@@ -43,22 +45,25 @@ def main(config_file):
     data_path = Path(App.config["data_folder"]) / symbol
 
     file_path = data_path / App.config.get("matrix_file_name")
-    if not file_path.is_file():
+    if not data_exists(file_path):
         print(f"ERROR: Input file does not exist: {file_path}")
         return
 
+    # Only the columns needed for training are loaded
+    file_columns = data_columns(file_path)
+    columns = [x for x in ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time'] if x in file_columns]
+    columns += [x for x in App.config.get("train_features") + App.config["labels"] if x not in columns]
+
     print(f"Loading data from source data file {file_path}...")
-    if file_path.suffix == ".parquet":
-        df = pd.read_parquet(file_path)
-    elif file_path.suffix == ".csv":
-        df = pd.read_csv(file_path, parse_dates=[time_column], date_format="ISO8601", nrows=P.in_nrows)
+    if file_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        df = load_data(file_path, time_column, columns=columns, nrows=P.in_nrows)
     else:
-        print(f"ERROR: Unknown extension of the 'matrix_file_name' file '{file_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'matrix_file_name' file '{file_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
     print(f"Finished loading {len(df)} records with {len(df.columns)} columns.")
 
-    df = df.iloc[-P.tail_rows:]
-    df = df.reset_index(drop=True)
+    df = df.iloc[-P.tail_rows:].copy(deep=False)  # New columns are added to this frame rather than to the sliced frame
+    df.index = pd.RangeIndex(len(df))
 
     print(f"Input data size {len(df)} records. Range: [{df.iloc[0][time_column]}, {df.iloc[-1][time_column]}]")
 
@@ -76,21 +81,21 @@ def main(config_file):
     # Select necessary features and labels
     out_columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time']
     out_columns = [x for x in out_columns if x in df.columns]
-    all_features = train_features + labels
-    df = df[out_columns + [x for x in all_features if x not in out_columns]]
+    # Only these columns have been loaded. Rows are selected below by slicing (if possible) so that the data is not copied
 
     for label in labels:
         # "category" NN does not work without this (note that we assume a classification task here)
         df[label] = df[label].astype(int)
 
+    df = replace_infinite(df, train_features)
+
     # Remove the tail data for which no (correct) labels are available
     # The reason is that these labels are computed from future values which are not available and hence labels might be wrong
     if label_horizon:
         df = df.head(-label_horizon)
 
-    df.replace([np.inf, -np.inf], np.nan, inplace=True)
     #df = df.dropna(subset=labels)
-    df = df.dropna(subset=train_features)
+    df = dropna_rows(df, train_features)
     if len(df) == 0:
         print(f"ERROR: Empty data set after removing NULLs in feature columns. Some features might have all NULL values.")
         #print(df.isnull().sum().sort_values(ascending=False))
@@ -100,7 +105,7 @@ def main(config_file):
     if train_length:
         df = df.tail(train_length)
 
-    df = df.reset_index(drop=True)  # To remove gaps in index before use
+    df.index = pd.RangeIndex(len(df))  # To remove gaps in index before use (without copying the data)
 
     #
     # Train feature models
@@ -171,12 +176,10 @@ def main(config_file):
         out_path = data_path / App.config.get("predict_file_name")
 
         print(f"Storing predictions with {len(out_df)} records and {len(out_df.columns)} columns in output file {out_path}...")
-        if out_path.suffix == ".parquet":
-            out_df.to_parquet(out_path, index=False)
-        elif out_path.suffix == ".csv":
-            out_df.to_csv(out_path, index=False, float_format='%.6f')
+        if out_path.suffix in (".parquet", ".csv", ".arrow", ""):
+            store_data(out_df, out_path, time_column, float_format='%.6f')
         else:
-            print(f"ERROR: Unknown extension of the 'predict_file_name' file '{out_path.suffix}'. Only 'csv' and 'parquet' are supported")
+            print(f"ERROR: Unknown extension of the 'predict_file_name' file '{out_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
             return
 
         print(f"Predictions stored in file: {out_path}. Length: {len(out_df)}. Columns: {len(out_df.columns)}")
@@ -9,6 +9,7 @@ from sklearn.metrics import (precision_recall_curve, PrecisionRecallDisplay, Roc
 from sklearn.model_selection import ParameterGrid
 
 from service.App import *
+from common.data_store import *
 from common.utils import *
 from common.gen_signals import *
 from common.classifiers import *
@@ -62,12 +63,10 @@ def main(config_file):
         return
 
     print(f"Loading signals from input file: {file_path}")
-    if file_path.suffix == ".parquet":
-        df = pd.read_parquet(file_path)
-    elif file_path.suffix == ".csv":
-        df = pd.read_csv(file_path, parse_dates=[time_column], date_format="ISO8601", nrows=P.in_nrows)
+    if file_path.suffix in (".parquet", ".csv", ".arrow", ""):
+        df = load_data(file_path, time_column, nrows=P.in_nrows)
     else:
-        print(f"ERROR: Unknown extension of the 'signal_file_name' file '{file_path.suffix}'. Only 'csv' and 'parquet' are supported")
+        print(f"ERROR: Unknown extension of the 'signal_file_name' file '{file_path.suffix}'. Only 'csv', 'parquet', 'arrow' and data sets (no extension) are supported")
         return
 
     print(f"Signals loaded. Length: {len(df)}. Width: {len(df.columns)}")
@@ -29,6 +29,10 @@ class App:
     bm = None
     conn_key = None  # Socket
 
+    event_writer = None  # Writes stream events to files in a separate thread
+
+    order_books = {}  # Local order books (symbol -> OrderBook) maintained from diff-depth stream events
+
     #
     # State of the server (updated after each interval)
     #
@@ -76,10 +80,12 @@ class App:
         #
         "merge_file_name": "data.csv",
         "feature_file_name": "features.csv",
-        "matrix_file_name": "matrix.csv",
+        "matrix_file_name": "matrix.csv",  # "matrix.arrow" is memory-mapped by train and predict-rolling without loading it into memory
         "predict_file_name": "predictions.csv",  # predict, predict-rolling
         "signal_file_name": "signals.csv",
         "signal_models_file_name": "signal_models",
+        # File names without extension are data sets (folders with parquet files partitioned by month)
+        "source_format": "csv",  # Format of downloaded data (klines): csv, parquet or dataset
 
         "model_folder": "MODELS",
 
@@ -177,6 +183,7 @@ class App:
                 "symbols": ["BTCUSDT", "ETHBTC", "ETHUSDT", "IOTAUSDT", "IOTABTC", "IOTAETH"],
                 "limit": 100,  # Legal values (depth): '5, 10, 20, 50, 100, 500, 1000, 5000' <100 weight=1
                 "freq": "1min",  # Pandas frequency
+                "format": "txt",  # txt (one json line per order book) or bin (fixed-size binary records, see common/depth_store.py)
             },
             "stream": {
                 "folder": "STREAM",
@@ -184,7 +191,12 @@ class App:
                 # For kline channel: <symbol>@kline_<interval>, Event type: "e": "kline", Symbol: "s": "BNBBTC"
                 # For depth channel: <symbol>@depth<levels>[@100ms], Event type: NO, Symbol: NO
                 # btcusdt@ticker
-                "channels": ["kline_1m", "depth20"],  # kline_1m, depth20, depth5
+                # For diff depth channel: <symbol>@depth[@100ms], Event type: "e": "depthUpdate". Events also update local order books
+                "channels": ["kline_1m", "depth20"],  # kline_1m, depth20, depth5, depth@100ms
+                "snapshot_limit": 1000,  # Levels of the order book snapshot requested to (re)synchronize a local order book
+                "max_events": 100_000,  # Events waiting for the writer. If exceeded, the stream waits (block) or new events are dropped (drop)
+                "overflow": "block",  # block, drop
+                "compression": None,  # None or gzip
                 "symbols": ["BTCUSDT", "ETHBTC", "ETHUSDT", "IOTAUSDT", "IOTABTC", "IOTAETH"],
                 # "BTCUSDT", "ETHBTC", "ETHUSDT", "IOTAUSDT", "IOTABTC", "IOTAETH"
             }
@@ -3,7 +3,6 @@ from typing import Union
 import json
 import pickle
 from datetime import datetime, date, timedelta
-import queue
 
 import numpy as np
 import pandas as pd
@@ -12,8 +11,11 @@ from service.App import *
 from common.utils import *
 from common.classifiers import *
 from common.model_store import *
-from common.generators import generate_feature_set
-from common.generators import predict_feature_set
+from common.kline_buffer import KlineBuffer
+from common.depth_store import DepthWriter
+from common.gen_features_rolling_agg import OnlineFeatureEngine, online_aggregation
+from common.generators import generate_feature_sets
+from common.generators import predict_feature_set, build_scoring_plan
 
 from scripts.merge import *
 from scripts.features import *
@@ -44,11 +46,15 @@ class Analyzer:
         # Data state
         #
 
-        # Klines are stored as a dict of lists. Key is a symbol and the list is a list of latest kline records
-        # One kline record is a list of values (not dict) as returned by API: open time, open, high, low, close, volume etc.
+        # Klines are stored as a dict of ring buffers. Key is a symbol and the buffer stores latest klines in typed columns
+        # The buffer capacity is equal to the history length needed to compute features
         self.klines = {}
 
-        self.queue = queue.Queue()
+        # Open files with binary order books (created when the first order book is stored)
+        self.depth_writer = None
+
+        # State of rolling aggregations which are computed incrementally for last rows between analysis cycles
+        self.feature_engine = OnlineFeatureEngine()
 
         #
         # Load models
@@ -63,7 +69,11 @@ class Analyzer:
 
         labels = App.config["labels"]
         algorithms = App.config["algorithms"]
-        self.models = load_models(model_path, labels, algorithms)
+        # Models are loaded on first use and reloaded after they have been retrained
+        self.models = ModelRegistry(model_path, labels, algorithms)
+
+        # Scoring plans of the train feature sets (built in the first analysis and after models have changed)
+        self.scoring_plans = None
 
         # Load latest transaction and (simulated) trade state
         App.transaction = load_last_transaction()
@@ -73,21 +83,20 @@ class Analyzer:
     #
 
     def get_klines_count(self, symbol):
-        return len(self.klines.get(symbol, []))
+        klines_data = self.klines.get(symbol)
+        return len(klines_data) if klines_data is not None else 0
 
     def get_last_kline(self, symbol):
         if self.get_klines_count(symbol) > 0:
-            return self.klines.get(symbol)[-1]
+            return self.klines.get(symbol).get_last_kline()
         else:
             return None
 
     def get_last_kline_ts(self, symbol):
         """Open time of the last kline. It is simultaneously kline id. Add 1m if the end is needed."""
-        last_kline = self.get_last_kline(symbol=symbol)
-        if not last_kline:
+        if self.get_klines_count(symbol) == 0:
             return 0
-        last_kline_ts = last_kline[0]
-        return last_kline_ts
+        return self.klines.get(symbol).get_last_timestamp()
 
     def get_missing_klines_count(self, symbol):
         """
@@ -124,40 +133,18 @@ class Analyzer:
             # If symbol does not exist then create
             klines_data = self.klines.get(symbol)
             if klines_data is None:
-                self.klines[symbol] = []
-                klines_data = self.klines.get(symbol)
-
-            ts = klines[0][0]  # Very first timestamp of the new data
-
-            # Find kline with this or younger timestamp in the database
-            # same_kline = next((x for x in klines_data if x[0] == ts), None)
-            existing_indexes = [i for i, x in enumerate(klines_data) if x[0] >= ts]
-            #print(f"===>>> Existing tss: {[x[0] for x in klines_data]}")
-            #print(f"===>>> New tss: {[x[0] for x in klines]}")
-            #print(f"===>>> {symbol} Overlap {len(existing_indexes)}. Existing Indexes: {existing_indexes}")
-            if existing_indexes:  # If there is overlap with new klines
-                start = min(existing_indexes)
-                num_deleted = len(klines_data) - start
-                del klines_data[start:]  # Delete starting from the first kline in new data (which will be added below)
-                if len(klines) < num_deleted:  # It is expected that we add same or more klines than deleted
-                    log.error("More klines is deleted by new klines added, than we actually add. Something woring with timestamps and storage logic.")
-
-            # Append new klines
-            klines_data.extend(klines)
-
-            # Remove too old klines
-            kline_window = App.config["features_horizon"]
-            to_delete = len(klines_data) - kline_window
-            if to_delete > 0:
-                del klines_data[:to_delete]
+                klines_data = KlineBuffer(App.config["features_horizon"])
+                self.klines[symbol] = klines_data
+
+            # Existing klines with the same or younger timestamps will be overwritten by the new klines
+            # Too old klines are removed because the buffer stores only the latest klines
+            num_deleted = klines_data.append_klines(klines)
+            if len(klines) < num_deleted:  # It is expected that we add same or more klines than deleted
+                log.error("More klines is deleted by new klines added, than we actually add. Something woring with timestamps and storage logic.")
 
             # Check validity. It has to be an ordered time series with certain frequency
-            for i, kline in enumerate(self.klines.get(symbol)):
-                ts = kline[0]
-                if i > 0:
-                    if ts - prev_ts != interval_length_ms:
-                        log.error("Wrong sequence of klines. They are expected to be a regular time series with 1m frequency.")
-                prev_ts = kline[0]
+            if not klines_data.is_regular(interval_length_ms):
+                log.error("Wrong sequence of klines. They are expected to be a regular time series with 1m frequency.")
 
             # Debug message about the last received kline end and current ts (which must be less than 1m - rather small delay)
             log.debug(f"Stored klines. Total {len(klines_data)} in db. Last kline end: {self.get_last_kline_ts(symbol)+interval_length_ms}. Current time: {now_ts}")
@@ -176,6 +163,8 @@ class Analyzer:
         # BASE_DIR = Path(__file__).resolve().parent.parent
         # BASE_DIR = Path.cwd()
 
+        depth_format = App.config["collector"]["depth"].get("format", "txt")
+
         for depth in depths:
             # TODO: The result might be an exception or some other object denoting bad return (timeout, cancelled etc.)
 
@@ -186,6 +175,20 @@ class Analyzer:
             path.mkdir(parents=True, exist_ok=True)  # Ensure that dir exists
 
             file_name = f"depth-{symbol}-{freq}"
+
+            if depth_format == "bin":
+                if not depth.get("bids") or not depth.get("asks"):
+                    log.warning(f"Order book for {symbol} has no bids or asks and is not stored. Response: {depth}")
+                    continue
+                if self.depth_writer is None:
+                    self.depth_writer = DepthWriter(
+                        levels=App.config["collector"]["depth"]["limit"],
+                        flush_period=App.config["collector"]["flush_period"],
+                    )
+                # The file is kept open and written through a buffer
+                self.depth_writer.write(Path(path, file_name).with_suffix(".bin"), depth)
+                continue
+
             file = Path(path, file_name).with_suffix(".txt")
 
             # Append to the file (create if it does not exist)
@@ -193,69 +196,6 @@ class Analyzer:
             with open(file, 'a+') as f:
                 f.write(json_line + "\n")
 
-    def store_queue(self):
-        """
-        Persistently store the queue data to one or more files corresponding to the stream (event) type, symbol (and frequency).
-
-        :return:
-        """
-        #
-        # Get all the data from the queue
-        #
-        events = {}
-        item = None
-        while True:
-            try:
-                item = self.queue.get_nowait()
-            except queue.Empty as ee:
-                break
-            except:
-                break
-
-            if item is None:
-                break
-
-            c = item.get("e")  # Channel
-            if not events.get(c):  # Insert if does not exit
-                events[c] = {}
-            symbols = events[c]
-
-            s = item.get("s")  # Symbol
-            if not symbols.get(s):  # Insert if does not exit
-                symbols[s] = []
-            data = symbols[s]
-
-            data.append(item)
-
-            self.queue.task_done()  # TODO: Do we really need this?
-
-        # File name like TRADE_HOME/COLLECT/DEPTH/depth-BTCUSDT-5s.txt
-        TRADE_DATA = "."  # TODO: We need to read it from the environment. It could be data dir or docker volume.
-        # BASE_DIR = Path(__file__).resolve().parent.parent
-        # BASE_DIR = Path.cwd()
-
-        path = Path(TRADE_DATA).joinpath(App.config["collector"]["folder"])
-        path = path.joinpath(App.config["collector"]["stream"]["folder"])
-        path.mkdir(parents=True, exist_ok=True)  # Ensure that dir exists
-
-        now = datetime.utcnow()
-        #rotate_suffix = f"{now:%Y}{now:%m}{now:%d}"  # Daily files
-        rotate_suffix = f"{now:%Y}{now:%m}"  # Monthly files
-
-        #
-        # Get all the data from the queue and store in file
-        #
-        for c, symbols in events.items():
-            for s, data in symbols.items():
-                file_name = f"{c}-{s}-{rotate_suffix}"
-                file = Path(path, file_name).with_suffix(".txt")
-
-                # Append to the file (create if it does not exist)
-                data = [json.dumps(event) for event in data]
-                data_str = "\n".join(data)
-                with open(file, 'a+') as f:
-                    f.write(data_str + "\n")
-
     #
     # Analysis (features, predictions, signals etc.)
     #
@@ -284,27 +224,26 @@ class Analyzer:
         if not data_sources:
             data_sources = [{"folder": App.config["symbol"], "file": "klines", "column_prefix": ""}]
 
-        # Read data from online sources into data frames
+        # Online sources are kline buffers which are merged directly (without converting them to data frames)
         for ds in data_sources:
             if ds.get("file") == "klines":
                 try:
                     klines = self.klines.get(ds.get("folder"))
-                    df = binance_klines_to_df(klines)
 
                     # Validate
-                    source_columns = ['open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_av', 'trades', 'tb_base_av', 'tb_quote_av']
-                    if df.isnull().any().any():
-                        null_columns = {k: v for k, v in df.isnull().any().to_dict().items() if v}
+                    source_columns = ['open', 'high', 'low', 'close', 'volume', 'quote_av', 'tb_base_av', 'tb_quote_av']
+                    null_columns = [c for c in source_columns if np.isnan(klines.column(c)).any()]
+                    if null_columns:
                         log.warning(f"Null in source data found. Columns with Null: {null_columns}")
                     # TODO: We might receive empty strings or 0s in numeric data - how can we detect them?
                     # TODO: Check that timestamps in 'close_time' are strictly consecutive
                 except Exception as e:
-                    log.error(f"Error in klines_to_df method: {e}. Length klines: {len(klines)}")
+                    log.error(f"Error in klines validation: {e}. Length klines: {self.get_klines_count(ds.get('folder'))}")
                     return
             else:
                 log.error("Unknown data sources. Currently only 'klines' is supported. Check 'data_sources' in config, key 'file'")
                 return
-            ds["df"] = df
+            ds["buffer"] = klines
 
         #
         # 1.
@@ -322,10 +261,9 @@ class Analyzer:
             return
 
         # Apply all feature generators to the data frame which get accordingly new derived columns
-        feature_columns = []
-        for fs in feature_sets:
-            df, feats = generate_feature_set(df, fs, last_rows=last_rows if not ignore_last_rows else 0)
-            feature_columns.extend(feats)
+        engine = self.feature_engine if not ignore_last_rows else None
+        with online_aggregation(engine):
+            df, feature_columns = generate_feature_sets(df, feature_sets, last_rows=last_rows if not ignore_last_rows else 0)
 
         # Shorten the data frame. Only several last rows will be needed and not the whole data context
         if not ignore_last_rows:
@@ -353,11 +291,18 @@ class Analyzer:
             log.error(f"ERROR: no train feature sets defined. Nothing to process.")
             return
 
+        # New versions of retrained models are used from this cycle
+        changed = self.models.refresh()
+        if changed:
+            log.info(f"New versions of models loaded: {changed}")
+        if changed or self.scoring_plans is None:
+            self.scoring_plans = [build_scoring_plan(fs, App.config, self.models) for fs in train_feature_sets]
+
         # Apply all train feature generators to the data frame by generating predicted columns
         score_df = pd.DataFrame(index=predict_df.index)
         train_feature_columns = []
-        for fs in train_feature_sets:
-            fs_df, feats, _ = predict_feature_set(predict_df, fs, App.config, self.models)
+        for fs, plan in zip(train_feature_sets, self.scoring_plans):
+            fs_df, feats, _ = predict_feature_set(predict_df, fs, App.config, self.models, plan)
             score_df = pd.concat([score_df, fs_df], axis=1)
             train_feature_columns.extend(feats)
 
@@ -374,10 +319,7 @@ class Analyzer:
             return
 
         # Apply all feature generators to the data frame which get accordingly new derived columns
-        signal_columns = []
-        for fs in signal_sets:
-            df, feats = generate_feature_set(df, fs, last_rows=last_rows if not ignore_last_rows else 0)
-            signal_columns.extend(feats)
+        df, signal_columns = generate_feature_sets(df, signal_sets, last_rows=last_rows if not ignore_last_rows else 0)
 
         #
         # Append the new rows to the main data frame with all previously computed data
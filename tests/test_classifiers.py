@@ -35,3 +35,157 @@ def test_nan_handling_predict():
 
 	pass
 
+
+
+def test_numpy_network(tmp_path):
+	from common.model_store import save_model_pair, load_model_pair
+
+	rng = np.random.default_rng(0)
+	df_X = pd.DataFrame(rng.normal(size=(200, 4)), columns=["a", "b", "c", "d"])
+	df_y = (df_X["a"] + df_X["b"] > 0).astype(int)
+	model_config = dict(params=dict(layers=[3, 2], learning_rate=0.1, n_epochs=2, bs=32), train=dict(is_scale=True))
+
+	model_pair = train_nn(df_X, df_y, model_config)
+	y_hat = predict_nn(model_pair, df_X, model_config)
+
+	# Network exported with the model is loaded without Keras and predicts the same
+	save_model_pair(tmp_path, "high_10_nn", model_pair)
+	numpy_pair = load_model_pair(tmp_path, "high_10_nn")
+	assert isinstance(numpy_pair[0], NumpyNetwork)
+	np.testing.assert_allclose(predict_nn(numpy_pair, df_X, model_config), y_hat, atol=1e-5)
+
+	pass
+
+
+def test_tree_ensemble(tmp_path):
+	from common.model_store import save_model_pair, load_model_pair
+
+	rng = np.random.default_rng(0)
+	df_X = pd.DataFrame(rng.normal(size=(500, 4)), columns=["a", "b", "c", "d"])
+	df_y = (df_X["a"] + df_X["b"] * df_X["c"] > 0).astype(int)
+	df_X_test = df_X.copy()
+	df_X_test.iloc[3, 1] = np.nan
+	model_config = dict(params=dict(objective="cross_entropy", max_depth=3, learning_rate=0.1, num_boost_round=50), train=dict(is_scale=True))
+
+	model_pair = train_gb(df_X, df_y, model_config)
+	y_hat = predict_gb(model_pair, df_X_test, model_config)
+
+	# Trees exported with the model predict the same as the booster
+	save_model_pair(tmp_path, "high_10_gb", model_pair)
+	trees_pair = load_model_pair(tmp_path, "high_10_gb")
+	assert isinstance(trees_pair[0], TreeEnsemble)
+	pd.testing.assert_series_equal(predict_gb(trees_pair, df_X_test, model_config), y_hat, rtol=1e-12)
+
+	# Missing values are handled like in LightGBM
+	X = df_X.to_numpy().copy()
+	X[::7, 0] = np.nan
+	X[::5, 2] = 0.0
+	np.testing.assert_allclose(trees_pair[0].predict(X), model_pair[0].predict(X), rtol=1e-12)
+
+	# Trees with one split are summed using lookup tables
+	model_config["params"]["max_depth"] = 1
+	model_pair = train_gb(df_X, df_y, model_config)
+	trees = TreeEnsemble.from_lightgbm(model_pair[0])
+	assert trees.depth == 1
+	np.testing.assert_allclose(trees.predict(df_X.to_numpy()), model_pair[0].predict(df_X.to_numpy()), rtol=1e-12)
+
+	# Export of the previous model is removed if the new model cannot be exported
+	lc_pair = train_lc(df_X, df_y, dict(params=dict(C=0.5), train=dict(is_scale=True)))
+	save_model_pair(tmp_path, "high_10_gb", lc_pair)
+	assert not (tmp_path / "high_10_gb.npz").is_file()
+	assert load_model_pair(tmp_path, "high_10_gb")[0].C == 0.5
+
+	pass
+
+
+def test_scoring_plan():
+	rng = np.random.default_rng(0)
+	df_X = pd.DataFrame(rng.normal(size=(300, 3)), columns=["a", "b", "c"])
+	df_y = (df_X["a"] + 0.5 * rng.normal(size=300) > 0).astype(int)
+	df_X_test = df_X.iloc[:20].copy()
+	df_X_test.iloc[5, 0] = np.nan
+
+	configs = {
+		"lc": dict(params=dict(max_iter=200), train=dict(is_scale=True)),
+		"lc2": dict(params=dict(C=0.1), train=dict(is_scale=True, shifts=[1, 2])),
+		"svc": dict(params=dict(kernel="linear"), train=dict(is_scale=True)),
+		"svc2": dict(params=dict(kernel="rbf"), train=dict(is_scale=True)),
+		"gb": dict(params=dict(objective="cross_entropy", max_depth=1, learning_rate=0.1, num_boost_round=20), train=dict(is_scale=False)),
+	}
+	train = dict(lc=train_lc, lc2=train_lc, svc=train_svc, svc2=train_svc, gb=train_gb)
+	predict = dict(lc=predict_lc, lc2=predict_lc, svc=predict_svc, svc2=predict_svc, gb=predict_gb)
+
+	models = []
+	expected = pd.DataFrame(index=df_X_test.index)
+	for name, config in configs.items():
+		model_pair = train[name](df_X, df_y, config)
+		models.append((f"high_{name}", model_pair, config))
+		expected[f"high_{name}"] = predict[name](model_pair, df_X_test, config)
+
+	# Models with the same scaler share the transformation and linear models are evaluated together
+	plan = ScoringPlan(["a", "b", "c"], models)
+	assert len(plan.groups) == 3
+	assert plan.groups[0]["weights"].shape == (3, 2)
+
+	pd.testing.assert_frame_equal(plan.predict(df_X_test), expected, rtol=1e-9)
+
+	# Shifts longer than the scored rows give missing values like double_columns
+	config = dict(params=dict(C=0.1), train=dict(is_scale=True, shifts=[1, 30]))
+	model_pair = train_lc(df_X, df_y, config)
+	plan = ScoringPlan(["a", "b", "c"], [("high_lc", model_pair, config)])
+	assert double_columns(df_X_test, [1, 30]).isnull().any(axis=1).all()
+	assert plan.predict(df_X_test)["high_lc"].isnull().all()
+	df = df_X.iloc[:40]
+	pd.testing.assert_series_equal(plan.predict(df)["high_lc"], predict_lc(model_pair, df, config), check_names=False, rtol=1e-9)
+
+	# Scalers which do not subtract the mean or do not divide by the standard deviation
+	from sklearn.preprocessing import StandardScaler
+	config = dict(params=dict(C=0.1), train=dict(is_scale=False))
+	for scaler in (StandardScaler(with_mean=False), StandardScaler(with_std=False)):
+		scaler.fit(df_X)
+		model = train_lc(pd.DataFrame(scaler.transform(df_X), columns=df_X.columns), df_y, config)[0]
+		plan = ScoringPlan(["a", "b", "c"], [("high_lc", (model, scaler), config)])
+		expected = model.predict_proba(scaler.transform(df_X_test.fillna(0.0)))[:, 1]
+		np.testing.assert_allclose(plan.predict(df_X_test.fillna(0.0))["high_lc"], expected, rtol=1e-9)
+
+	pass
+
+
+def test_model_registry(tmp_path):
+	from common.model_store import save_model_pair, ModelRegistry
+
+	df_X = pd.DataFrame({"x": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+	df_y = pd.Series([0, 0, 1, 0, 1, 1])
+	model_config = dict(params=dict(C=1.0), train=dict(is_scale=True))
+	save_model_pair(tmp_path, "high_10_lc", train_lc(df_X, df_y, model_config))
+
+	registry = ModelRegistry(tmp_path, ["high_10"], [{"name": "lc"}])
+	assert list(registry) == ["high_10_lc"] and not registry.models  # Loaded on first access
+	model_pair = registry["high_10_lc"]
+	assert registry.versions["high_10_lc"] == 1
+	assert registry.refresh() == []
+
+	# Retrained model is loaded after its files have not changed for one check
+	model_config["params"]["C"] = 0.01
+	save_model_pair(tmp_path, "high_10_lc", train_lc(df_X, df_y, model_config))
+	assert registry.refresh() == []
+	assert registry["high_10_lc"] is model_pair
+	assert registry.refresh() == ["high_10_lc"]
+	assert registry.versions["high_10_lc"] == 2
+	assert registry["high_10_lc"][0].C == 0.01
+
+	pass
+
+
+def test_algorithm_backends():
+	train, predict = get_algorithm_backend("lc")
+	assert train is train_lc and predict is predict_lc
+
+	register_algorithm("lc2", "common.classifiers:train_lc", predict_lc)
+	assert get_algorithm_backend("lc2") == (train_lc, predict_lc)
+	del algorithm_backends["lc2"]
+
+	with pytest.raises(ValueError):
+		get_algorithm_backend("unknown")
+
+	pass
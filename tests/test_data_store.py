@@ -0,0 +1,102 @@
+import pytest
+
+from common.utils import *
+from common.data_store import *
+
+
+def _df(start, periods):
+	times = pd.date_range(start, periods=periods, freq="D")
+	return pd.DataFrame({"timestamp": times, "close": np.arange(periods, dtype=float), "count": np.arange(periods)})
+
+
+def test_data_set(tmp_path):
+	path = tmp_path / "klines"
+	df = _df("2024-01-20", 30)  # Two partitions
+	store_data(df, path, "timestamp")
+
+	assert is_dataset(path) and data_exists(path)
+	assert sorted(p.name for p in path.iterdir()) == ["month=2024-01", "month=2024-02"]
+	assert data_columns(path) == ["timestamp", "close", "count"]
+	pd.testing.assert_frame_equal(load_data(path, "timestamp"), df, check_dtype=False)
+
+	# The last row is replaced and new rows are appended. The first partition is not rewritten
+	first_file = path / "month=2024-01" / "part-0.parquet"
+	mtime = first_file.stat().st_mtime_ns
+	new_df = _df("2024-02-18", 20)
+	new_df["count"] = new_df["count"].astype("int32")  # Converted to the type of the stored data
+	append_data(new_df, path, "timestamp")
+	assert first_file.stat().st_mtime_ns == mtime
+
+	df_ref = pd.concat([df.iloc[:-1], new_df], ignore_index=True)
+	df = load_data(path, "timestamp")
+	assert df["count"].dtype == np.int64
+	pd.testing.assert_frame_equal(df, df_ref, check_dtype=False)
+
+	# Filters are applied while reading
+	df = load_data(path, "timestamp", columns=["close"], start="2024-02-01", end="2024-03-01")
+	assert df.columns.to_list() == ["timestamp", "close"]
+	assert len(df) == 29 and df["timestamp"].iloc[0] == pd.Timestamp("2024-02-01")
+
+	df = load_data(path, "timestamp", tail_rows=3)
+	pd.testing.assert_frame_equal(df, df_ref.iloc[-3:].reset_index(drop=True), check_dtype=False)
+
+	pass
+
+
+def test_arrow_matrix(tmp_path):
+	path = tmp_path / "matrix.arrow"
+	df = _df("2024-01-01", 10)
+	df.loc[:1, "close"] = np.nan  # NaNs in the head like in features computed over windows
+	store_data(df, path, "timestamp")
+
+	# Numeric columns are mapped rather than loaded
+	matrix = load_data(path, "timestamp", columns=["close"])
+	pd.testing.assert_frame_equal(matrix, df[["timestamp", "close"]])
+	assert not matrix["close"].to_numpy().flags.writeable
+
+	# Contiguous valid rows are selected without copying
+	rows = dropna_rows(matrix, ["close"])
+	assert len(rows) == 8
+	assert np.shares_memory(rows["close"].to_numpy(), matrix["close"].to_numpy())
+
+	df.loc[5, "close"] = np.inf
+	rows = dropna_rows(replace_infinite(df, ["close"]), ["close"])
+	assert rows.index.to_list() == [2, 3, 4, 6, 7, 8, 9]
+
+	pass
+
+
+def test_append_csv(tmp_path):
+	path = tmp_path / "klines.csv"
+	df = _df("2024-01-01", 100)
+	store_data(df, path, "timestamp")
+
+	# Only the tail is read
+	pd.testing.assert_frame_equal(load_data(path, "timestamp", tail_rows=3), df.iloc[-3:].reset_index(drop=True))
+
+	# Two last rows are replaced
+	new_df = _df("2024-04-08", 5)[["count", "timestamp", "close"]]
+	append_data(new_df, path, "timestamp")
+
+	df_ref = pd.concat([df.iloc[:-2], new_df[df.columns]], ignore_index=True)
+	pd.testing.assert_frame_equal(load_data(path, "timestamp"), df_ref)
+
+	pass
+
+
+def test_compact_data(tmp_path):
+	path = tmp_path / "klines"
+	df = _df("2024-01-01", 20)
+	store_data(df.iloc[:5], path, "timestamp")
+	for i in range(5, 20, 5):
+		append_data(df.iloc[i:i + 5], path, "timestamp")  # Each append adds a segment
+	append_data(df.iloc[18:], path, "timestamp")  # Only the last segment is rewritten
+
+	month_path = path / "month=2024-01"
+	assert len(list(month_path.glob("*.parquet"))) == 4
+
+	assert compact_data(path, min_segments=2) == 1
+	assert [f.name for f in month_path.iterdir()] == ["part-0.parquet"]
+	pd.testing.assert_frame_equal(load_data(path, "timestamp"), df, check_dtype=False)
+
+	pass
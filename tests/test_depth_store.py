@@ -0,0 +1,48 @@
+import pytest
+
+from common.utils import *
+from common.depth_processing import *
+from common.depth_store import *
+
+
+def _order_book(i):
+	return {
+		"timestamp": 60_000 * i, "requestTime": 60_000 * i + 5, "responseTime": 60_000 * i + 50,
+		"bids": [[f"{100.0 - 0.5 * k:.8f}", f"{1.0 + k + i:.8f}"] for k in range(10)],
+		"asks": [[f"{100.5 + 0.5 * k:.8f}", f"{2.0 + k:.8f}"] for k in range(8)],  # Shorter than the levels
+	}
+
+
+def test_depth_store(tmp_path):
+	path = tmp_path / "depth-BTCUSDT-1m.bin"
+	writer = DepthWriter(levels=10)
+	for i in range(3):
+		writer.write(path, _order_book(i))
+	writer.close()
+
+	# Incomplete record is ignored by the reader and overwritten by the writer
+	with open(path, "ab") as f:
+		f.write(b"\x00" * 10)
+	assert len(read_depth(path)) == 3
+	writer = DepthWriter(levels=10)
+	writer.write(path, _order_book(3))
+	writer.close()
+
+	records = read_depth(path)
+	assert list(records["timestamp"]) == [0, 60_000, 120_000, 180_000]
+	assert list(records["ask_count"]) == [8] * 4
+	assert np.isnan(records["asks"][:, 8:]).all()
+
+	# Features are the same as for order books with parsed strings
+	for entry, record in zip([_order_book(i) for i in range(4)], depth_entries(records)):
+		entry["bids"] = [[float(p), float(v)] for p, v in entry["bids"]]
+		entry["asks"] = [[float(p), float(v)] for p, v in entry["asks"]]
+		assert depth_to_features(record, [1, 2, 5], 1.0) == pytest.approx(depth_to_features(entry, [1, 2, 5], 1.0))
+
+	# Batch features of the (padded) records are the same as features of each order book
+	df = depth_features_batch(records["timestamp"], records["bids"], records["asks"], [1, 2, 5], 1.0)
+	assert df["timestamp"].to_list() == [0, 60_000, 120_000, 180_000]
+	for i, record in enumerate(depth_entries(records)):
+		assert df.iloc[i].to_dict() == pytest.approx(depth_to_features(record, [1, 2, 5], 1.0))
+
+	pass
@@ -0,0 +1,48 @@
+import pytest
+
+from common.utils import *
+from common.event_writer import *
+from common.order_book import read_events
+
+
+def _event(i, channel="depthUpdate", symbol="BTCUSDT"):
+	return {"e": channel, "E": i, "s": symbol, "U": i, "u": i, "b": [], "a": []}
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_event_writer(tmp_path, compression):
+	writer = EventWriter(tmp_path, flush_size=100, compression=compression)
+	writer.start()
+	for i in range(50):
+		writer.put(_event(i))
+		writer.put(_event(i, "kline", "ETHUSDT"))
+	writer.close()
+
+	assert writer.stats()["written"] == 100 and writer.stats()["dropped"] == 0
+	files = sorted(p.name for p in tmp_path.iterdir())
+	assert len(files) == 2 and files[0].startswith("depthUpdate-BTCUSDT-")
+
+	# Events are appended to the existing files
+	writer = EventWriter(tmp_path, compression=compression)
+	writer.start()
+	writer.put(_event(50))
+	writer.close()
+
+	events = list(read_events(tmp_path / files[0]))
+	assert [e["E"] for e in events] == list(range(51))
+
+	pass
+
+
+def test_event_writer_drop(tmp_path):
+	# Writer thread is not started so the queue is not consumed
+	writer = EventWriter(tmp_path, max_events=10, overflow="drop")
+	results = [writer.put(_event(i)) for i in range(15)]
+	assert results == [True] * 10 + [False] * 5
+	assert writer.stats()["dropped"] == 5
+
+	writer.start()
+	writer.close()
+	assert writer.stats()["written"] == 10
+
+	pass
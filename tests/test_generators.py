@@ -0,0 +1,76 @@
+import pytest
+
+from common.utils import *
+from common.generators import *
+
+
+def test_plan_feature_sets():
+	feature_sets = [
+		{"column_prefix": "", "generator": "talib", "feature_prefix": "", "config": {"columns": ["close"], "functions": ["SMA"], "windows": [5]}},
+		{"column_prefix": "", "generator": "itblib", "feature_prefix": "", "config": {"base_window": 10}},
+		{"column_prefix": "", "generator": "talib", "feature_prefix": "", "config": {"columns": ["close_SMA_5"], "functions": ["SMA"], "windows": [3]}},
+		{"column_prefix": "", "generator": "talib", "feature_prefix": "", "config": {"columns": ["close"], "functions": ["SMA"], "windows": [5]}},
+		{"column_prefix": "", "generator": "combine", "feature_prefix": "", "config": {}},
+	]
+	plan = plan_feature_sets(feature_sets, ["open", "close"])
+
+	assert [p["depends_on"] for p in plan] == [[], [], [0, 1], [], [0, 1, 2, 3]]
+	assert [p["duplicate_of"] for p in plan] == [None, None, None, 0, None]
+
+	pass
+
+
+def test_generate_feature_sets():
+	rng = np.random.default_rng(0)
+	close = 100 + np.cumsum(rng.normal(size=500))
+	df = pd.DataFrame({"close": close, "volume": rng.uniform(1, 10, size=500)})
+
+	feature_sets = [
+		{"generator": "itbstats", "config": {"columns": "close", "functions": ["mean", "std", "slope"], "windows": [5, 20]}},
+		{"generator": "talib", "config": {"columns": "close", "functions": ["SMA", "STDDEV"], "windows": [5, 20]}},
+		{"generator": "itbstats", "config": {"columns": "close", "functions": ["mean", "slope"], "windows": [20, 60], "names": ["m20", "s20", "m60", "s60"]}},
+		{"generator": "talib", "config": {"columns": "close", "functions": ["SMA", "STDDEV"], "windows": [5, 20]}},
+	]
+
+	# The same result as applying each feature set separately
+	df_ref = df.copy()
+	features_ref = []
+	for fs in feature_sets:
+		df_ref, new_features = generate_feature_set(df_ref, fs, last_rows=0)
+		features_ref.extend(new_features)
+
+	df_out, features = generate_feature_sets(df.copy(), feature_sets)
+
+	assert features == features_ref
+	pd.testing.assert_frame_equal(df_out, df_ref)
+
+	# The same computations in different feature sets are performed once
+	cache = ComputationCache()
+	with computation_cache(cache):
+		generate_feature_set(df.copy(), feature_sets[0], last_rows=0)
+		generate_feature_set(df.copy(), feature_sets[2], last_rows=0)
+	assert cache.hits == 2  # Mean and slope with window 20
+
+	pass
+
+
+def test_generate_feature_sets_parallel():
+	rng = np.random.default_rng(1)
+	df = pd.DataFrame({"close": 100 + np.cumsum(rng.normal(size=300)), "volume": rng.uniform(1, 10, size=300)})
+	df["timestamp"] = pd.date_range("2020-01-01", periods=len(df), freq="min")
+
+	feature_sets = [
+		{"generator": "talib", "config": {"columns": "close", "functions": ["SMA"], "windows": [5, 20]}},
+		{"generator": "itbstats", "config": {"columns": "volume", "functions": ["mean", "std"], "windows": [10]}},
+		{"generator": "talib", "config": {"columns": "close_SMA_5", "functions": ["SMA"], "windows": [3]}},  # Depends on the first set
+		{"generator": "talib", "config": {"columns": "close", "functions": ["SMA"], "windows": [5, 20]}},  # Duplicate
+		{"generator": "itbstats", "config": {"columns": "close", "functions": ["slope"], "windows": [10]}},
+	]
+
+	df_ref, features_ref = generate_feature_sets(df.copy(), feature_sets)
+	df_out, features = generate_feature_sets(df.copy(), feature_sets, workers=2)
+
+	assert features == features_ref
+	pd.testing.assert_frame_equal(df_out, df_ref)
+
+	pass
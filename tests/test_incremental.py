@@ -0,0 +1,61 @@
+import pytest
+
+from common.utils import *
+from common.generators import generate_feature_sets
+from common.incremental import *
+
+
+def _generate(df, feature_sets, out_path):
+	"""The same steps as in the scripts: generate all or only new rows and store them in the output file."""
+	input_columns = df.columns.to_list()
+	rows = incremental_rows(df, feature_sets, out_path, "timestamp")
+	if rows is not None:
+		context_start, start, end = rows
+		df = df.iloc[context_start:].reset_index(drop=True)
+
+	df, _ = generate_feature_sets(df, feature_sets)
+
+	if rows is not None:
+		df = df.iloc[start - context_start:]
+		store_incremental(df, out_path, replace_rows=end - start, time_column="timestamp")
+	else:
+		df.to_csv(out_path, index=False, float_format="%.6f")
+	store_meta(df, feature_sets, input_columns, out_path, "timestamp")
+
+	return rows
+
+
+def test_incremental(tmp_path):
+	rng = np.random.default_rng(0)
+	length = 1_000
+	close = 100 + np.cumsum(rng.normal(size=length))
+	df = pd.DataFrame({
+		"timestamp": pd.date_range("2020-01-01", periods=length, freq="min"),
+		"close": close,
+		"high": close + rng.uniform(0, 1, size=length),
+		"low": close - rng.uniform(0, 1, size=length),
+	})
+	feature_sets = [
+		{"generator": "itbstats", "config": {"columns": "close", "functions": ["mean", "std", "slope"], "windows": [5, 30]}},
+		{"generator": "talib", "config": {"columns": "close", "functions": ["SMA"], "windows": [10]}},
+		{"generator": "itbstats", "config": {"columns": "close_SMA_10", "functions": ["mean"], "windows": [20]}},
+		{"generator": "highlow", "config": {"horizon": 20}},
+	]
+	assert feature_sets_context(feature_sets, df.columns) == (120, 20)  # SMA of talib is assumed to be EMA-like
+
+	out_path = tmp_path / "features.csv"
+	assert _generate(df.iloc[:700].copy(), feature_sets, out_path) is None  # No output yet
+	assert _generate(df.iloc[:900].copy(), feature_sets, out_path) == (560, 680, 700)
+	assert _generate(df.copy(), feature_sets, out_path) == (760, 880, 900)
+
+	ref_path = tmp_path / "features_ref.csv"
+	df_ref, _ = generate_feature_sets(df.copy(), feature_sets)
+	df_ref.to_csv(ref_path, index=False, float_format="%.6f")
+
+	pd.testing.assert_frame_equal(pd.read_csv(out_path), pd.read_csv(ref_path))
+
+	# Any change of the feature sets requires generating all rows
+	feature_sets[0]["config"]["windows"] = [5, 31]
+	assert incremental_rows(df, feature_sets, out_path, "timestamp") is None
+
+	pass
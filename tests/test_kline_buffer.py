@@ -0,0 +1,36 @@
+import pytest
+
+from common.utils import *
+from common.kline_buffer import *
+
+
+def _klines(start, end):
+	return [
+		[60_000 * i, f"{i + 0.5}", f"{i + 1.1}", f"{i + 0.1}", f"{i + 0.7}", "10.3", 60_000 * i + 59_999, "3.3", 7 + i, "1.2", "2.2", "0"]
+		for i in range(start, end)
+	]
+
+
+def test_kline_buffer():
+	buffer = KlineBuffer(5)
+
+	assert buffer.append_klines(_klines(0, 3)) == 0
+	assert buffer.append_klines(_klines(2, 8)) == 1  # One overlapping kline is overwritten
+
+	# Only the latest klines fitting into the capacity are stored
+	assert len(buffer) == 5
+	assert buffer.get_last_timestamp() == 7 * 60_000
+	assert buffer.is_regular(60_000)
+
+	df = buffer.to_df()
+	df_ref = binance_klines_to_df(_klines(3, 8))
+	pd.testing.assert_frame_equal(df.drop(columns="ignore"), df_ref.drop(columns="ignore"), check_index_type=False)
+
+	# Float columns are not copied
+	assert np.shares_memory(df["close"].values, buffer.column("close"))
+
+	# Gap in the time series
+	buffer.append_klines(_klines(9, 10))
+	assert not buffer.is_regular(60_000)
+
+	pass
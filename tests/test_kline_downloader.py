@@ -0,0 +1,78 @@
+import time
+import asyncio
+
+import pytest
+
+from common.utils import *
+from common.kline_downloader import *
+
+
+def _stub_app(interval_ms, requests, fail_from=None):
+	"""Local server returning synthetic klines like the klines endpoint of the exchange."""
+	from aiohttp import web
+
+	async def klines(request):
+		start, end, limit = (int(request.query[k]) for k in ("startTime", "endTime", "limit"))
+		requests.append(start)
+		if fail_from is not None and start >= fail_from:
+			return web.Response(status=400)
+		opens = range(start, min(end + 1, start + limit * interval_ms), interval_ms)
+		return web.json_response([[t, "1.0", "2.0", "0.5", "1.5", "10.0", t + interval_ms - 1, "15.0", 3, "5.0", "7.5", "0"] for t in opens])
+
+	app = web.Application()
+	app.router.add_get("/api/v3/klines", klines)
+	return app
+
+
+async def _download(tmp_path, requests, fail_from=None):
+	from aiohttp import web
+
+	runner = web.AppRunner(_stub_app(60_000, requests, fail_from))
+	await runner.setup()
+	site = web.TCPSite(runner, "127.0.0.1", 0)
+	await site.start()
+	port = site._server.sockets[0].getsockname()[1]
+	try:
+		return await download_klines(
+			f"http://127.0.0.1:{port}/api/v3/klines", "BTCUSDT", "1m", 60_000,
+			start_ms=0, end_ms=60_000 * 2_500, checkpoint_path=tmp_path / "chunks", limit=1000,
+		)
+	finally:
+		await runner.cleanup()
+
+
+def test_download_klines(tmp_path):
+	pytest.importorskip("aiohttp")
+
+	# The download fails for the last chunk but the previous chunks are stored
+	requests = []
+	with pytest.raises(Exception):
+		asyncio.run(_download(tmp_path, requests, fail_from=2_000 * 60_000))
+	assert len(list((tmp_path / "chunks").glob("*.json"))) == 2
+
+	# Only the missing chunk is downloaded when the download is repeated
+	requests = []
+	klines = asyncio.run(_download(tmp_path, requests))
+	assert requests == [2_000 * 60_000]
+
+	assert [k[0] for k in klines] == list(range(0, 60_000 * 2_500, 60_000))
+	df = klines_to_df(klines, None)
+	assert len(df) == 2_500
+
+	remove_checkpoints(tmp_path / "chunks")
+	assert not (tmp_path / "chunks").exists()
+
+	pass
+
+
+def test_token_bucket():
+	async def run():
+		bucket = TokenBucket(600)  # 10 weight per second
+		await bucket.acquire(600)
+		start = time.monotonic()
+		await bucket.acquire(2)
+		return time.monotonic() - start
+
+	assert 0.15 < asyncio.run(run()) < 1.0
+
+	pass
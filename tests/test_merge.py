@@ -0,0 +1,39 @@
+import pytest
+
+from common.utils import *
+from common.kline_buffer import *
+from scripts.merge import *
+from scripts.merge import _join_data_sources
+
+
+def _data_sources():
+	times = pd.date_range("2024-01-01", periods=50, freq="1min")
+	btc = pd.DataFrame({"timestamp": times, "close": np.arange(50.0), "trades": np.arange(50), "close_time": times + pd.Timedelta("59s")})
+
+	times = pd.date_range("2024-01-01 00:05", periods=60, freq="1min").delete([3, 10])  # Gaps
+	eth = pd.DataFrame({"timestamp": times, "close": np.arange(58.0), "trades": np.arange(58), "flag": np.arange(58) % 2 == 0})
+
+	return [{"df": btc, "column_prefix": ""}, {"df": eth, "column_prefix": "eth"}]
+
+
+def test_merge_data_sources():
+	App.config["time_column"] = "timestamp"
+	App.config["freq"] = "1min"
+
+	df = merge_data_sources(_data_sources())
+	df_ref = _join_data_sources(_data_sources())
+
+	assert df.columns.to_list() == ["close", "trades", "close_time", "eth_close", "eth_trades", "eth_flag"]
+	pd.testing.assert_frame_equal(df, df_ref, check_freq=False)
+
+	# Online sources are kline buffers
+	buffer = KlineBuffer(10)
+	buffer.append_klines([
+		[60_000 * i, f"{i + 0.5}", f"{i + 1.1}", f"{i + 0.1}", f"{i + 0.7}", "10.3", 60_000 * i + 59_999, "3.3", 7 + i, "1.2", "2.2", "0"]
+		for i in range(20)
+	])
+	df = merge_data_sources([{"buffer": buffer, "column_prefix": "btc"}])
+	df_ref = _join_data_sources([{"df": buffer.to_df(), "column_prefix": "btc"}])
+	pd.testing.assert_frame_equal(df, df_ref, check_freq=False)
+
+	pass
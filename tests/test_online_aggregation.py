@@ -0,0 +1,64 @@
+import pytest
+
+from common.utils import *
+from common.gen_features_rolling_agg import *
+
+
+def _features(df, last_rows):
+	features = []
+	features += add_past_aggregations(df, 'close', np.nanmean, [3, 10], last_rows=last_rows)
+	features += add_past_aggregations(df, 'close', np.nanstd, [3, 10], last_rows=last_rows)
+	features += add_past_weighted_aggregations(df, 'close', 'volume', np.nanmean, [4, 10], last_rows=last_rows)
+	features += add_area_ratio(df, is_future=False, column_name='close', windows=[5], last_rows=last_rows)
+	features += add_linear_trends(df, is_future=False, column_name='close', windows=[2, 10], last_rows=last_rows)
+	return features
+
+
+def test_online_aggregation():
+	length, last_rows = 30, 4
+	rng = np.random.default_rng(0)
+	close = 100 + np.cumsum(rng.normal(size=200))
+	close[[40, 41, 90]] = np.nan
+	volume = rng.uniform(1, 10, size=200)
+
+	engine = OnlineFeatureEngine(resync_period=50)
+	for end in list(range(length, 120)) + list(range(100, 200)):  # History is rewritten in the middle
+		df = pd.DataFrame({'close': close[end-length:end], 'volume': volume[end-length:end]}, index=pd.RangeIndex(end-length, end))
+		if end == 150:
+			df.loc[end-2, 'close'] = 0.0  # Changed value in the existing history
+
+		df_ref = df.copy()
+		features = _features(df_ref, last_rows)
+
+		with online_aggregation(engine):
+			assert _features(df, last_rows) == features
+
+		pd.testing.assert_frame_equal(df[features], df_ref[features], rtol=1e-9)
+
+	pass
+
+
+def test_online_talib():
+	from common.generators import generate_feature_set
+
+	length, last_rows = 200, 3
+	rng = np.random.default_rng(1)
+	close = 100 + np.cumsum(rng.normal(size=300))
+	index = pd.date_range('2020-01-01', periods=len(close), freq='min')
+	fs = {"generator": "talib", "config": {"columns": "close", "functions": ["SMA", "EMA", "DEMA", "TEMA", "RSI"], "windows": [3, 10]}}
+
+	engine = OnlineFeatureEngine()
+	for end in range(length, len(close)):
+		df = pd.DataFrame({'close': close[end-length:end]}, index=index[end-length:end])
+
+		df_ref, features = generate_feature_set(df.copy(), fs, last_rows=last_rows)
+		with online_aggregation(engine):
+			df, _ = generate_feature_set(df, fs, last_rows=last_rows)
+
+		pd.testing.assert_frame_equal(df[features].iloc[-last_rows:], df_ref[features].iloc[-last_rows:], rtol=1e-6)
+
+	# All online computations passed the parity check and the EMA-like functions have persistent state
+	assert all(engine.checks.values())
+	assert engine.states[(None, 'talib_close_TEMA_10')].ticks > 0
+
+	pass
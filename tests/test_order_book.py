@@ -0,0 +1,166 @@
+import json
+
+import pytest
+
+from common.utils import *
+from common.depth_processing import *
+from common.order_book import *
+
+
+def _events(rng, first_id, count):
+	"""Random diff-depth events and the final state of the book as dicts of price levels."""
+	bids = {round(100.0 - 0.1 * k, 1): 1.0 for k in range(1, 50)}
+	asks = {round(100.0 + 0.1 * k, 1): 1.0 for k in range(1, 50)}
+	snapshot = {"lastUpdateId": first_id - 1, "bids": [[str(p), str(v)] for p, v in bids.items()], "asks": [[str(p), str(v)] for p, v in asks.items()]}
+
+	events = []
+	update_id = first_id
+	for i in range(count):
+		event = {"e": "depthUpdate", "E": 1_000 * i, "s": "BTCUSDT", "U": update_id, "u": update_id + 2, "b": [], "a": []}
+		for side, levels, sign in (("b", bids, -1), ("a", asks, 1)):
+			for price in np.round(100.0 + sign * 0.1 * rng.integers(1, 60, size=3), 1):
+				volume = float(rng.choice([0.0, 0.5, 2.0]))
+				event[side].append([f"{price:.8f}", f"{volume:.8f}"])
+				if volume:
+					levels[price] = volume
+				else:
+					levels.pop(price, None)
+		events.append(event)
+		update_id += 3
+
+	return snapshot, events, bids, asks
+
+
+def test_order_book_replay(tmp_path):
+	rng = np.random.default_rng(0)
+	snapshot, events, bids, asks = _events(rng, 100, 200)
+
+	path = tmp_path / "depthUpdate-BTCUSDT-202401.txt"
+	with open(path, "w") as f:
+		f.write("\n".join(json.dumps(e) for e in events) + "\n")
+
+	# Events received before the snapshot are buffered, and events older than the snapshot are dropped
+	book = OrderBook("BTCUSDT")
+	replayed = list(read_events(path))
+	for event in replayed[:10]:
+		assert not book.update(event)
+	snapshot_5 = OrderBook()
+	snapshot_5.apply_snapshot(snapshot)
+	for event in replayed[:5]:
+		snapshot_5.update(event)
+	assert book.apply_snapshot({"lastUpdateId": snapshot_5.last_update_id, "bids": snapshot_5.bids(), "asks": snapshot_5.asks()})
+	for event in replayed[10:]:
+		assert book.update(event)
+
+	bid_levels = sorted(bids.items(), reverse=True)
+	ask_levels = sorted(asks.items())
+	np.testing.assert_array_equal(book.bids(), bid_levels)
+	np.testing.assert_array_equal(book.asks(), ask_levels)
+
+	# Queries are the same as for the full list of levels
+	assert book.price_to_volume("buy", ask_levels[2][0]) == pytest.approx(sum(v for p, v in ask_levels[:3]))
+	assert book.price_to_volume("sell", bid_levels[0][0] + 1) == 0.0
+	volumes = np.cumsum([v for p, v in bid_levels])
+	assert book.volume_to_price("sell", volumes[4]) == bid_levels[4][0]
+	assert book.volume_to_price("sell", volumes[4] + 0.1) == bid_levels[5][0]
+	assert book.volume_to_price("buy", 1e6) is None
+
+	entry = {"timestamp": events[-1]["E"], "bids": [list(l) for l in bid_levels], "asks": [list(l) for l in ask_levels]}
+	assert book.features([1, 2, 3], 0.5) == pytest.approx(depth_to_features(entry, [1, 2, 3], 0.5))
+
+	pass
+
+
+def test_order_book_resync():
+	rng = np.random.default_rng(1)
+	snapshot, events, bids, asks = _events(rng, 100, 10)
+
+	book = OrderBook()
+	assert book.apply_snapshot(snapshot)
+	assert book.update(events[0])
+
+	# Lost event breaks the sequence of update ids
+	assert not book.update(events[2])
+	assert not book.synced
+
+	# Snapshot which is older than the buffered events is rejected
+	assert not book.apply_snapshot(snapshot)
+	assert not book.synced
+
+	pass
+
+
+def test_order_book_first_event():
+	# All buffered events are older than the snapshot, so the next event is the first one and contains the snapshot id
+	book = OrderBook()
+	assert not book.update({"U": 90, "u": 95, "b": [], "a": []})
+	assert book.apply_snapshot({"lastUpdateId": 100, "bids": [["99.0", "1.0"]], "asks": [["101.0", "1.0"]]})
+	assert book.update({"U": 98, "u": 105, "b": [["99.5", "2.0"]], "a": []})
+	assert book.synced and book.best_bid() == 99.5
+
+	# Next events have to continue it
+	assert book.update({"U": 106, "u": 107, "b": [], "a": []})
+	assert not book.update({"U": 109, "u": 110, "b": [], "a": []})
+	assert not book.synced
+
+	pass
+
+
+def test_order_book_merge():
+	from common.order_book import _merge
+
+	# Levels are inserted into an empty side, and a later update of the same price in an event replaces an earlier one
+	prices, volumes = _merge(np.empty(0), np.empty(0), [["2.0", "1.0"], ["1.0", "1.0"], ["2.0", "3.0"], ["3.0", "0.0"]])
+	np.testing.assert_array_equal(prices, [1.0, 2.0])
+	np.testing.assert_array_equal(volumes, [1.0, 3.0])
+
+	# Volumes are overwritten, levels are removed and inserted at both ends
+	prices, volumes = _merge(prices, volumes, [["0.5", "4.0"], ["1.0", "0.0"], ["2.0", "5.0"], ["2.5", "0.0"], ["4.0", "6.0"]])
+	np.testing.assert_array_equal(prices, [0.5, 2.0, 4.0])
+	np.testing.assert_array_equal(volumes, [4.0, 5.0, 6.0])
+
+	pass
+
+
+class _Client:
+	def get_order_book(self, symbol, limit):
+		return {"lastUpdateId": 101, "bids": [["99.8", "2.0"]], "asks": [["100.1", "1.0"]]}
+
+
+def test_process_depth_message(tmp_path):
+	pytest.importorskip("binance.websockets")
+	from collectors import collector_ws
+	from common.event_writer import EventWriter
+	from service.App import App
+
+	App.event_writer = EventWriter(tmp_path)
+	App.order_books = {}
+	App.client = _Client()
+
+	# Stream name has the update speed as a part of the channel
+	event = {"e": "depthUpdate", "E": 1_000, "s": "BTCUSDT", "U": 100, "u": 102, "b": [["99.9", "1.0"]], "a": []}
+	collector_ws.process_message({"stream": "btcusdt@depth@100ms", "data": event})
+	assert App.event_writer.queue.get_nowait() is event
+	book = App.order_books["BTCUSDT"]
+	assert book.buffer[0] is event
+
+	# Snapshot requested in a worker thread is applied with the next event
+	collector_ws.snapshot_requests["BTCUSDT"].result()
+	event = {"e": "depthUpdate", "E": 1_100, "s": "BTCUSDT", "U": 103, "u": 105, "b": [], "a": [["100.1", "0"]]}
+	collector_ws.process_message({"stream": "btcusdt@depth@100ms", "data": event})
+	assert book.synced and book.last_update_id == 105
+	np.testing.assert_array_equal(book.bids(), [[99.9, 1.0], [99.8, 2.0]])
+	assert len(book.asks()) == 0
+
+	# Stale event does not request a new snapshot
+	collector_ws.snapshot_times.clear()  # Not throttled
+	event = {"e": "depthUpdate", "E": 1_200, "s": "BTCUSDT", "U": 90, "u": 92, "b": [], "a": []}
+	collector_ws.process_message({"stream": "btcusdt@depth@100ms", "data": event})
+	assert book.synced and "BTCUSDT" not in collector_ws.snapshot_requests
+
+	# Channel and symbol of events without them are taken from the stream name
+	event = {"lastUpdateId": 5, "bids": [], "asks": []}
+	collector_ws.process_message({"stream": "btcusdt@depth20@100ms", "data": event})
+	assert event["e"] == "depth20@100ms" and event["s"] == "BTCUSDT"
+
+	pass
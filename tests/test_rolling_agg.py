@@ -0,0 +1,93 @@
+import pytest
+
+from common.utils import *
+from common.gen_features_rolling_agg import *
+from common.gen_features_rolling_agg import _rolling_aggregate, _aggregate_last_rows_windows
+
+
+def _column(length=300, nans=True):
+	rng = np.random.default_rng(0)
+	column = pd.Series(100 + np.cumsum(rng.normal(size=length)))
+	if nans:
+		nan_rows = [0, 1, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59, 200]
+		column.iloc[[i for i in nan_rows if i < length]] = np.nan
+	return column
+
+
+@pytest.mark.parametrize("fn", [np.nanmean, np.nanstd, np.nansum, np.nanmin, np.nanmax])
+def test_rolling_kernels(fn):
+	column = _column()
+	for w in [1, 2, 5, 12]:
+		reference = column.rolling(window=w, min_periods=max(1, w // 2)).apply(fn, raw=True)
+		pd.testing.assert_series_equal(_rolling_aggregate(column, w, fn), reference, rtol=1e-9)
+
+	pass
+
+
+def test_rolling_kernels_no_nan():
+	# Functions propagating NaNs are computed natively only if there are no NaNs
+	column = _column(nans=False)
+	for fn in [np.mean, np.std, np.sum, np.min, np.max]:
+		reference = column.rolling(window=7, min_periods=3).apply(fn, raw=True)
+		pd.testing.assert_series_equal(_rolling_aggregate(column, 7, fn), reference, rtol=1e-9)
+
+	pass
+
+
+def test_rolling_slopes():
+	column = _column()
+	windows = [2, 3, 10, 60]
+	slopes = rolling_slopes(column, windows, block_rows=64)  # Several blocks
+	for w, slope in zip(windows, slopes):
+		reference = column.rolling(window=w, min_periods=max(1, w // 2)).apply(slope_fn, raw=True)
+		pd.testing.assert_series_equal(slope, reference, rtol=1e-7, atol=1e-9)
+
+	pass
+
+
+@pytest.mark.parametrize("is_future", [False, True])
+def test_rolling_area_ratios(is_future):
+	column = _column()
+	windows = [2, 5, 10, 60]
+	ratios = rolling_area_ratios(column, windows, is_future)
+	for w, ratio in zip(windows, ratios):
+		reference = column.rolling(window=w, min_periods=max(1, w // 2)).apply(area_fn, kwargs=dict(is_future=is_future), raw=True)
+		pd.testing.assert_series_equal(ratio, reference, rtol=1e-9, atol=1e-12)
+
+	pass
+
+
+@pytest.mark.parametrize("fn, args", [
+	(np.nanmean, ()), (np.nanstd, ()), (np.nansum, ()), (np.nanmax, ()), (np.mean, ()), (np.max, ()),
+	(slope_fn, ()), (area_fn, (False,)), (area_fn, (True,)), (lsbm_fn, ()),
+])
+def test_aggregate_last_rows_windows(fn, args):
+	windows = [2, 5, 12]
+	last_rows = 6
+	for length in [8, 70]:  # Short column has shorter windows for the oldest rows
+		column = _column(length)
+		outs = _aggregate_last_rows_windows(column, windows, last_rows, fn, *args)
+		for w, out in zip(windows, outs):
+			values = [fn(column.iloc[-w - r:length - r].to_numpy(), *args) for r in range(last_rows)]
+			reference = pd.Series(data=np.nan, index=column.index, dtype=float)
+			reference.iloc[-last_rows:] = list(reversed(values))
+			pd.testing.assert_series_equal(out, reference, rtol=1e-9, atol=1e-12)
+
+	pass
+
+
+@pytest.mark.parametrize("fn, args", [
+	(stats.skew, (0, False)), (stats.skew, (0, True)), (stats.kurtosis, (0, False)), (stats.kurtosis, (0, True)),
+	(pandas_skew_fn, ()), (pandas_kurtosis_fn, ()), (lsbm_fn, ()), (fmax_fn, ()), (msdc_fn, ()),
+])
+def test_rolling_stats(fn, args):
+	column = _column()
+	column.iloc[100:110] = 101.5  # Constant values
+	for w in [2, 3, 4, 10, 60]:
+		reference = column.rolling(window=w, min_periods=max(1, w // 2)).apply(fn, args=args, raw=True)
+		pd.testing.assert_series_equal(_rolling_aggregate(column, w, fn, *args), reference, rtol=1e-6, atol=1e-9)
+
+		outs = _aggregate_last_rows_windows(column, [w], 20, fn, *args)
+		pd.testing.assert_series_equal(outs[0].iloc[-20:], reference.iloc[-20:], rtol=1e-6, atol=1e-9)
+
+	pass
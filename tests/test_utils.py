@@ -3,6 +3,7 @@ import numpy.testing as npt
 
 from common.utils import *
 from common.utils import add_area_ratio
+from common.depth_processing import *
 from common.gen_signals import *
 
 
@@ -129,6 +130,11 @@ def test_depth_density():
 
 	bins = discretize("ask", depth=depth, bin_size=2.0, start=0.0)
 
+	assert bins == [0.5, 1.0, 1.5]
+
+	# Densities for several windows (number of bins)
+	assert list(window_densities(bins, [1, 2, 5])) == [0.5, 0.75, 1.0]
+
 	pass
 
 